@@ -129,6 +129,7 @@ def process_absent_penalties(
             user_id=user.id,
             amount=-penalty_amount,
             reason=f"Absent penalty ({target_date.isoformat()})",
+            log_type="penalty",
             created_by="System"
         )
         db.add(log)
@@ -22,6 +22,7 @@ import logging
 logger = logging.getLogger("hr-api")
 
 from app.services.notifications import find_step_approvers, notify_approvers
+from app.services import checkin_cache
 
 router = APIRouter(prefix="/api/attendance", tags=["Attendance"])
 
@@ -144,14 +145,18 @@ def check_in(
     day_start_utc = datetime.combine(today_local, datetime.min.time()) - timedelta(hours=7)
     day_end_utc = datetime.combine(today_local, datetime.max.time()) - timedelta(hours=7)
     
+    if checkin_cache.contains(current_user.id):
+        raise HTTPException(status_code=400, detail="You have already checked in today.")
+
     existing = db.query(Attendance).filter(
         Attendance.user_id == current_user.id,
         Attendance.timestamp >= day_start_utc,
         Attendance.timestamp <= day_end_utc,
-        Attendance.status.in_(["present", "late", "absent"])
+        Attendance.status.in_(checkin_cache.CHECKIN_STATUSES)
     ).first()
     
     if existing:
+        checkin_cache.mark(current_user.id)
         raise HTTPException(status_code=400, detail="You have already checked in today.")
     
     # 3. Resolve check-in location (branch → user default → company fallback)
@@ -344,11 +349,13 @@ def check_in(
             user_id=current_user.id,
             amount=coin_change,
             reason=coin_reason,
+            log_type="check_in",
             created_by="System"
         )
         db.add(log)
 
     db.commit()
+    checkin_cache.mark(current_user.id)
     return {
         "message": "Check-in successful", 
         "distance": int(distance), 
@@ -402,6 +409,9 @@ def face_check_in(req: FaceCheckInRequest, db: Session = Depends(get_db)):
     day_start_utc = datetime.combine(today_local, datetime.min.time()) - timedelta(hours=7)
     day_end_utc = datetime.combine(today_local, datetime.max.time()) - timedelta(hours=7)
 
+    if checkin_cache.contains(req.user_id):
+        return {"message": "Already checked in today", "skipped": True}
+
     existing = db.query(Attendance).filter(
         Attendance.user_id == req.user_id,
         Attendance.timestamp >= day_start_utc,
@@ -503,11 +513,14 @@ def face_check_in(req: FaceCheckInRequest, db: Session = Depends(get_db)):
                 user_id=req.user_id,
                 amount=coin_change,
                 reason=coin_reason,
+                log_type="check_in",
                 created_by="Face Recognition"
             )
             db.add(log)
 
     db.commit()
+    if status in checkin_cache.CHECKIN_STATUSES:
+        checkin_cache.mark(req.user_id)
     logger.info(f"📸 Face check-in: {user.name} {user.surname} — {status} (confidence: {req.confidence:.3f})")
     return {
         "message": "Face check-in successful",
@@ -5,23 +5,26 @@ import logging
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
 from app.models.user import User, UserRole
 from app.models.badge import Badge, UserBadge
-from app.models.badge_quest import BadgeQuest
+from app.models.badge_quest import BadgeQuest, BadgeQuestDirty
 from app.api import deps
 from app.services.badge_quest_evaluator import (
     CONDITION_LABELS, FIELD_DESCRIPTIONS, FIELD_RESOLVERS,
-    evaluate_query, validate_query,
-    resolve_user_fields,
+    validate_query, compile_query, effective_query,
+    resolve_user_fields, resolve_fields_for_users, evaluate_query_bulk,
 )
 
 logger = logging.getLogger("hr-api")
 
 router = APIRouter(prefix="/api/badge-quests", tags=["Badge Quests"])
 
+EVALUATION_LOCK_ID = 0x42515545  # "BQUE" — pg advisory lock key
+
 
 # ── Schemas ───────────────────────────────────────────
 
@@ -255,20 +258,18 @@ def preview_query(
         raise HTTPException(status_code=400, detail=f"Invalid query: {v['error']}")
 
     users = db.query(User).all()
+    users_by_id = {u.id: u for u in users}
+    values = {}
     matches = []
-    for user in users:
-        try:
-            if evaluate_query(user.id, body.query, db):
-                user_name = f"{user.name} {user.surname or ''}".strip()
-                values = resolve_user_fields(user.id, body.query, db)
-                matches.append({
-                    "user_id": user.id,
-                    "user_name": user_name,
-                    "user_image": user.image,
-                    "field_values": values,
-                })
-        except Exception as e:
-            logger.error(f"Preview error for user {user.id}: {e}")
+    for uid in evaluate_query_bulk(body.query, users_by_id, db, values):
+        user = users_by_id[uid]
+        user_name = f"{user.name} {user.surname or ''}".strip()
+        matches.append({
+            "user_id": user.id,
+            "user_name": user_name,
+            "user_image": user.image,
+            "field_values": {field: per_user.get(uid, 0) for field, per_user in values.items()},
+        })
 
     return {
         "query": body.query,
@@ -290,18 +291,122 @@ def evaluate_all_quests(
     return _run_evaluation(db)
 
 
-def _run_evaluation(db: Session):
-    """Core evaluation logic, used by both API and scheduler."""
+def _lock_evaluation(db: Session, wait: bool = True) -> bool:
+    """
+    Take the transaction-level advisory lock that serializes evaluation runs
+    across API workers (released on commit/rollback). Awards are read and
+    written under it, so two runs never both see a (user, quest) as unawarded.
+    With wait=False, returns False instead of blocking when another run holds it.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return True  # no advisory locks — single-process dev setup
+    if wait:
+        db.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": EVALUATION_LOCK_ID})
+        return True
+    return bool(db.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": EVALUATION_LOCK_ID}).scalar())
+
+
+def _insert_badge_award(db: Session, user_id: int, badge_id: int) -> bool:
+    """
+    Award a badge unless the user already holds it (unique user_id + badge_id).
+    Returns whether a row was inserted. A Core insert skips the flush hooks, so
+    the badges_count mark the tracker would have written is added here.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    result = db.execute(
+        insert(UserBadge.__table__)
+        .values(user_id=user_id, badge_id=badge_id, awarded_by="Badge Quest")
+        .on_conflict_do_nothing(index_elements=["user_id", "badge_id"])
+    )
+    if not result.rowcount:
+        return False
+    db.execute(BadgeQuestDirty.__table__.insert().values(user_id=user_id, field="badges_count"))
+    return True
+
+
+def _run_evaluation(db: Session, dirty: dict = None):
+    """
+    Core evaluation logic, used by both API and scheduler.
+
+    Set-based: every field referenced by an active quest is resolved for all
+    users in one query, and existing awards are loaded up front, so the cost
+    is roughly one query per distinct field instead of one per (quest, user).
+    Rewards granted in this run show up in field values on the next run.
+
+    `dirty` ({user_id: {field, ...}}, key None = every user) limits the run
+    to quests reading a dirty field and to the users it is dirty for.
+    """
     from app.models.reward import CoinLog, Redemption
+    _lock_evaluation(db)
     active_quests = db.query(BadgeQuest).filter(BadgeQuest.is_active == True).all()
-    logger.info(f"🎯 Badge Quest eval: {len(active_quests)} active quest(s)")
+    if dirty is None:
+        logger.info(f"🎯 Badge Quest eval: {len(active_quests)} active quest(s)")
     if not active_quests:
         return {"awarded": 0, "details": []}
 
-    users = db.query(User).all()
-    logger.info(f"🎯 Evaluating {len(users)} user(s)")
+    # Compile every quest once
+    compiled = {}
+    for quest in active_quests:
+        query = effective_query(quest)
+        if not query:
+            continue
+        try:
+            compiled[quest.id] = compile_query(query, db)
+        except ValueError as e:
+            logger.error(f"Query eval error quest={quest.id}: {e}")
+
+    # Candidate users per quest (None = everyone), then the users each field is needed for
+    candidates = {}
+    for quest_id, query in compiled.items():
+        fields = set(query.fields)
+        if dirty is None or fields & dirty.get(None, set()):
+            candidates[quest_id] = None
+        else:
+            uids = {uid for uid, dirty_fields in dirty.items() if uid is not None and fields & dirty_fields}
+            if uids:
+                candidates[quest_id] = uids
+    if not candidates:
+        return {"awarded": 0, "details": []}
+    needed = {}
+    for quest_id, uids in candidates.items():
+        for field in compiled[quest_id].fields:
+            if uids is None or needed.get(field, set()) is None:
+                needed[field] = None
+            else:
+                needed[field] = needed.get(field, set()) | uids
+
+    everyone = any(uids is None for uids in candidates.values())
+    if everyone:
+        users = db.query(User).all()
+    else:
+        users = db.query(User).filter(User.id.in_(set().union(*candidates.values()))).all()
+    if dirty is None:
+        logger.info(f"🎯 Evaluating {len(users)} user(s)")
+    users_by_id = {u.id: u for u in users}
     awarded_list = []
 
+    values = {}
+    for field, uids in needed.items():
+        values.update(resolve_fields_for_users([field], uids, db))
+
+    # Existing awards: holders per badge, and per-quest reward markers
+    markers = {f"🎯 Quest #{q.id} reward": q.id for q in active_quests}
+    badge_holders, badge_award_counts = {}, {}
+    for uid, badge_id in db.query(UserBadge.user_id, UserBadge.badge_id).filter(
+        UserBadge.badge_id.in_({q.badge_id for q in active_quests if q.badge_id})
+    ).all():
+        badge_holders.setdefault(badge_id, set()).add(uid)
+        badge_award_counts[badge_id] = badge_award_counts.get(badge_id, 0) + 1
+    quest_holders, quest_award_counts = {}, {}
+    for uid, reason in db.query(CoinLog.user_id, CoinLog.reason).filter(
+        CoinLog.log_type == "quest_reward", CoinLog.reason.in_(list(markers))
+    ).all():
+        quest_holders.setdefault(markers[reason], set()).add(uid)
+        quest_award_counts[markers[reason]] = quest_award_counts.get(markers[reason], 0) + 1
+
     for quest in active_quests:
         reward_type = quest.reward_type or "badge"
         reward_value = quest.reward_value or 0
@@ -312,104 +417,117 @@ def _run_evaluation(db: Session):
             badge = db.query(Badge).filter(Badge.id == quest.badge_id).first()
             if not badge:
                 continue
+            holders = badge_holders.setdefault(quest.badge_id, set())
+            award_counts, count_key = badge_award_counts, quest.badge_id
+        else:
+            holders = quest_holders.setdefault(quest.id, set())
+            award_counts, count_key = quest_award_counts, quest.id
+
+        if quest.id not in candidates:
+            continue
+        query = compiled[quest.id]
+        uids = candidates[quest.id]
+        query_display = query.source
+        matched = query.evaluate_bulk(
+            [uid for uid in (users_by_id if uids is None else uids) if uid in users_by_id and uid not in holders],
+            values,
+        )
 
-        for user in users:
-            # Skip if already awarded
+        for uid in matched:
+            user = users_by_id[uid]
+            user_name = f"{user.name} {user.surname or ''}".strip()
+            # Check max_awards limit
+            if quest.max_awards is not None and award_counts.get(count_key, 0) >= quest.max_awards:
+                quest.is_active = False
+                logger.info(f"🔒 Quest {quest.id} auto-disabled: limit reached")
+                break
+
+            # Grant reward
+            reward_label = ""
             if reward_type == "badge":
-                existing = db.query(UserBadge).filter(
-                    UserBadge.user_id == user.id,
-                    UserBadge.badge_id == quest.badge_id,
-                ).first()
-                if existing:
-                    continue
-            else:
-                # For non-badge rewards, check CoinLog for quest award marker
-                existing = db.query(CoinLog).filter(
-                    CoinLog.user_id == user.id,
-                    CoinLog.reason == f"🎯 Quest #{quest.id} reward",
-                ).first()
-                if existing:
+                if not _insert_badge_award(db, user.id, quest.badge_id):
+                    holders.add(uid)  # awarded elsewhere (e.g. manually) since holders were loaded
                     continue
+                reward_label = f"Badge: {badge.name}"
+            elif reward_type == "gold":
+                user.coins = (user.coins or 0) + reward_value
+                db.add(CoinLog(user_id=user.id, amount=reward_value, reason=f"🎯 Quest #{quest.id} reward", log_type="quest_reward", created_by="Badge Quest"))
+                reward_label = f"+{reward_value} Gold"
+            elif reward_type == "mana":
+                user.angel_coins = (user.angel_coins or 0) + reward_value
+                db.add(CoinLog(user_id=user.id, amount=0, reason=f"🎯 Quest #{quest.id} reward", log_type="quest_reward", created_by="Badge Quest"))
+                reward_label = f"+{reward_value} Mana"
+            elif reward_type == "str":
+                user.base_str = (user.base_str or 0) + reward_value
+                db.add(CoinLog(user_id=user.id, amount=0, reason=f"🎯 Quest #{quest.id} reward", log_type="quest_reward", created_by="Badge Quest"))
+                reward_label = f"+{reward_value} STR"
+            elif reward_type == "def":
+                user.base_def = (user.base_def or 0) + reward_value
+                db.add(CoinLog(user_id=user.id, amount=0, reason=f"🎯 Quest #{quest.id} reward", log_type="quest_reward", created_by="Badge Quest"))
+                reward_label = f"+{reward_value} DEF"
+            elif reward_type == "luk":
+                user.base_luk = (user.base_luk or 0) + reward_value
+                db.add(CoinLog(user_id=user.id, amount=0, reason=f"🎯 Quest #{quest.id} reward", log_type="quest_reward", created_by="Badge Quest"))
+                reward_label = f"+{reward_value} LUK"
+            elif reward_type == "coupon":
+                from app.models.reward import Reward
+                reward_item = db.query(Reward).filter(Reward.id == reward_value).first()
+                if reward_item:
+                    redemption = Redemption(user_id=user.id, reward_id=reward_value, status="approved")
+                    db.add(redemption)
+                    db.add(CoinLog(user_id=user.id, amount=0, reason=f"🎯 Quest #{quest.id} reward", log_type="quest_reward", created_by="Badge Quest"))
+                    reward_label = f"Coupon: {reward_item.name}"
+                else:
+                    reward_label = f"Coupon (item {reward_value} not found)"
+
+            holders.add(uid)
+            award_counts[count_key] = award_counts.get(count_key, 0) + 1
+            awarded_list.append({
+                "user_id": user.id,
+                "user_name": user_name,
+                "reward": reward_label,
+                "query": query_display,
+            })
+            logger.info(f"🏅 Quest #{quest.id} → {user_name}: {reward_label}")
 
-            # Evaluate: prefer query, fallback to legacy (auto-convert to query)
-            met = False
-            effective_query = quest.condition_query
-            if not effective_query and quest.condition_type:
-                effective_query = f"{quest.condition_type} >= {quest.threshold or 1}"
-            if effective_query:
-                try:
-                    met = evaluate_query(user.id, effective_query, db)
-                except Exception as e:
-                    logger.error(f"Query eval error quest={quest.id} user={user.id}: {e}")
+    db.commit()
+    return {"awarded": len(awarded_list), "details": awarded_list}
 
-            user_name = f"{user.name} {user.surname or ''}".strip()
-            query_display = effective_query or "(no condition)"
-
-            if met:
-                # Check max_awards limit
-                if quest.max_awards is not None:
-                    from sqlalchemy import func as sqlfunc
-                    if reward_type == "badge":
-                        count = db.query(sqlfunc.count(UserBadge.id)).filter(
-                            UserBadge.badge_id == quest.badge_id
-                        ).scalar() or 0
-                    else:
-                        count = db.query(sqlfunc.count(CoinLog.id)).filter(
-                            CoinLog.reason == f"🎯 Quest #{quest.id} reward",
-                        ).scalar() or 0
-                    if count >= quest.max_awards:
-                        quest.is_active = False
-                        logger.info(f"🔒 Quest {quest.id} auto-disabled: limit reached")
-                        break
-
-                # Grant reward
-                reward_label = ""
-                if reward_type == "badge":
-                    ub = UserBadge(user_id=user.id, badge_id=quest.badge_id, awarded_by="Badge Quest")
-                    db.add(ub)
-                    reward_label = f"Badge: {badge.name}"
-                elif reward_type == "gold":
-                    user.coins = (user.coins or 0) + reward_value
-                    db.add(CoinLog(user_id=user.id, amount=reward_value, reason=f"🎯 Quest #{quest.id} reward", created_by="Badge Quest"))
-                    reward_label = f"+{reward_value} Gold"
-                elif reward_type == "mana":
-                    user.angel_coins = (user.angel_coins or 0) + reward_value
-                    db.add(CoinLog(user_id=user.id, amount=0, reason=f"🎯 Quest #{quest.id} reward", created_by="Badge Quest"))
-                    reward_label = f"+{reward_value} Mana"
-                elif reward_type == "str":
-                    user.base_str = (user.base_str or 0) + reward_value
-                    db.add(CoinLog(user_id=user.id, amount=0, reason=f"🎯 Quest #{quest.id} reward", created_by="Badge Quest"))
-                    reward_label = f"+{reward_value} STR"
-                elif reward_type == "def":
-                    user.base_def = (user.base_def or 0) + reward_value
-                    db.add(CoinLog(user_id=user.id, amount=0, reason=f"🎯 Quest #{quest.id} reward", created_by="Badge Quest"))
-                    reward_label = f"+{reward_value} DEF"
-                elif reward_type == "luk":
-                    user.base_luk = (user.base_luk or 0) + reward_value
-                    db.add(CoinLog(user_id=user.id, amount=0, reason=f"🎯 Quest #{quest.id} reward", created_by="Badge Quest"))
-                    reward_label = f"+{reward_value} LUK"
-                elif reward_type == "coupon":
-                    from app.models.reward import Reward
-                    reward_item = db.query(Reward).filter(Reward.id == reward_value).first()
-                    if reward_item:
-                        redemption = Redemption(user_id=user.id, reward_id=reward_value, status="approved")
-                        db.add(redemption)
-                        db.add(CoinLog(user_id=user.id, amount=0, reason=f"🎯 Quest #{quest.id} reward", created_by="Badge Quest"))
-                        reward_label = f"Coupon: {reward_item.name}"
-                    else:
-                        reward_label = f"Coupon (item {reward_value} not found)"
-
-                db.flush()
-                awarded_list.append({
-                    "user_id": user.id,
-                    "user_name": user_name,
-                    "reward": reward_label,
-                    "query": query_display,
-                })
-                logger.info(f"🏅 Quest #{quest.id} → {user_name}: {reward_label}")
 
+DIRTY_BATCH = 5000  # dirty marks drained per incremental run
+
+
+def run_incremental_evaluation(db: Session):
+    """
+    Evaluate only the (user, field) pairs marked dirty since the last run.
+
+    Every API worker schedules this job, but only one evaluates at a time:
+    a worker that can't take the evaluation lock skips its tick and leaves
+    the marks for the next run. Marks are deleted in the same transaction as
+    the awards, so a failed run leaves its marks for the next one.
+    """
+    if not _lock_evaluation(db, wait=False):
+        db.rollback()
+        return {"awarded": 0, "details": []}
+    rows = (
+        db.query(BadgeQuestDirty.id, BadgeQuestDirty.user_id, BadgeQuestDirty.field)
+        .order_by(BadgeQuestDirty.id)
+        .limit(DIRTY_BATCH)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not rows:
+        db.rollback()
+        return {"awarded": 0, "details": []}
+    dirty = {}
+    for _, uid, field in rows:
+        dirty.setdefault(uid, set()).add(field)
+    db.query(BadgeQuestDirty).filter(
+        BadgeQuestDirty.id.in_([r.id for r in rows])
+    ).delete(synchronize_session=False)
+    result = _run_evaluation(db, dirty)
     db.commit()
-    return {"awarded": len(awarded_list), "details": awarded_list}
+    return result
 
 
 # ── Staff: My Progress ───────────────────────────────
@@ -439,17 +557,16 @@ def get_my_progress(
             completed = existing is not None
         else:
             existing = db.query(CoinLog).filter(
+                CoinLog.log_type == "quest_reward",
                 CoinLog.user_id == current_user.id,
                 CoinLog.reason == f"🎯 Quest #{quest.id} reward",
             ).first()
             completed = existing is not None
 
         # Get progress
-        effective_query = quest.condition_query
-        if not effective_query and quest.condition_type:
-            effective_query = f"{quest.condition_type} >= {quest.threshold or 1}"
-        if effective_query:
-            progress_data = resolve_user_fields(current_user.id, effective_query, db)
+        query = effective_query(quest)
+        if query:
+            progress_data = resolve_user_fields(current_user.id, query, db)
         else:
             progress_data = {}
 
@@ -159,6 +159,7 @@ def buy_badge(
             user_id=current_user.id,
             amount=-price,
             reason=f"🏪 Badge Shop — purchased \"{badge.name}\"",
+            log_type="badge_shop",
             created_by="Badge Shop",
         )
         db.add(log)
@@ -464,6 +464,7 @@ def buy_magic_item(
         log = CoinLog(
             user_id=current_user.id, amount=-scroll_cost,
             reason=f"📜 Scroll of Luck — LUK +1 (now {current_user.base_luk})",
+            log_type="scroll_purchase",
             created_by="Magic Shop"
         )
         db.add(log)
@@ -475,6 +476,7 @@ def buy_magic_item(
         log = CoinLog(
             user_id=current_user.id, amount=-scroll_cost,
             reason=f"📜 Scroll of Strength — STR +1 (now {current_user.base_str})",
+            log_type="scroll_purchase",
             created_by="Magic Shop"
         )
         db.add(log)
@@ -486,6 +488,7 @@ def buy_magic_item(
         log = CoinLog(
             user_id=current_user.id, amount=-scroll_cost,
             reason=f"📜 Scroll of Defense — DEF +1 (now {current_user.base_def})",
+            log_type="scroll_purchase",
             created_by="Magic Shop"
         )
         db.add(log)
@@ -692,20 +695,10 @@ def get_recent_awards(
             })
 
     # Mana (Angel Coin) transfers — only "Received" entries (amount > 0)
-    # Use log_type if available, fallback to ILIKE for old data
     # Filter amount > 0 to exclude sender's deduction logs
-    from sqlalchemy import or_
     mana_logs = (
         db.query(CoinLog)
-        .filter(
-            CoinLog.amount > 0,
-            or_(
-                CoinLog.log_type == "mana_gift",
-                CoinLog.reason.ilike("%Received Angel Coins%"),
-                CoinLog.reason.ilike("%Received Gold from%"),
-                CoinLog.reason.ilike("%Received Mana from%"),
-            ),
-        )
+        .filter(CoinLog.log_type == "mana_gift", CoinLog.amount > 0)
         .order_by(CoinLog.created_at.desc())
         .limit(limit)
         .all()
@@ -740,7 +733,7 @@ def get_recent_awards(
     # Lucky Draw winners
     draw_logs = (
         db.query(CoinLog)
-        .filter(or_(CoinLog.log_type == "lucky_draw", CoinLog.reason.ilike("%Lucky Draw%")))
+        .filter(CoinLog.log_type == "lucky_draw")
         .order_by(CoinLog.created_at.desc())
         .limit(limit)
         .all()
@@ -762,7 +755,7 @@ def get_recent_awards(
     # Magic Lottery results
     lottery_logs = (
         db.query(CoinLog)
-        .filter(or_(CoinLog.log_type == "lottery", CoinLog.reason.ilike("%Magic Lottery%")))
+        .filter(CoinLog.log_type == "lottery")
         .order_by(CoinLog.created_at.desc())
         .limit(limit)
         .all()
@@ -812,7 +805,7 @@ def get_recent_awards(
     # Mana Rescue events — aggregated per recipient
     rescue_logs = (
         db.query(CoinLog)
-        .filter(or_(CoinLog.log_type == "rescue", CoinLog.reason.ilike("%Mana Rescue from%")))
+        .filter(CoinLog.log_type == "rescue")
         .order_by(CoinLog.created_at.desc())
         .limit(limit)
         .all()
@@ -898,7 +891,7 @@ def get_recent_awards(
     # PvP Battle results
     pvp_logs = (
         db.query(CoinLog)
-        .filter(or_(CoinLog.log_type == "pvp", CoinLog.reason.ilike("%PvP Match:%")))
+        .filter(CoinLog.log_type == "pvp")
         .order_by(CoinLog.created_at.desc())
         .limit(limit)
         .all()
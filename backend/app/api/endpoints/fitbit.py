@@ -455,6 +455,7 @@ def claim_step_reward(
             user_id=current_user.id,
             amount=rewards["gold"],
             reason=f"🥾 Step reward — {reward_type} goal ({threshold:,} steps)",
+            log_type="step_reward",
             created_by="System",
         ))
     if rewards["mana"] > 0:
@@ -117,7 +117,7 @@ def spin_wheel(wheel_id: int, db: Session = Depends(get_db), current_user: User
     # Deduct cost
     if wheel.currency == "gold":
         user.coins -= wheel.price
-        db.add(CoinLog(user_id=user.id, amount=-wheel.price, reason=f"Fortune Wheel: {wheel.name}", created_by="System"))
+        db.add(CoinLog(user_id=user.id, amount=-wheel.price, reason=f"Fortune Wheel: {wheel.name}", log_type="fortune_spin", created_by="System"))
     else:
         user.angel_coins -= wheel.price
 
@@ -140,7 +140,7 @@ def spin_wheel(wheel_id: int, db: Session = Depends(get_db), current_user: User
     message = f"🎡 {seg.get('label', 'Unknown')}"
     if reward_type == "gold" and reward_amount > 0:
         user.coins += reward_amount
-        db.add(CoinLog(user_id=user.id, amount=reward_amount, reason=f"Fortune Wheel Prize: {seg.get('label', '')}", created_by="System"))
+        db.add(CoinLog(user_id=user.id, amount=reward_amount, reason=f"Fortune Wheel Prize: {seg.get('label', '')}", log_type="fortune_prize", created_by="System"))
         message = f"💰 Won {reward_amount} Gold!"
     elif reward_type == "mana" and reward_amount > 0:
         user.angel_coins += reward_amount
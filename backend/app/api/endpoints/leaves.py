@@ -277,6 +277,7 @@ def approve_leave(
             date_str = current_date.isoformat()
             
             penalty_log = db.query(CoinLog).filter(
+                CoinLog.log_type == "penalty",
                 CoinLog.user_id == leave.user_id,
                 CoinLog.reason.like(f"%Absent penalty ({date_str})%"),
                 CoinLog.amount < 0,
@@ -295,6 +296,7 @@ def approve_leave(
                 user_id=user.id,
                 amount=total_refund,
                 reason=f"Sick leave approved — refund for absent penalties ({leave.start_date} to {leave.end_date})",
+                log_type="refund",
                 created_by=f"{current_user.name} {current_user.surname}",
             )
             db.add(refund_log)
@@ -331,6 +333,7 @@ def reject_leave(
                     user_id=user.id,
                     amount=-penalty,
                     reason=f"Sick leave rejected — absent penalty ({leave.start_date.isoformat()})",
+                    log_type="penalty",
                     created_by=f"{current_user.name} {current_user.surname}",
                 )
                 db.add(log)
@@ -15,6 +15,7 @@ from app.models.user import User, UserRole
 from app.models.party_quest import PartyQuest, PartyQuestMember
 from app.models.reward import CoinLog
 from app.models.badge import Badge, UserBadge
+from app.services import user_stats
 
 logger = logging.getLogger("hr-api")
 
@@ -57,9 +58,6 @@ def _now_local():
 
 def _compute_progress(db: Session, quest: PartyQuest, team_members_a: list, team_members_b: list):
     """Compute progress for both teams across all active goals."""
-    from app.models.social import ThankYouCard
-    from app.models.pvp import PvpBattle
-
     start_utc = datetime.combine(quest.start_date, datetime.min.time()) - timedelta(hours=7)
     end_utc = datetime.combine(quest.end_date, datetime.max.time()) - timedelta(hours=7)
     a_ids = [m.user_id for m in team_members_a]
@@ -70,35 +68,22 @@ def _compute_progress(db: Session, quest: PartyQuest, team_members_a: list, team
 
     # Steps
     if quest.steps_goal:
-        try:
-            from app.models.fitbit import FitbitSteps
-            for label, ids in [("team_a", a_ids), ("team_b", b_ids)]:
-                total = db.query(func.coalesce(func.sum(FitbitSteps.steps), 0)).filter(
-                    FitbitSteps.user_id.in_(ids),
-                    FitbitSteps.date >= quest.start_date,
-                    FitbitSteps.date <= quest.end_date,
-                ).scalar() if ids else 0
-                result[label]["steps"] = int(total)
-        except Exception:
-            result["team_a"]["steps"] = 0
-            result["team_b"]["steps"] = 0
-
-    # Gifts received from non-team members (exclude same-team gifts)
+        for label, ids in [("team_a", a_ids), ("team_b", b_ids)]:
+            result[label]["steps"] = user_stats.range_total(db, "steps", ids, quest.start_date, quest.end_date)
+
+    # Gifts received from non-team members (exclude same-team gifts).
+    # Read from coin_logs: the exclusion depends on the sender, which user_stats doesn't keep.
     if quest.gifts_goal:
-        from sqlalchemy import or_, and_
+        from sqlalchemy import or_
         for label, ids, own_ids in [("team_a", a_ids, a_ids), ("team_b", b_ids, b_ids)]:
             total = 0
             if ids:
                 filters = [
+                    CoinLog.log_type == "mana_gift",
                     CoinLog.user_id.in_(ids),
                     CoinLog.created_at >= start_utc,
                     CoinLog.created_at <= end_utc,
                     CoinLog.amount > 0,
-                    or_(
-                        CoinLog.reason.ilike("%Received Angel Coins%"),
-                        CoinLog.reason.ilike("%Received Gold from%"),
-                        CoinLog.reason.ilike("%Received Mana from%"),
-                    ),
                 ]
                 # Exclude gifts from same team members
                 if own_ids:
@@ -111,30 +96,14 @@ def _compute_progress(db: Session, quest: PartyQuest, team_members_a: list, team
                 total = db.query(func.coalesce(func.sum(CoinLog.amount), 0)).filter(*filters).scalar()
             result[label]["gifts"] = int(total) if total else 0
 
-    # PvP battles won
+    # PvP battles won and Thank You Cards received (user_stats day buckets)
     if quest.battles_goal:
         for label, ids in [("team_a", a_ids), ("team_b", b_ids)]:
-            count = 0
-            if ids:
-                count = db.query(func.count(PvpBattle.id)).filter(
-                    PvpBattle.winner_id.in_(ids),
-                    PvpBattle.status == "resolved",
-                    PvpBattle.created_at >= start_utc,
-                    PvpBattle.created_at <= end_utc,
-                ).scalar()
-            result[label]["battles"] = int(count) if count else 0
-
-    # Thank You Cards received
+            result[label]["battles"] = user_stats.range_total(db, "pvp_wins", ids, quest.start_date, quest.end_date)
+
     if quest.thankyou_goal:
         for label, ids in [("team_a", a_ids), ("team_b", b_ids)]:
-            count = 0
-            if ids:
-                count = db.query(func.count(ThankYouCard.id)).filter(
-                    ThankYouCard.recipient_id.in_(ids),
-                    ThankYouCard.created_at >= start_utc,
-                    ThankYouCard.created_at <= end_utc,
-                ).scalar()
-            result[label]["thankyou"] = int(count) if count else 0
+            result[label]["thankyou"] = user_stats.range_total(db, "thank_you_received", ids, quest.start_date, quest.end_date)
 
     return result
 
@@ -194,11 +163,11 @@ def _check_and_resolve(db: Session, quest: PartyQuest):
         if quest.reward_gold:
             share = math.ceil(quest.reward_gold / team_size)
             user.coins = (user.coins or 0) + share
-            db.add(CoinLog(user_id=user.id, amount=share, reason=f"🤝 Party Quest '{quest.title}' — {team_name} Wins! Gold +{share} (Team Reward {quest.reward_gold}/{team_size})", created_by="System"))
+            db.add(CoinLog(user_id=user.id, amount=share, reason=f"🤝 Party Quest '{quest.title}' — {team_name} Wins! Gold +{share} (Team Reward {quest.reward_gold}/{team_size})", log_type="party_quest", created_by="System"))
         if quest.reward_mana:
             share = math.ceil(quest.reward_mana / team_size)
             user.angel_coins = (user.angel_coins or 0) + share
-            db.add(CoinLog(user_id=user.id, amount=share, reason=f"🤝 Party Quest '{quest.title}' — {team_name} Wins! Mana +{share} (Team Reward {quest.reward_mana}/{team_size})", created_by="System"))
+            db.add(CoinLog(user_id=user.id, amount=share, reason=f"🤝 Party Quest '{quest.title}' — {team_name} Wins! Mana +{share} (Team Reward {quest.reward_mana}/{team_size})", log_type="party_quest", created_by="System"))
         if quest.reward_str:
             share = math.ceil(quest.reward_str / team_size)
             user.base_str = (user.base_str or 10) + share
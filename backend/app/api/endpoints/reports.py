@@ -189,7 +189,7 @@ def get_mana_gift_report(
     from sqlalchemy import func, case
 
     # Build date filters
-    filters = [CoinLog.reason.ilike("%Sent%Mana%to%")]
+    filters = [CoinLog.log_type == "mana_gift", CoinLog.amount < 0]
     if start_date:
         filters.append(CoinLog.created_at >= datetime.combine(start_date, datetime.min.time()))
     if end_date:
@@ -256,7 +256,7 @@ def get_mana_gift_report(
         })
 
     # Now get received logs for per-user received stats
-    recv_filters = [CoinLog.reason.ilike("%Received%from%")]
+    recv_filters = [CoinLog.log_type == "mana_gift", CoinLog.amount > 0]
     if start_date:
         recv_filters.append(CoinLog.created_at >= datetime.combine(start_date, datetime.min.time()))
     if end_date:
@@ -120,6 +120,7 @@ def redeem_reward(
         user_id=current_user.id,
         amount=-reward.point_cost,
         reason=f"Redeemed: {reward.name}",
+        log_type="redemption",
         created_by="System"
     )
     db.add(log)
@@ -260,6 +261,7 @@ def reject_redemption(
             user_id=user.id,
             amount=reward.point_cost,
             reason=f"Refund: {reward.name} redemption rejected",
+            log_type="refund",
             created_by=f"{current_user.name}",
         )
         db.add(log)
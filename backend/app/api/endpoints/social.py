@@ -7,16 +7,16 @@ from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
+from sqlalchemy import func
 
 from app.core.database import get_db
 from app.models.social import ThankYouCard, AnonymousPraise, TownCrierReaction, StatBuff
 from app.models.user import User
 from app.models.company import Company
 from app.models.reward import CoinLog
-from app.models.attendance import Attendance
 from app.models.expense import ExpenseRequest, ExpenseType
 from app.api import deps
+from app.services import user_stats
 
 logger = logging.getLogger("hr-api")
 
@@ -216,14 +216,15 @@ def get_man_of_the_month(
     month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     # Convert back to UTC for DB queries
     month_start_utc = month_start - timedelta(hours=7)
+    month = user_stats.month_period(now)  # user_stats bucket for the leaderboards
 
     results = {
         "month": now.strftime("%B %Y"),
-        "most_mana_received": _leaderboard_mana_received(db, month_start_utc),
-        "most_steps": _leaderboard_steps(db, now),
-        "most_on_time": _leaderboard_on_time(db, month_start_utc),
-        "most_gold_spent": _leaderboard_gold_spent(db, month_start_utc),
-        "most_anonymous_praises": _leaderboard_anonymous_praises(db, now),
+        "most_mana_received": _leaderboard_mana_received(db, month),
+        "most_steps": _leaderboard_steps(db, month),
+        "most_on_time": _leaderboard_on_time(db, month),
+        "most_gold_spent": _leaderboard_gold_spent(db, month),
+        "most_anonymous_praises": _leaderboard_anonymous_praises(db, month),
         "most_center_slips": _leaderboard_center_slips(db, month_start_utc),
     }
 
@@ -256,120 +257,37 @@ def get_man_of_the_month(
     return results
 
 
-def _leaderboard_mana_received(db: Session, month_start_utc):
+def _leaderboard_mana_received(db: Session, month: str):
     """Most Mana received from gifts (not admin adjust)."""
-    mana_logs = (
-        db.query(
-            CoinLog.user_id,
-            func.sum(CoinLog.amount).label("total_received"),
-        )
-        .filter(
-            CoinLog.created_at >= month_start_utc,
-            or_(
-                CoinLog.reason.ilike("%Received Angel Coins%"),
-                CoinLog.reason.ilike("%Received Gold from%"),
-                CoinLog.reason.ilike("%Received Mana from%"),
-            ),
-            # Exclude admin adjustments
-            ~CoinLog.created_by.ilike("%admin%"),
-        )
-        .group_by(CoinLog.user_id)
-        .order_by(func.sum(CoinLog.amount).desc())
-        .limit(10)
-        .all()
-    )
-    return _resolve_users(db, [(r.user_id, int(r.total_received)) for r in mana_logs])
+    return _resolve_users(db, user_stats.top(db, "gift_amount_received_non_admin", month))
 
 
-def _leaderboard_steps(db: Session, now_local):
+def _leaderboard_steps(db: Session, month: str):
     """Most total steps this month."""
-    try:
-        from app.models.fitbit import FitbitSteps
-        month_start_date = now_local.replace(day=1).date()
-        step_data = (
-            db.query(
-                FitbitSteps.user_id,
-                func.sum(FitbitSteps.steps).label("total_steps"),
-            )
-            .filter(FitbitSteps.date >= month_start_date)
-            .group_by(FitbitSteps.user_id)
-            .order_by(func.sum(FitbitSteps.steps).desc())
-            .limit(10)
-            .all()
-        )
-        return _resolve_users(db, [(r.user_id, int(r.total_steps)) for r in step_data])
-    except Exception as e:
-        logger.warning(f"Steps leaderboard error: {e}")
-        return []
+    return _resolve_users(db, user_stats.top(db, "steps", month))
 
 
-def _leaderboard_on_time(db: Session, month_start_utc):
+def _leaderboard_on_time(db: Session, month: str):
     """Most check-ins with status 'present' (on time).
     Tiebreaker: earliest average check-in time wins.
     """
-    # Average seconds-since-midnight as tiebreaker (lower = earlier check-in)
-    avg_time_of_day = func.avg(
-        func.extract('epoch', Attendance.timestamp) % 86400
-    ).label("avg_tod")
-
-    on_time = (
-        db.query(
-            Attendance.user_id,
-            func.count(Attendance.id).label("on_time_count"),
-            avg_time_of_day,
-        )
-        .filter(
-            Attendance.timestamp >= month_start_utc,
-            Attendance.status == "present",
-        )
-        .group_by(Attendance.user_id)
-        .order_by(
-            func.count(Attendance.id).desc(),   # primary: most on-time days
-            avg_time_of_day.asc(),               # tiebreaker: earliest avg check-in
-        )
-        .limit(10)
-        .all()
+    counts = user_stats.get_values(db, "on_time_checkins", month)
+    seconds = user_stats.get_values(db, "on_time_seconds", month, counts)
+    ranked = sorted(
+        ((uid, n) for uid, n in counts.items() if n > 0),
+        key=lambda item: (-item[1], seconds.get(item[0], 0) / item[1]),
     )
-    return _resolve_users(db, [(r.user_id, int(r.on_time_count)) for r in on_time])
+    return _resolve_users(db, ranked[:10])
 
 
-def _leaderboard_gold_spent(db: Session, month_start_utc):
+def _leaderboard_gold_spent(db: Session, month: str):
     """Most Gold spent (negative coin logs, excludes penalties like 'Late penalty', 'Absent penalty')."""
-    spending_logs = (
-        db.query(
-            CoinLog.user_id,
-            func.sum(func.abs(CoinLog.amount)).label("total_spent"),
-        )
-        .filter(
-            CoinLog.created_at >= month_start_utc,
-            CoinLog.amount < 0,
-            ~CoinLog.reason.ilike("%penalty%"),
-            ~CoinLog.reason.ilike("%Late%"),
-            ~CoinLog.reason.ilike("%Absent%"),
-        )
-        .group_by(CoinLog.user_id)
-        .order_by(func.sum(func.abs(CoinLog.amount)).desc())
-        .limit(10)
-        .all()
-    )
-    return _resolve_users(db, [(r.user_id, int(r.total_spent)) for r in spending_logs])
+    return _resolve_users(db, user_stats.top(db, "gold_spent_voluntary", month))
 
 
-def _leaderboard_anonymous_praises(db: Session, now_local):
+def _leaderboard_anonymous_praises(db: Session, month: str):
     """Most Anonymous Praises received this month."""
-    month_str = now_local.strftime("%Y-%m")  # e.g. "2026-02"
-    praises = (
-        db.query(
-            AnonymousPraise.recipient_id,
-            func.count(AnonymousPraise.id).label("praise_count"),
-        )
-        .filter(AnonymousPraise.date_key.startswith(month_str))
-        .group_by(AnonymousPraise.recipient_id)
-        .order_by(func.count(AnonymousPraise.id).desc())
-        .limit(10)
-        .all()
-    )
-    return _resolve_users(db, [(r.recipient_id, int(r.praise_count)) for r in praises])
+    return _resolve_users(db, user_stats.top(db, "praise_received", month))
 
 
 def _leaderboard_center_slips(db: Session, month_start_utc):
@@ -537,7 +455,9 @@ def send_buff(
         user_id=current_user.id,
         amount=-req.amount,
         reason=f"⚡ Buff {icon} {req.stat_type.upper()}+{req.amount} → {recipient_name}",
+        log_type="buff",
         created_by=sender_name,
+        sender_user_id=current_user.id,
     ))
 
     db.commit()
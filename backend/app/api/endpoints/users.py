@@ -4,6 +4,7 @@ import shutil
 from datetime import timedelta
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query
 from pydantic import BaseModel
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from app.core.database import get_db
@@ -205,9 +206,9 @@ def rescue_user(
 
     # Check if this user already contributed to this revival
     existing_prayer = db.query(CoinLog).filter(
+        CoinLog.log_type == "revival_prayer",
         CoinLog.user_id == recipient.id,
-        CoinLog.reason.ilike(f"%Revival Prayer from {current_user.name}%"),
-        CoinLog.amount == 0,
+        CoinLog.sender_user_id == current_user.id,
     ).first()
     if existing_prayer:
         raise HTTPException(status_code=400, detail="You already contributed to this revival!")
@@ -223,6 +224,7 @@ def rescue_user(
         user_id=current_user.id,
         amount=-cost,
         reason=f"🙏 Revival Contribution for {recipient_name}",
+        log_type="revival_contribution",
         created_by="System",
         sender_user_id=current_user.id,
     )
@@ -233,6 +235,7 @@ def rescue_user(
         user_id=recipient.id,
         amount=0,
         reason=f"🙏 Revival Prayer from {sender_name}",
+        log_type="revival_prayer",
         created_by=sender_name,
         sender_user_id=current_user.id,
     )
@@ -241,9 +244,8 @@ def rescue_user(
 
     # Count current prayers for this recipient
     prayer_count = db.query(CoinLog).filter(
+        CoinLog.log_type == "revival_prayer",
         CoinLog.user_id == recipient.id,
-        CoinLog.reason.ilike("🙏 Revival Prayer from%"),
-        CoinLog.amount == 0,
     ).count()
 
     revived = False
@@ -253,9 +255,8 @@ def rescue_user(
 
         # Gather all rescuer names
         prayer_logs = db.query(CoinLog).filter(
+            CoinLog.log_type == "revival_prayer",
             CoinLog.user_id == recipient.id,
-            CoinLog.reason.ilike("🙏 Revival Prayer from%"),
-            CoinLog.amount == 0,
         ).all()
         rescuer_names = [p.created_by for p in prayer_logs]
 
@@ -268,6 +269,7 @@ def rescue_user(
             user_id=recipient.id,
             amount=gold_on_revive,
             reason=f"💖 Revived by {', '.join(rescuer_names)}!",
+            log_type="revived",
             created_by="Revival Pool",
         )
         db.add(revival_log)
@@ -303,7 +305,7 @@ def get_revival_records(
 ):
     """Get revival history for the Hall of Fame."""
     logs = db.query(CoinLog).filter(
-        CoinLog.reason.ilike("💖 Revived by%"),
+        CoinLog.log_type == "revived",
     ).order_by(CoinLog.created_at.desc()).limit(50).all()
 
     records = []
@@ -360,15 +362,12 @@ def get_rescue_pool(
         return {"is_dead": False, "prayer_count": 0, "required": required, "contributors": [], "cost": cost}
 
     prayers = db.query(CoinLog).filter(
+        CoinLog.log_type == "revival_prayer",
         CoinLog.user_id == user_id,
-        CoinLog.reason.ilike("🙏 Revival Prayer from%"),
-        CoinLog.amount == 0,
     ).all()
 
     contributors = [p.created_by for p in prayers]
-    already_contributed = any(
-        current_user.name in c for c in contributors
-    )
+    already_contributed = any(p.sender_user_id == current_user.id for p in prayers)
 
     return {
         "is_dead": True,
@@ -380,6 +379,56 @@ def get_rescue_pool(
     }
 
 
+# ── Check-in Streaks ─────────────────────────────────
+
+@router.get("/checkin-streaks")
+def get_checkin_streak_leaderboard(
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Top current and all-time on-time check-in streaks."""
+    from app.services import checkin_calendar
+
+    current = checkin_calendar.top(db, limit)
+    longest = checkin_calendar.top(db, limit, longest=True)
+    user_ids = {uid for uid, _ in current + longest}
+    users = {u.id: u for u in db.query(User).filter(User.id.in_(user_ids)).all()} if user_ids else {}
+
+    def _entries(rows):
+        return [
+            {
+                "user_id": uid,
+                "name": f"{users[uid].name} {users[uid].surname or ''}".strip(),
+                "image": users[uid].image,
+                "streak": streak,
+            }
+            for uid, streak in rows
+            if uid in users
+        ]
+
+    return {"current": _entries(current), "longest": _entries(longest)}
+
+
+@router.get("/{user_id}/checkin-streak")
+def get_user_checkin_streak(
+    user_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Current and longest on-time check-in streak for a profile page."""
+    from app.services import checkin_calendar
+
+    streak = checkin_calendar.get_streak(db, user_id)
+    return {
+        "user_id": user_id,
+        "current": streak["current"],
+        "longest": streak["longest"],
+        "longest_end": streak["longest_end"].isoformat() if streak["longest_end"] else None,
+        "last_on_time": streak["last_on_time"].isoformat() if streak["last_on_time"] else None,
+    }
+
+
 @router.get("/{user_id}", response_model=UserResponse)
 def read_user(user_id: int, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.id == user_id).first()
@@ -492,6 +541,7 @@ def adjust_user_coins(
         user_id=user.id,
         amount=req.amount,
         reason=req.reason,
+        log_type="admin",
         created_by=f"{current_user.name} {current_user.surname}",
         sender_user_id=current_user.id,
     )
@@ -670,7 +720,9 @@ def grant_angel_coins(
         user_id=user.id,
         amount=req.amount,  # Angel coins amount for the angel tab
         reason=f"🪽 Angel Coins +{req.amount}: {req.reason}",
-        created_by=f"{current_user.name} {current_user.surname}"
+        log_type="admin",
+        created_by=f"{current_user.name} {current_user.surname}",
+        sender_user_id=current_user.id,
     )
     db.add(log)
     db.commit()
@@ -777,6 +829,13 @@ def get_staff_list(
 
 from app.models.face_image import UserFaceImage
 
+MAX_FACE_IMAGES_PER_USER = 2
+BULK_MAX_IMAGES = 1000
+BULK_MAX_IMAGE_BYTES = 20 * 1024 * 1024
+BULK_MAX_TOTAL_BYTES = 1024 * 1024 * 1024
+FACE_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+
 @router.get("/{user_id}/face-images")
 def get_user_face_images(
     user_id: int,
@@ -803,7 +862,7 @@ def upload_user_face_image(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_gm_or_above)
 ):
-    """Upload a face image for a user (max 2). Triggers FAISS index rebuild."""
+    """Upload a face image for a user (max 2). Adds its embedding to the FAISS index."""
     # Check user exists
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
@@ -811,8 +870,8 @@ def upload_user_face_image(
 
     # Check max 2 face images
     existing_count = db.query(UserFaceImage).filter(UserFaceImage.user_id == user_id).count()
-    if existing_count >= 2:
-        raise HTTPException(status_code=400, detail="Maximum 2 face images allowed. Delete an existing one first.")
+    if existing_count >= MAX_FACE_IMAGES_PER_USER:
+        raise HTTPException(status_code=400, detail=f"Maximum {MAX_FACE_IMAGES_PER_USER} face images allowed. Delete an existing one first.")
 
     # Save file
     ext = os.path.splitext(file.filename)[1]
@@ -831,8 +890,8 @@ def upload_user_face_image(
     db.commit()
     db.refresh(face_img)
 
-    # Trigger FAISS rebuild in background
-    _trigger_faiss_rebuild()
+    # Embed only the new image and add it to the FAISS index in background
+    _trigger_faiss_update(add_image_id=face_img.id)
 
     return {
         "id": face_img.id,
@@ -842,6 +901,139 @@ def upload_user_face_image(
     }
 
 
+def _bulk_user_keys(path):
+    """
+    Candidate user keys for a bulk-upload path: the folder name (zip), else
+    the file name — whole, before the last "_" and before the first "_".
+    A key is a user id or an email.
+    """
+    folder = os.path.basename(os.path.dirname(path))
+    if folder:
+        return [folder]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return list(dict.fromkeys([stem, stem.rsplit("_", 1)[0], stem.split("_", 1)[0]]))
+
+
+def _list_bulk_uploads(files):
+    """
+    (name, size, open) for every image in the uploaded files and zip archives,
+    found without reading any image data; open() returns a file object to
+    stream the image from. The image count and total size are checked here,
+    so an oversized upload is rejected before anything is extracted or written.
+    """
+    import zipfile
+    entries = []
+    for upload in files:
+        name = upload.filename or ""
+        if name.lower().endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(upload.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"Invalid zip file: {name}")
+            for info in archive.infolist():
+                if info.is_dir() or info.filename.startswith("__MACOSX") or os.path.basename(info.filename).startswith("."):
+                    continue
+                if os.path.splitext(info.filename)[1].lower() not in FACE_IMAGE_EXTENSIONS:
+                    continue
+                entries.append((info.filename, info.file_size, lambda a=archive, i=info: a.open(i)))
+        elif os.path.splitext(name)[1].lower() in FACE_IMAGE_EXTENSIONS:
+            size = upload.file.seek(0, os.SEEK_END)
+            upload.file.seek(0)
+            entries.append((name, size, lambda f=upload.file: f))
+
+    if len(entries) > BULK_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_IMAGES} images per upload")
+    if sum(size for _, size, _ in entries if size <= BULK_MAX_IMAGE_BYTES) > BULK_MAX_TOTAL_BYTES:
+        raise HTTPException(status_code=400, detail=f"Upload exceeds {BULK_MAX_TOTAL_BYTES // (1024 * 1024)} MB of images")
+    return entries
+
+
+@router.post("/face-images/bulk")
+def bulk_upload_face_images(
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_gm_or_above)
+):
+    """
+    Bulk face enrollment from many image files and/or zip archives. Each image
+    is matched to a user by its folder (zip) or file name, using the user id or
+    email: "12/front.jpg", "jane@corp.com/1.jpg", "12_front.jpg".
+    Images are quality-checked (no face, multiple faces, small face) and
+    embedded in parallel; the FAISS index gets one update at the end.
+    """
+    import zipfile
+    import zlib
+    from app.services import face_worker_client
+    from app.services.face_service import enroll_faces
+
+    entries = _list_bulk_uploads(files)
+    if not entries:
+        raise HTTPException(status_code=400, detail="No images found in upload")
+
+    # Resolve all user keys from the names alone, with two queries
+    keys = {key for name, _, _ in entries for key in _bulk_user_keys(name)}
+    ids = {int(k) for k in keys if k.isdigit()}
+    emails = {k.lower() for k in keys if "@" in k}
+    users_by_key = {}
+    if ids:
+        for u in db.query(User).filter(User.id.in_(ids)).all():
+            users_by_key[str(u.id)] = u
+    if emails:
+        for u in db.query(User).filter(func.lower(User.email).in_(emails)).all():
+            users_by_key[u.email.lower()] = u
+
+    # Stream each accepted image straight to disk, one at a time
+    upload_dir = os.path.join(settings.UPLOAD_DIR, "face_images")
+    os.makedirs(upload_dir, exist_ok=True)
+    results = []
+    items = []
+    for name, size, open_entry in entries:
+        user = next((users_by_key.get(k.lower()) for k in _bulk_user_keys(name) if users_by_key.get(k.lower())), None)
+        if size > BULK_MAX_IMAGE_BYTES:
+            results.append({"file": name, "status": "too_large"})
+            continue
+        if user is None:
+            results.append({"file": name, "status": "unknown_user"})
+            continue
+        ext = os.path.splitext(name)[1].lower()
+        filename = f"face_{user.id}_{uuid.uuid4().hex[:8]}{ext}"
+        path = os.path.join(upload_dir, filename)
+        try:
+            with open_entry() as src, open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        except (zipfile.BadZipFile, zlib.error, EOFError):
+            # Corrupt or truncated archive member: nothing is enrolled from this upload
+            for written in [path] + [os.path.join(upload_dir, os.path.basename(i["image_path"])) for i in items]:
+                if os.path.exists(written):
+                    os.remove(written)
+            raise HTTPException(status_code=400, detail=f"Corrupt zip entry: {name}")
+        items.append({"file": name, "user_id": user.id, "image_path": f"/uploads/face_images/{filename}"})
+
+    if items:
+        if face_worker_client.is_remote():
+            # The face worker owns the model and index; files are on the shared uploads volume
+            response = face_worker_client.post(
+                "/enroll/bulk", timeout=900,
+                json={"items": items, "max_per_user": MAX_FACE_IMAGES_PER_USER},
+            )
+            if response is None:
+                # The worker may have enrolled some items before the call failed (e.g. a
+                # timeout): only remove files that no UserFaceImage row points at
+                paths = [item["image_path"] for item in items]
+                enrolled = {p for (p,) in db.query(UserFaceImage.image_path).filter(UserFaceImage.image_path.in_(paths))}
+                for image_path in set(paths) - enrolled:
+                    path = os.path.join(upload_dir, os.path.basename(image_path))
+                    if os.path.exists(path):
+                        os.remove(path)
+                raise HTTPException(status_code=502, detail="Face worker unavailable")
+            results.extend(response["results"])
+        else:
+            results.extend(enroll_faces(items, max_per_user=MAX_FACE_IMAGES_PER_USER))
+
+    accepted = sum(1 for r in results if r["status"] == "ok")
+    return {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
+
+
 @router.delete("/{user_id}/face-images/{image_id}")
 def delete_user_face_image(
     user_id: int,
@@ -849,7 +1041,7 @@ def delete_user_face_image(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_gm_or_above)
 ):
-    """Delete a face image. Triggers FAISS index rebuild."""
+    """Delete a face image. Removes its vector from the FAISS index."""
     face_img = db.query(UserFaceImage).filter(
         UserFaceImage.id == image_id,
         UserFaceImage.user_id == user_id
@@ -865,12 +1057,76 @@ def delete_user_face_image(
     db.delete(face_img)
     db.commit()
 
-    # Trigger FAISS rebuild in background
-    _trigger_faiss_rebuild()
+    # Remove the vector by image id (no re-embedding)
+    _trigger_faiss_update(remove_image_id=image_id)
 
     return {"message": "Face image deleted"}
 
 
+@router.post("/face-index/rebuild")
+def rebuild_face_index(
+    reembed: bool = False,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_gm_or_above)
+):
+    """
+    Repair: rebuild the FAISS index from stored embeddings.
+    With reembed=true, all images are marked stale and re-embedded by the background
+    job; their current vectors stay in the index until each one is replaced.
+    """
+    if reembed:
+        db.query(UserFaceImage).update({UserFaceImage.embedding_model: None}, synchronize_session=False)
+        db.commit()
+    _trigger_faiss_rebuild()
+    return {"message": "FAISS index rebuild started", "reembed": reembed}
+
+
+@router.get("/face-index/stats")
+def face_index_stats(
+    recall_sample: int = 0,
+    k: int = 5,
+    current_user: User = Depends(get_current_gm_or_above)
+):
+    """
+    FAISS index type, size and memory. With recall_sample > 0, also the recall@k
+    and search latency of the live (possibly approximate) index vs. an exact one.
+    """
+    from app.services import face_worker_client
+    recall_sample = max(0, min(recall_sample, 2000))
+    if face_worker_client.is_remote():
+        report = face_worker_client.get("/index/stats", timeout=120, params={"recall_sample": recall_sample, "k": k})
+        if report is None:
+            raise HTTPException(status_code=502, detail="Face worker unavailable")
+        return report
+    from app.services.face_service import index_report
+    return index_report(recall_sample=recall_sample, k=k)
+
+
+def _trigger_faiss_update(add_image_id=None, remove_image_id=None):
+    """Apply an incremental FAISS index update in a background thread."""
+    import threading
+    import logging
+    logger = logging.getLogger("hr-api")
+    def _update():
+        try:
+            from app.services import face_worker_client
+            if face_worker_client.is_remote():
+                if remove_image_id is not None:
+                    face_worker_client.post(f"/index/remove/{remove_image_id}")
+                if add_image_id is not None:
+                    face_worker_client.post(f"/index/add/{add_image_id}", timeout=120)
+                return
+            from app.services.face_service import add_face_image, remove_face_image
+            if remove_image_id is not None:
+                remove_face_image(remove_image_id)
+            if add_image_id is not None:
+                add_face_image(add_image_id)
+        except Exception as e:
+            logger.error(f"❌ FAISS update failed: {e}")
+    threading.Thread(target=_update, daemon=True).start()
+    logger.info("🔄 FAISS incremental update triggered in background")
+
+
 def _trigger_faiss_rebuild():
     """Trigger FAISS index rebuild in a background thread."""
     import threading
@@ -878,6 +1134,10 @@ def _trigger_faiss_rebuild():
     logger = logging.getLogger("hr-api")
     def _rebuild():
         try:
+            from app.services import face_worker_client
+            if face_worker_client.is_remote():
+                face_worker_client.post("/index/rebuild")
+                return
             from app.services.face_service import rebuild_index
             rebuild_index()
         except Exception as e:
@@ -197,6 +197,7 @@ def approve_work_request(
             user_id=user.id,
             amount=coin_change,
             reason=coin_reason,
+            log_type="check_in",
             created_by=f"{current_user.name} {current_user.surname}",
         )
         db.add(log)
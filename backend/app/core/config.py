@@ -15,6 +15,19 @@ class Settings(BaseSettings):
     FITBIT_CLIENT_SECRET: str = os.getenv("FITBIT_CLIENT_SECRET", "")
     FITBIT_REDIRECT_URI: str = os.getenv("FITBIT_REDIRECT_URI", "https://hr.doby.me/oauth/callback")
 
+    # Face Recognition (CCTV check-in) inference
+    FACE_WORKER_URL: str = os.getenv("FACE_WORKER_URL", "")  # standalone face worker; empty = run in-process
+    FACE_INFERENCE_WORKERS: int = int(os.getenv("FACE_INFERENCE_WORKERS", "2"))  # shared across all cameras
+    FACE_INTRA_OP_THREADS: int = int(os.getenv("FACE_INTRA_OP_THREADS", "0"))    # onnxruntime threads per call, 0 = cores / workers
+    FACE_BULK_WORKERS: int = int(os.getenv("FACE_BULK_WORKERS", "0"))           # bulk enrollment processes, 0 = min(4, cores)
+    FACE_WARMUP: bool = os.getenv("FACE_WARMUP", "true").lower() == "true"     # load model + index at process start
+    FACE_ALLOWED_MODULES: str = os.getenv("FACE_ALLOWED_MODULES", "detection,recognition,landmark_2d_106")  # InsightFace models to load, empty = all
+    FACE_INDEX_TYPE: str = os.getenv("FACE_INDEX_TYPE", "auto")                  # auto | flat | ivf | hnsw
+    FACE_INDEX_AUTO_THRESHOLD: int = int(os.getenv("FACE_INDEX_AUTO_THRESHOLD", "20000"))  # auto: IVF from this many vectors
+    FACE_INDEX_QUANTIZER: str = os.getenv("FACE_INDEX_QUANTIZER", "")            # "", sq8 or pq (ivf/hnsw vector compression)
+    FACE_INDEX_NPROBE: int = int(os.getenv("FACE_INDEX_NPROBE", "16"))           # ivf: clusters scanned per query
+    FACE_INDEX_EF_SEARCH: int = int(os.getenv("FACE_INDEX_EF_SEARCH", "64"))     # hnsw: search breadth
+
     # Email (SMTP)
     SMTP_HOST: str = os.getenv("SMTP_HOST", "")
     SMTP_PORT: int = int(os.getenv("SMTP_PORT", "587"))
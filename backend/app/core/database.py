@@ -47,3 +47,55 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+class LeaderLock:
+    """
+    Session-level pg advisory lock held on a dedicated connection: the process
+    holding it is the leader until it releases it or its connection dies.
+    """
+
+    def __init__(self, lock_id, name="leader"):
+        self._lock_id = lock_id
+        self._name = name
+        self._conn = None
+
+    @property
+    def held(self):
+        return self._conn is not None
+
+    def try_acquire(self):
+        if engine.dialect.name != "postgresql":
+            self._conn = engine.connect()  # no advisory locks — single-instance dev setup
+            return True
+        conn = engine.connect()
+        try:
+            got = conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": self._lock_id}).scalar()
+        except Exception:
+            conn.close()
+            raise
+        if got:
+            conn.commit()
+            self._conn = conn
+            return True
+        conn.close()
+        return False
+
+    def still_held(self):
+        """Ping the lock connection; the lock is gone if the connection died."""
+        try:
+            self._conn.execute(text("SELECT 1"))
+            self._conn.commit()
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ {self._name} lost its leader connection: {e}")
+            self.release()
+            return False
+
+    def release(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
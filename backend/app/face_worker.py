@@ -0,0 +1,189 @@
+"""
+Standalone face recognition worker.
+
+Owns the RTSP streams, the ArcFace model and the FAISS index, so API
+processes (uvicorn --workers N) never load them. API processes talk to it
+over HTTP via FACE_WORKER_URL (see app.services.face_worker_client).
+
+Run exactly one process per instance:
+
+    uvicorn app.face_worker:app --host 0.0.0.0 --port 8001 --workers 1
+
+A Postgres advisory lock elects a leader: only the instance holding the
+lock runs streams and applies index updates. Other instances stay on
+standby and take over if the leader's DB connection goes away.
+"""
+
+import sys
+import logging
+import threading
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from fastapi import Body, FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.core.database import LeaderLock
+# Register all models so relationships resolve (tables are created by the API process)
+from app.models import user, company, approval, attendance, leave, reward, approval_pattern, work_request, badge, fitbit, step_rewards, badge_quest, fortune_wheel, expense, face_image, social, pvp, artifact, badge_shop, holiday, location, party_quest, user_stats, checkin_calendar  # noqa: F401
+from app.services import badge_quest_tracker  # noqa: F401  (check-ins written here feed badge quests)
+from app.services import user_stats as user_stats_rollup  # noqa: F401  (... and the user_stats rollup)
+from app.services import checkin_calendar as checkin_calendars  # noqa: F401  (... and streak calendars)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s │ %(levelname)-7s │ %(name)s │ %(message)s",
+    datefmt="%H:%M:%S",
+    stream=sys.stdout,
+)
+logger = logging.getLogger("hr-api")
+
+LEADER_LOCK_ID = 0x46414345  # "FACE" — pg advisory lock key
+LEADER_CHECK_SECONDS = 10
+
+app = FastAPI(title="HR Face Worker", version="1.0.0")
+scheduler = BackgroundScheduler()
+
+
+_leader = LeaderLock(LEADER_LOCK_ID, "Face worker")
+_leader_stop = threading.Event()
+
+
+def _become_leader():
+    from app.services.face_service import load_index
+    logger.info("👑 Face worker is leader — owning streams, model and index")
+    load_index()
+
+
+def _step_down():
+    from app.services import face_checkin_worker
+    logger.warning("🪑 Face worker stepped down — stopping streams")
+    face_checkin_worker.stop()
+
+
+def _leader_loop():
+    while not _leader_stop.is_set():
+        try:
+            if not _leader.held:
+                if _leader.try_acquire():
+                    _become_leader()
+            elif not _leader.still_held():
+                _step_down()
+        except Exception as e:
+            logger.error(f"❌ Face worker leader check error: {e}")
+        _leader_stop.wait(LEADER_CHECK_SECONDS)
+
+
+def _require_leader():
+    if not _leader.held:
+        raise HTTPException(status_code=503, detail="Face worker is on standby (not leader)")
+
+
+def _run_face_recognition():
+    if _leader.held:
+        from app.scheduler import _run_face_recognition as run
+        run()
+
+
+def _run_face_reembed():
+    if _leader.held:
+        from app.scheduler import _run_face_reembed as run
+        run()
+
+
+@app.on_event("startup")
+def startup_event():
+    from app.services.face_service import warm_up
+    # Standbys warm up too, so a failover doesn't pay the model load
+    threading.Thread(target=warm_up, daemon=True, name="face-warmup").start()
+    threading.Thread(target=_leader_loop, daemon=True, name="face-leader").start()
+    # The worker itself checks the time window and exits if outside
+    scheduler.add_job(_run_face_recognition, "interval", seconds=60, id="face_recognition_worker", replace_existing=True)
+    scheduler.add_job(_run_face_reembed, "interval", minutes=5, id="face_reembed", replace_existing=True)
+    scheduler.start()
+    logger.info("✅ Face worker started — face recognition check every 60s, re-embed every 5m")
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    from app.services import face_checkin_worker
+    _leader_stop.set()
+    scheduler.shutdown(wait=False)
+    face_checkin_worker.stop()
+    _leader.release()
+
+
+# ── Internal API (called by API processes) ───────────
+
+@app.get("/health")
+def health():
+    from app.services import face_service
+    index = face_service._index
+    return {
+        "leader": _leader.held,
+        "ready": face_service.get_readiness()["ready"],
+        "index_size": index.ntotal if index is not None else 0,
+    }
+
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until the model is loaded, warmed and the index is loaded."""
+    from app.services.face_service import get_readiness
+    readiness = {**get_readiness(), "leader": _leader.held}
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+
+@app.post("/index/add/{image_id}")
+def index_add(image_id: int):
+    _require_leader()
+    from app.services.face_service import add_face_image
+    return {"added": add_face_image(image_id)}
+
+
+@app.post("/index/remove/{image_id}")
+def index_remove(image_id: int):
+    _require_leader()
+    from app.services.face_service import remove_face_image
+    return {"removed": remove_face_image(image_id)}
+
+
+@app.post("/enroll/bulk")
+def enroll_bulk(payload: dict = Body(...)):
+    _require_leader()
+    from app.services.face_service import enroll_faces
+    return {"results": enroll_faces(payload.get("items", []), payload.get("max_per_user"))}
+
+
+@app.post("/index/rebuild")
+def index_rebuild():
+    _require_leader()
+    from app.services.face_service import rebuild_index
+    threading.Thread(target=rebuild_index, daemon=True).start()
+    return {"message": "FAISS index rebuild started"}
+
+
+@app.get("/index/stats")
+def index_stats(recall_sample: int = 0, k: int = 5):
+    from app.services.face_service import index_report
+    return index_report(recall_sample=recall_sample, k=k)
+
+
+@app.get("/metrics")
+def metrics():
+    from app.services.face_checkin_worker import get_stream_metrics, get_writer_metrics
+    from app.services.mjpeg_broadcaster import get_broadcast_metrics
+    return {
+        "leader": _leader.held,
+        "streams": get_stream_metrics(),
+        "checkin_writer": get_writer_metrics(),
+        "test_streams": get_broadcast_metrics(),
+    }
+
+
+@app.get("/test-stream")
+async def test_stream(rtsp_url: str = Query(...)):
+    from app.services import mjpeg_broadcaster
+    return StreamingResponse(
+        mjpeg_broadcaster.stream(rtsp_url),
+        media_type="multipart/x-mixed-replace; boundary=frame",
+    )
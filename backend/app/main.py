@@ -11,10 +11,14 @@ from fastapi.staticfiles import StaticFiles
 from app.core.database import engine, Base
 from app.core.config import settings
 from app.api.endpoints import company, users, approval, auth, attendance, leaves, rewards, reports, absent_check, approval_pattern, work_requests, badges, fitbit, badge_quests, fortune_wheel, expenses, face_test, social, pvp, badge_shop, sync, holidays, locations, presence, party_quest, combined
-from app.models import user as user_model, company as company_model, approval as approval_model, attendance as attendance_model, leave as leave_model, reward as reward_model, approval_pattern as approval_pattern_model, work_request as work_request_model, badge as badge_model, fitbit as fitbit_model, step_rewards as step_rewards_model, badge_quest as badge_quest_model, fortune_wheel as fortune_wheel_model, expense as expense_model, face_image as face_image_model, social as social_model, pvp as pvp_model, artifact as artifact_model, badge_shop as badge_shop_model, holiday as holiday_model, location as location_model, party_quest as party_quest_model
+from app.models import user as user_model, company as company_model, approval as approval_model, attendance as attendance_model, leave as leave_model, reward as reward_model, approval_pattern as approval_pattern_model, work_request as work_request_model, badge as badge_model, fitbit as fitbit_model, step_rewards as step_rewards_model, badge_quest as badge_quest_model, fortune_wheel as fortune_wheel_model, expense as expense_model, face_image as face_image_model, social as social_model, pvp as pvp_model, artifact as artifact_model, badge_shop as badge_shop_model, holiday as holiday_model, location as location_model, party_quest as party_quest_model, user_stats as user_stats_model, checkin_calendar as checkin_calendar_model
 from app.core.database import SessionLocal
+from app.services import badge_quest_tracker  # noqa: F401  (records quest-dirty users on every flush)
+from app.services import user_stats  # also keeps the user_stats rollup current on every flush
+from app.services import coin_log_types  # also types CoinLog rows inserted without a log_type
+from app.services import checkin_calendar  # also keeps check-in streak calendars current on every flush
 from app.core.security import get_password_hash
-from app.scheduler import start_scheduler
+from app.scheduler import start_scheduler, is_scheduler_leader
 
 # ── Logging Setup ──────────────────────────────────────────
 logging.basicConfig(
@@ -73,6 +77,8 @@ def auto_migrate():
             return t.name if t.name else "VARCHAR"
         if isinstance(t, sa.JSON):
             return "JSON"
+        if isinstance(t, sa.LargeBinary):
+            return "BYTEA"
         if isinstance(t, sa.Numeric):
             return f"NUMERIC({t.precision},{t.scale})" if t.precision else "NUMERIC"
         # Fallback
@@ -132,14 +138,19 @@ def auto_migrate():
             "ALTER TABLE attendance ALTER COLUMN longitude DROP NOT NULL",
             "ALTER TYPE leavestatus ADD VALUE IF NOT EXISTS 'pending_evidence'",
             "ALTER TYPE leavestatus ADD VALUE IF NOT EXISTS 'PENDING_EVIDENCE'",
+            "CREATE INDEX IF NOT EXISTS ix_coin_logs_type_user ON coin_logs (log_type, user_id)",
+            "DROP INDEX IF EXISTS ix_coin_logs_log_type",
+            # Badges are held at most once: drop duplicate awards, then enforce it
+            "DELETE FROM user_badges a USING user_badges b WHERE a.user_id = b.user_id AND a.badge_id = b.badge_id AND a.id > b.id",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_badges_user_badge ON user_badges (user_id, badge_id)",
         ]
         with engine.connect() as conn:
             for sql in extra_migrations:
                 try:
                     conn.execute(text(sql))
+                    conn.commit()
                 except Exception:
-                    pass  # Already applied or not applicable
-            conn.commit()
+                    conn.rollback()  # Already applied or not applicable (don't abort the rest)
 
         logger.info(f"✅ Auto-migration complete — {added} columns added")
     except Exception as e:
@@ -255,6 +266,30 @@ def startup_event():
         print(f"Error creating default admin: {e}")
     finally:
         db.close()
+
+    # Type legacy coin_logs rows, then backfill the user_stats rollup on first
+    # start (or rebuild it, since its classifiers read log_type) — in one worker only
+    if is_scheduler_leader():
+        db = SessionLocal()
+        try:
+            typed = coin_log_types.backfill(db)
+            user_stats.rebuild(db, only_if_empty=not typed)
+        except Exception as e:
+            logger.error(f"❌ user_stats backfill failed: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    # Backfill check-in streak calendars on first start — in one worker only
+    if is_scheduler_leader():
+        db = SessionLocal()
+        try:
+            checkin_calendar.rebuild(db, only_if_empty=True)
+        except Exception as e:
+            logger.error(f"❌ checkin_calendars backfill failed: {e}")
+            db.rollback()
+        finally:
+            db.close()
     
     # Start scheduler for auto coin/angel distribution
     start_scheduler()
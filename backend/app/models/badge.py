@@ -24,6 +24,7 @@ class UserBadge(Base):
     __tablename__ = "user_badges"
     __table_args__ = (
         Index("ix_user_badges_user", "user_id"),
+        Index("uq_user_badges_user_badge", "user_id", "badge_id", unique=True),  # a badge is held at most once
     )
 
     id = Column(Integer, primary_key=True, index=True)
@@ -21,3 +21,13 @@ class BadgeQuest(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     badge = relationship("Badge")
+
+
+class BadgeQuestDirty(Base):
+    """A (user, quest field) whose inputs changed since the last evaluation; user_id NULL = every user."""
+    __tablename__ = "badge_quest_dirty"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=True, index=True)
+    field = Column(String(50), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
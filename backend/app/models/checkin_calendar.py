@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, Date, DateTime, LargeBinary, Index
+from datetime import datetime
+from app.core.database import Base
+
+
+class CheckinCalendar(Base):
+    """
+    Per-user calendar of on-time check-in days, maintained by app.services.checkin_calendar.
+
+    days is a little-endian bitmap: bit i set = an on-time ("present") check-in
+    on local day first_day + i. The latest run of consecutive days and the
+    longest run are kept alongside so streak reads never touch the bitmap.
+    """
+    __tablename__ = "checkin_calendars"
+    __table_args__ = (
+        Index("ix_checkin_calendars_run", "run_end", "run_start"),
+        Index("ix_checkin_calendars_longest", "longest"),
+    )
+
+    user_id = Column(Integer, primary_key=True)
+    first_day = Column(Date, nullable=True)
+    days = Column(LargeBinary, nullable=False, default=b"")
+    run_start = Column(Date, nullable=True)   # latest run of consecutive days
+    run_end = Column(Date, nullable=True)
+    longest = Column(Integer, nullable=False, default=0)
+    longest_end = Column(Date, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -53,6 +53,7 @@ class Company(Base):
     face_confidence_threshold = Column(Float, default=0.5) # Min cosine similarity
     face_min_consecutive_frames = Column(Integer, default=20)  # Consecutive frames required
     face_min_face_height = Column(Integer, default=50)     # Minimum face height in px
+    face_match_mode = Column(String(20), default="nearest")  # nearest | vote (top-k per-user voting)
     face_start_time = Column(String(5), default="06:00")   # HH:MM start
     face_end_time = Column(String(5), default="10:30")     # HH:MM end
     # Man of the Month Rewards (JSON config)
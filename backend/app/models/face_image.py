@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, LargeBinary, ForeignKey
 from sqlalchemy.orm import relationship
 from app.core.database import Base
 from datetime import datetime
@@ -10,6 +10,11 @@ class UserFaceImage(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     image_path = Column(String(500), nullable=False)
+    # Normalized ArcFace embedding (512 × float32 little-endian), computed once at upload
+    embedding = Column(LargeBinary, nullable=True)
+    embedding_model = Column(String(50), nullable=True)  # model that produced the embedding, e.g. "buffalo_l"
+    det_score = Column(Float, nullable=True)  # face detection score of the embedded face
+    embedded_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", backref="face_images")
@@ -43,16 +43,20 @@ class CoinLog(Base):
     __tablename__ = "coin_logs"
     __table_args__ = (
         Index("ix_coin_logs_user_created", "user_id", "created_at"),
-        Index("ix_coin_logs_log_type", "log_type"),
+        Index("ix_coin_logs_type_user", "log_type", "user_id"),
     )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     amount = Column(Integer, nullable=False) # Positive or Negative
     reason = Column(String(255), nullable=False)
-    log_type = Column(String(30), nullable=True)  # mana_gift, lucky_draw, pvp, lottery, rescue, check_in, penalty, admin, system
+    # check_in, penalty, refund, admin, mana_gift, revival_contribution, revival_prayer, revived,
+    # rescue, lucky_draw, lottery, pvp, scroll_purchase, buff, party_quest, quest_reward,
+    # fortune_spin, fortune_prize, step_reward, badge_shop, redemption, auto_coin, auto_mana,
+    # motm, other — see app/services/coin_log_types.py
+    log_type = Column(String(30), nullable=True)
     created_by = Column(String(100), nullable=True) # "System" or Admin Name
-    sender_user_id = Column(Integer, nullable=True)  # User ID of the gift sender
+    sender_user_id = Column(Integer, nullable=True)  # User ID of the gift sender / counterparty
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User")
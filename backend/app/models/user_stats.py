@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, UniqueConstraint, Index
+from app.core.database import Base
+
+
+class UserStat(Base):
+    """
+    Rolled-up per-user counter, maintained by app.services.user_stats.
+
+    period is "all", a local month "YYYY-MM" or a local day "YYYY-MM-DD".
+    first_at is the UTC time of the earliest event counted in the bucket
+    (leaderboard tie-breaker: first to get there wins).
+    """
+    __tablename__ = "user_stats"
+    __table_args__ = (
+        UniqueConstraint("user_id", "period", "metric", name="uq_user_stats_user_period_metric"),
+        Index("ix_user_stats_metric_period_value", "metric", "period", "value"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    period = Column(String(10), nullable=False)
+    metric = Column(String(40), nullable=False)
+    value = Column(BigInteger, nullable=False, default=0)
+    first_at = Column(DateTime, nullable=True)
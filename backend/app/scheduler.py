@@ -6,23 +6,42 @@ Uses APScheduler with two cron jobs:
 """
 import logging
 import random
+import threading
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from app.core.database import SessionLocal
+from app.core.database import SessionLocal, LeaderLock
 from app.models.company import Company
 from app.models.user import User, UserRole
 from app.models.reward import CoinLog
 from app.models.badge import Badge, UserBadge
 from app.models.social import ThankYouCard
 from app.models.attendance import Attendance
-from app.models.social import AnonymousPraise
 from app.models.pvp import PvpBattle
+from app.services import user_stats, checkin_calendar
 
 logger = logging.getLogger("hr-api")
 
 DAY_MAP = {0: "mon", 1: "tue", 2: "wed", 3: "thu", 4: "fri", 5: "sat", 6: "sun"}
 
+SCHEDULER_LEADER_LOCK_ID = 0x53434844  # "SCHD" — pg advisory lock key
+
+_leader = LeaderLock(SCHEDULER_LEADER_LOCK_ID, "Scheduler")
+_leader_check = threading.Lock()
+
+
+def is_scheduler_leader():
+    """
+    Every API worker (uvicorn --workers N) runs this scheduler. Work that must
+    happen once per deployment — rollup backfills and full rebuilds — runs only
+    in the worker holding the scheduler advisory lock; it keeps the lock for
+    its lifetime and another worker takes over if its connection drops.
+    """
+    with _leader_check:
+        if _leader.held and _leader.still_held():
+            return True
+        return _leader.try_acquire()
+
 
 def auto_give_coins_and_angels():
     """Run daily: check if today matches auto_coin_day / auto_angel_day and distribute."""
@@ -54,6 +73,7 @@ def auto_give_coins_and_angels():
                         user_id=user.id,
                         amount=company.auto_coin_amount,
                         reason=f"🪙 Auto Coin ({today_code.upper()})",
+                        log_type="auto_coin",
                         created_by="System"
                     )
                     db.add(log)
@@ -71,6 +91,7 @@ def auto_give_coins_and_angels():
                         user_id=user.id,
                         amount=company.auto_angel_amount,
                         reason=f"🪽 Auto Angel Coins ({today_code.upper()})",
+                        log_type="auto_mana",
                         created_by="System"
                     )
                     db.add(log)
@@ -220,6 +241,7 @@ def distribute_lucky_wheel_reward():
             user_id=winner.id,
             amount=reward_amount,
             reason=f"🎰 Lucky Draw! Won {reward_amount} Gold ({today_code.upper()})",
+            log_type="lucky_draw",
             created_by="System"
         )
         db.add(log)
@@ -244,7 +266,7 @@ def distribute_lucky_wheel_reward():
 
 
 def evaluate_badge_quests():
-    """Run daily: evaluate all active badge quests and auto-award badges."""
+    """Run daily: full sweep of all active badge quests × all users (backstop for time-based fields)."""
     db = SessionLocal()
     try:
         from app.api.endpoints.badge_quests import _run_evaluation
@@ -257,6 +279,49 @@ def evaluate_badge_quests():
         db.close()
 
 
+def evaluate_dirty_badge_quests():
+    """Run every few seconds: evaluate badge quests for users whose quest inputs changed."""
+    db = SessionLocal()
+    try:
+        from app.api.endpoints.badge_quests import run_incremental_evaluation
+        result = run_incremental_evaluation(db)
+        if result["awarded"]:
+            logger.info(f"🏅 Badge Quest incremental evaluation: {result['awarded']} rewards granted")
+    except Exception as e:
+        logger.error(f"Badge Quest incremental evaluation error: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
+def rebuild_user_stats():
+    """Run nightly: recompute the user_stats rollup from source tables (repairs any drift)."""
+    if not is_scheduler_leader():
+        return
+    db = SessionLocal()
+    try:
+        user_stats.rebuild(db)
+    except Exception as e:
+        logger.error(f"❌ user_stats rebuild error: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
+def rebuild_checkin_calendars():
+    """Run nightly: recompute check-in streak calendars from attendance (repairs any drift)."""
+    if not is_scheduler_leader():
+        return
+    db = SessionLocal()
+    try:
+        checkin_calendar.rebuild(db)
+    except Exception as e:
+        logger.error(f"❌ checkin_calendars rebuild error: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
 def auto_process_absent_penalties():
     """Run daily at 12:00 UTC+7 (noon): deduct coins from users who didn't check in today."""
     db = SessionLocal()
@@ -346,6 +411,7 @@ def auto_process_absent_penalties():
                 user_id=user.id,
                 amount=-penalty_amount,
                 reason=f"Absent penalty ({target_date.isoformat()})",
+                log_type="penalty",
                 created_by="System"
             )
             db.add(log)
@@ -460,7 +526,7 @@ def weekly_thank_you_badge_eval():
 def distribute_motm_rewards():
     """Distribute Man of the Month rewards on the 1st of each month for the previous month."""
     import json
-    from sqlalchemy import func, or_
+    from sqlalchemy import func
     db = SessionLocal()
     try:
         company = db.query(Company).first()
@@ -491,86 +557,18 @@ def distribute_motm_rewards():
         # Find winners for each category
         category_winners = {}
 
-        # 1. Most Mana Received
-        mana_winner = (
-            db.query(CoinLog.user_id, func.sum(CoinLog.amount).label("total"))
-            .filter(
-                CoinLog.created_at >= pm_start_utc,
-                CoinLog.created_at < pm_end_utc,
-                or_(
-                    CoinLog.reason.ilike("%Received Angel Coins%"),
-                    CoinLog.reason.ilike("%Received Gold from%"),
-                    CoinLog.reason.ilike("%Received Mana from%"),
-                ),
-            )
-            .group_by(CoinLog.user_id)
-            .order_by(func.sum(CoinLog.amount).desc(), func.min(CoinLog.created_at).asc())
-            .first()
-        )
-        if mana_winner:
-            category_winners["motm_mana"] = mana_winner.user_id
-
-        # 2. Most Steps
-        try:
-            from app.models.fitbit import FitbitSteps
-            pm_start_date = first_of_last_month.date()
-            pm_end_date = first_of_this_month.date()
-            steps_winner = (
-                db.query(FitbitSteps.user_id, func.sum(FitbitSteps.steps).label("total"))
-                .filter(FitbitSteps.date >= pm_start_date, FitbitSteps.date < pm_end_date)
-                .group_by(FitbitSteps.user_id)
-                .order_by(func.sum(FitbitSteps.steps).desc(), func.min(FitbitSteps.date).asc())
-                .first()
-            )
-            if steps_winner:
-                category_winners["motm_steps"] = steps_winner.user_id
-        except Exception as e:
-            logger.warning(f"🏆 MOTM steps query error: {e}")
-
-        # 3. Most On-Time
-        ontime_winner = (
-            db.query(Attendance.user_id, func.count(Attendance.id).label("cnt"))
-            .filter(
-                Attendance.timestamp >= pm_start_utc,
-                Attendance.timestamp < pm_end_utc,
-                Attendance.status == "present",
-            )
-            .group_by(Attendance.user_id)
-            .order_by(func.count(Attendance.id).desc(), func.min(Attendance.timestamp).asc())
-            .first()
-        )
-        if ontime_winner:
-            category_winners["motm_ontime"] = ontime_winner.user_id
-
-        # 4. Most Gold Spent
-        gold_winner = (
-            db.query(CoinLog.user_id, func.sum(func.abs(CoinLog.amount)).label("total"))
-            .filter(
-                CoinLog.created_at >= pm_start_utc,
-                CoinLog.created_at < pm_end_utc,
-                CoinLog.amount < 0,
-                ~CoinLog.reason.ilike("%penalty%"),
-                ~CoinLog.reason.ilike("%Late%"),
-                ~CoinLog.reason.ilike("%Absent%"),
-            )
-            .group_by(CoinLog.user_id)
-            .order_by(func.sum(func.abs(CoinLog.amount)).desc(), func.min(CoinLog.created_at).asc())
-            .first()
-        )
-        if gold_winner:
-            category_winners["motm_gold_spent"] = gold_winner.user_id
-
-        # 5. Most Anonymous Praises
-        pm_month_str = first_of_last_month.strftime("%Y-%m")
-        praise_winner = (
-            db.query(AnonymousPraise.recipient_id, func.count(AnonymousPraise.id).label("cnt"))
-            .filter(AnonymousPraise.date_key.startswith(pm_month_str))
-            .group_by(AnonymousPraise.recipient_id)
-            .order_by(func.count(AnonymousPraise.id).desc(), func.min(AnonymousPraise.id).asc())
-            .first()
-        )
-        if praise_winner:
-            category_winners["motm_praises"] = praise_winner.recipient_id
+        # 1-5 come from the user_stats month buckets; ties go to whoever got there first
+        pm_month = user_stats.month_period(first_of_last_month)
+        for cat_key, metric in [
+            ("motm_mana", "gift_amount_received"),           # 1. Most Mana Received
+            ("motm_steps", "steps"),                         # 2. Most Steps
+            ("motm_ontime", "on_time_checkins"),             # 3. Most On-Time
+            ("motm_gold_spent", "gold_spent_voluntary"),     # 4. Most Gold Spent (excl. penalties)
+            ("motm_praises", "praise_received"),             # 5. Most Anonymous Praises
+        ]:
+            leader = user_stats.top(db, metric, pm_month, limit=1)
+            if leader:
+                category_winners[cat_key] = leader[0][0]
 
         # 6. Most Center Slips
         from app.models.expense import ExpenseRequest, ExpenseType
@@ -615,14 +613,14 @@ def distribute_motm_rewards():
             gold_amt = int(config.get("gold", 0) or 0)
             if gold_amt > 0:
                 user.coins = (user.coins or 0) + gold_amt
-                db.add(CoinLog(user_id=user.id, amount=gold_amt, reason=f"🏆 MOTM {month_label}: {label} — Gold +{gold_amt}", created_by="system"))
+                db.add(CoinLog(user_id=user.id, amount=gold_amt, reason=f"🏆 MOTM {month_label}: {label} — Gold +{gold_amt}", log_type="motm", created_by="system"))
                 applied.append(f"Gold +{gold_amt}")
 
             # Mana
             mana_amt = int(config.get("mana", 0) or 0)
             if mana_amt > 0:
                 user.angel_coins = (user.angel_coins or 0) + mana_amt
-                db.add(CoinLog(user_id=user.id, amount=mana_amt, reason=f"🏆 MOTM {month_label}: {label} — Mana +{mana_amt}", created_by="system"))
+                db.add(CoinLog(user_id=user.id, amount=mana_amt, reason=f"🏆 MOTM {month_label}: {label} — Mana +{mana_amt}", log_type="motm", created_by="system"))
                 applied.append(f"Mana +{mana_amt}")
 
             # Stats
@@ -872,12 +870,21 @@ scheduler = BackgroundScheduler()
 
 def start_scheduler():
     """Start the background scheduler."""
-    # Load FAISS index at startup
-    try:
-        from app.services.face_service import load_index
-        load_index()
-    except Exception as e:
-        logger.warning(f"⚠️ FAISS index load skipped: {e}")
+    from app.services.face_worker_client import is_remote
+    face_in_process = not is_remote()  # otherwise the standalone face worker owns it
+
+    # Warm the ArcFace model + FAISS index at startup (background, reported by /api/face/ready)
+    if face_in_process:
+        try:
+            import threading
+            from app.core.config import settings
+            from app.services.face_service import load_index, warm_up
+            if settings.FACE_WARMUP:
+                threading.Thread(target=warm_up, daemon=True, name="face-warmup").start()
+            else:
+                load_index()
+        except Exception as e:
+            logger.warning(f"⚠️ FAISS index load skipped: {e}")
 
     # Auto coin/angel giver at 00:01 UTC+7 (17:01 UTC)
     scheduler.add_job(
@@ -906,14 +913,41 @@ def start_scheduler():
         id="distribute_lucky_wheel_reward",
         replace_existing=True,
     )
-    # Badge Quest evaluation every 2 hours
+    # Badge Quests: evaluate changed (user, field) pairs every 10s ...
     scheduler.add_job(
-        evaluate_badge_quests,
+        evaluate_dirty_badge_quests,
         "interval",
-        hours=2,
+        seconds=10,
+        id="badge_quest_eval_dirty",
+        replace_existing=True,
+    )
+    # ... plus a full sweep at 00:20 UTC+7 (17:20 UTC) for time-based fields (days_employed)
+    scheduler.add_job(
+        evaluate_badge_quests,
+        "cron",
+        hour=17,
+        minute=20,
         id="badge_quest_eval",
         replace_existing=True,
     )
+    # user_stats rollup rebuild at 03:00 UTC+7 (20:00 UTC)
+    scheduler.add_job(
+        rebuild_user_stats,
+        "cron",
+        hour=20,
+        minute=0,
+        id="user_stats_rebuild",
+        replace_existing=True,
+    )
+    # Check-in streak calendar rebuild at 03:10 UTC+7 (20:10 UTC)
+    scheduler.add_job(
+        rebuild_checkin_calendars,
+        "cron",
+        hour=20,
+        minute=10,
+        id="checkin_calendar_rebuild",
+        replace_existing=True,
+    )
     # Auto absent penalties at 12:00 UTC+7 (05:00 UTC) — noon check
     scheduler.add_job(
         auto_process_absent_penalties,
@@ -923,15 +957,6 @@ def start_scheduler():
         id="auto_absent_penalty",
         replace_existing=True,
     )
-    # Face Recognition check-in worker — every 60 seconds
-    # The worker itself checks the time window (06:00–10:30 UTC+7) and exits if outside
-    scheduler.add_job(
-        _run_face_recognition,
-        "interval",
-        seconds=60,
-        id="face_recognition_worker",
-        replace_existing=True,
-    )
     # Weekly Thank You Star badge — every Monday 00:05 UTC+7 (17:05 UTC Sunday)
     scheduler.add_job(
         weekly_thank_you_badge_eval,
@@ -960,8 +985,26 @@ def start_scheduler():
         id="pvp_resolve",
         replace_existing=True,
     )
+    if face_in_process:
+        # Face Recognition check-in worker — every 60 seconds
+        # The worker itself checks the time window (06:00–10:30 UTC+7) and exits if outside
+        scheduler.add_job(
+            _run_face_recognition,
+            "interval",
+            seconds=60,
+            id="face_recognition_worker",
+            replace_existing=True,
+        )
+        # Face embeddings: re-embed images missing a current-model embedding (small batches)
+        scheduler.add_job(
+            _run_face_reembed,
+            "interval",
+            minutes=5,
+            id="face_reembed",
+            replace_existing=True,
+        )
     scheduler.start()
-    logger.info("✅ Scheduler started — auto coin/angel at 00:01, lucky draw at 12:30, absent penalty at 23:00, face recognition check, badge quest eval every 2h, thank you star Mon 00:05, MOTM rewards 1st 00:10, PVP resolve every 60s")
+    logger.info("✅ Scheduler started — auto coin/angel at 00:01, lucky draw at 12:30, absent penalty at 23:00, face recognition check, badge quest eval every 10s (full sweep 00:20), thank you star Mon 00:05, MOTM rewards 1st 00:10, PVP resolve every 60s")
 
 
 def _run_face_recognition():
@@ -971,3 +1014,12 @@ def _run_face_recognition():
         run()
     except Exception as e:
         logger.error(f"❌ Face recognition worker error: {e}")
+
+
+def _run_face_reembed():
+    """Wrapper to run the background face re-embed job safely."""
+    try:
+        from app.services.face_service import reembed_stale_faces
+        reembed_stale_faces()
+    except Exception as e:
+        logger.error(f"❌ Face re-embed job error: {e}")
@@ -44,6 +44,7 @@ class CompanyBase(BaseModel):
     face_confidence_threshold: Optional[float] = 0.5
     face_min_consecutive_frames: Optional[int] = 20
     face_min_face_height: Optional[int] = 50
+    face_match_mode: Optional[str] = "nearest"
     face_start_time: Optional[str] = "06:00"
     face_end_time: Optional[str] = "10:30"
     # Man of the Month Rewards
@@ -92,6 +93,7 @@ class CompanyUpdate(BaseModel):
     face_confidence_threshold: Optional[float] = None
     face_min_consecutive_frames: Optional[int] = None
     face_min_face_height: Optional[int] = None
+    face_match_mode: Optional[str] = None
     face_start_time: Optional[str] = None
     face_end_time: Optional[str] = None
     motm_rewards: Optional[str] = None
@@ -8,22 +8,24 @@ Supports SQL-like queries, e.g.:
     item_6 >= 3          (bought item #6 at least 3 times)
     leave_sick >= 1       (took sick leave at least once)
 
+AND binds tighter than OR; parentheses group, e.g.
+    total_steps >= 50 AND (mana_sent > 3 OR pvp_wins >= 1)
+
 Each "field" maps to a resolver function that computes the user's value.
 """
 import re
 import logging
+from functools import reduce
 from datetime import datetime, timedelta, timezone
+import numpy as np
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
 from app.models.user import User
-from app.models.attendance import Attendance
-from app.models.fitbit import FitbitSteps
 from app.models.reward import CoinLog, Redemption, Reward
 from app.models.leave import LeaveRequest
 from app.models.badge import UserBadge
-from app.models.pvp import PvpBattle
-from app.models.social import ThankYouCard, AnonymousPraise
+from app.services import user_stats, checkin_calendar
 
 logger = logging.getLogger("hr-api")
 
@@ -34,74 +36,29 @@ BKK = timezone(timedelta(hours=7))
 
 
 def _resolve_checkin_streak(user_id: int, db: Session) -> int:
-    records = (
-        db.query(Attendance)
-        .filter(Attendance.user_id == user_id, Attendance.status == "present")
-        .order_by(Attendance.timestamp.desc())
-        .all()
-    )
-    seen_dates = set()
-    for r in records:
-        local_dt = r.timestamp + timedelta(hours=7) if r.timestamp else None
-        if local_dt:
-            seen_dates.add(local_dt.date())
-    today = (datetime.utcnow() + timedelta(hours=7)).date()
-    streak = 0
-    d = today
-    while d in seen_dates:
-        streak += 1
-        d -= timedelta(days=1)
-    return streak
-
-
-def _resolve_total_steps(user_id: int, db: Session) -> int:
-    return (
-        db.query(func.coalesce(func.sum(FitbitSteps.steps), 0))
-        .filter(FitbitSteps.user_id == user_id)
-        .scalar()
-    )
+    return checkin_calendar.current_streaks(db, [user_id]).get(user_id, 0)
 
 
-def _resolve_mana_received(user_id: int, db: Session) -> int:
-    from sqlalchemy import or_
-    return (
-        db.query(func.count(CoinLog.id))
-        .filter(CoinLog.user_id == user_id, or_(
-            CoinLog.reason.ilike("%Received Angel Coins%"),
-            CoinLog.reason.ilike("%Received Gold from%"),
-            CoinLog.reason.ilike("%Received Mana from%"),
-        ))
-        .scalar()
-    )
-
-
-def _resolve_mana_sent(user_id: int, db: Session) -> int:
-    from sqlalchemy import or_
-    return (
-        db.query(func.count(CoinLog.id))
-        .filter(CoinLog.user_id == user_id, or_(
-            CoinLog.reason.ilike("%Sent%Angel Coins%"),
-            CoinLog.reason.ilike("%Sent%Mana as%"),
-        ))
-        .scalar()
-    )
+def _resolve_longest_checkin_streak(user_id: int, db: Session) -> int:
+    return checkin_calendar.longest_streaks(db, [user_id]).get(user_id, 0)
 
 
-def _resolve_revival_prayers(user_id: int, db: Session) -> int:
-    """How many times this user contributed a Revival Prayer."""
-    return (
-        db.query(func.count(CoinLog.id))
-        .filter(CoinLog.reason.ilike(f"%Revival Prayer from {db.query(User).filter(User.id == user_id).first().name if db.query(User).filter(User.id == user_id).first() else ''}%"))
-        .scalar()
-    )
+def _resolve_coin_logs(log_type: str, *filters):
+    """Factory: count a user's coin_logs of one log_type."""
+    def resolver(user_id: int, db: Session) -> int:
+        return (
+            db.query(func.count(CoinLog.id))
+            .filter(CoinLog.log_type == log_type, CoinLog.user_id == user_id, *filters)
+            .scalar()
+        )
+    return resolver
 
 
-def _resolve_scroll_purchased(user_id: int, db: Session) -> int:
-    return (
-        db.query(func.count(CoinLog.id))
-        .filter(CoinLog.user_id == user_id, CoinLog.reason.ilike("%Scroll of%"))
-        .scalar()
-    )
+def _resolve_stat(metric: str):
+    """Factory for all-time counters kept in the user_stats rollup."""
+    def resolver(user_id: int, db: Session) -> int:
+        return user_stats.get_value(db, metric, user_id)
+    return resolver
 
 
 def _resolve_user_field(field_name: str):
@@ -158,95 +115,8 @@ def _resolve_leave(leave_type: str):
     return resolver
 
 
-# ── Registry ──────────────────────────────────────────
-
-def _resolve_rescue_given(user_id: int, db: Session) -> int:
-    """How many times this user contributed a Revival Prayer to help someone."""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        return 0
-    user_name = f"{user.name} {user.surname or ''}".strip()
-    return db.query(func.count(CoinLog.id)).filter(
-        CoinLog.reason.ilike(f"%Revival Prayer from {user_name}%"),
-    ).scalar()
-
-
-def _resolve_rescue_received(user_id: int, db: Session) -> int:
-    """How many times this user was successfully revived."""
-    return db.query(func.count(CoinLog.id)).filter(
-        CoinLog.user_id == user_id,
-        CoinLog.reason.ilike("💖 Revived by%"),
-    ).scalar()
-
-
 # ── New resolvers ────────────────────────────────────
 
-def _resolve_total_checkins(user_id: int, db: Session) -> int:
-    """Total number of check-ins (any status)."""
-    return db.query(func.count(Attendance.id)).filter(
-        Attendance.user_id == user_id,
-    ).scalar()
-
-
-def _resolve_on_time_checkins(user_id: int, db: Session) -> int:
-    """Number of on-time check-ins (status = 'present')."""
-    return db.query(func.count(Attendance.id)).filter(
-        Attendance.user_id == user_id,
-        Attendance.status == "present",
-    ).scalar()
-
-
-def _resolve_pvp_wins(user_id: int, db: Session) -> int:
-    """Number of PvP battles won."""
-    return db.query(func.count(PvpBattle.id)).filter(
-        PvpBattle.winner_id == user_id,
-    ).scalar()
-
-
-def _resolve_pvp_battles(user_id: int, db: Session) -> int:
-    """Total PvP battles played (as player A or B)."""
-    from sqlalchemy import or_
-    return db.query(func.count(PvpBattle.id)).filter(
-        or_(PvpBattle.player_a_id == user_id, PvpBattle.player_b_id == user_id),
-    ).scalar()
-
-
-def _resolve_thank_you_sent(user_id: int, db: Session) -> int:
-    """Thank You Cards sent."""
-    return db.query(func.count(ThankYouCard.id)).filter(
-        ThankYouCard.sender_id == user_id,
-    ).scalar()
-
-
-def _resolve_thank_you_received(user_id: int, db: Session) -> int:
-    """Thank You Cards received."""
-    return db.query(func.count(ThankYouCard.id)).filter(
-        ThankYouCard.recipient_id == user_id,
-    ).scalar()
-
-
-def _resolve_anonymous_praise_sent(user_id: int, db: Session) -> int:
-    """Anonymous praises written."""
-    return db.query(func.count(AnonymousPraise.id)).filter(
-        AnonymousPraise.sender_id == user_id,
-    ).scalar()
-
-
-def _resolve_anonymous_praise_received(user_id: int, db: Session) -> int:
-    """Anonymous praises received."""
-    return db.query(func.count(AnonymousPraise.id)).filter(
-        AnonymousPraise.recipient_id == user_id,
-    ).scalar()
-
-
-def _resolve_fortune_spins(user_id: int, db: Session) -> int:
-    """Total Fortune Wheel spins."""
-    return db.query(func.count(CoinLog.id)).filter(
-        CoinLog.user_id == user_id,
-        CoinLog.reason.ilike("%Magic Lottery%"),
-    ).scalar()
-
-
 def _resolve_badges_count(user_id: int, db: Session) -> int:
     """Total badges earned."""
     return db.query(func.count(UserBadge.id)).filter(
@@ -254,23 +124,6 @@ def _resolve_badges_count(user_id: int, db: Session) -> int:
     ).scalar()
 
 
-def _resolve_gold_spent(user_id: int, db: Session) -> int:
-    """Total gold spent (sum of negative CoinLog amounts, returned as positive)."""
-    result = db.query(func.coalesce(func.sum(CoinLog.amount), 0)).filter(
-        CoinLog.user_id == user_id,
-        CoinLog.amount < 0,
-    ).scalar()
-    return abs(result)
-
-
-def _resolve_total_gold_earned(user_id: int, db: Session) -> int:
-    """Total gold earned (sum of positive CoinLog amounts)."""
-    return db.query(func.coalesce(func.sum(CoinLog.amount), 0)).filter(
-        CoinLog.user_id == user_id,
-        CoinLog.amount > 0,
-    ).scalar()
-
-
 def _resolve_days_employed(user_id: int, db: Session) -> int:
     """Days since start_date."""
     user = db.query(User).filter(User.id == user_id).first()
@@ -280,13 +133,18 @@ def _resolve_days_employed(user_id: int, db: Session) -> int:
     return max(0, (today - user.start_date).days)
 
 
+# ── Registry ──────────────────────────────────────────
+
 FIELD_RESOLVERS = {
     "checkin_streak": _resolve_checkin_streak,
-    "total_steps": _resolve_total_steps,
-    "mana_received": _resolve_mana_received,
-    "mana_sent": _resolve_mana_sent,
-    "revival_prayers": _resolve_revival_prayers,
-    "scroll_purchased": _resolve_scroll_purchased,
+    "longest_checkin_streak": _resolve_longest_checkin_streak,
+    "total_steps": _resolve_stat("steps"),
+    "mana_received": _resolve_stat("gifts_received"),
+    "mana_sent": _resolve_coin_logs("mana_gift", CoinLog.amount < 0),
+    # Revival prayers given: the sender's contribution log (the prayer logs on
+    # the recipient are deleted once the revival completes)
+    "revival_prayers": _resolve_coin_logs("revival_contribution"),
+    "scroll_purchased": _resolve_coin_logs("scroll_purchase"),
     "coins": _resolve_user_field("coins"),
     "angel_coins": _resolve_user_field("angel_coins"),
     "base_str": _resolve_user_field("base_str"),
@@ -299,24 +157,116 @@ FIELD_RESOLVERS = {
     # Total redemptions
     "total_redemptions": _resolve_total_redemptions,
     # Rescue
-    "rescue_given": _resolve_rescue_given,
-    "rescue_received": _resolve_rescue_received,
+    "rescue_given": _resolve_coin_logs("revival_contribution"),
+    "rescue_received": _resolve_coin_logs("revived"),
     # ── New fields ──
-    "total_checkins": _resolve_total_checkins,
-    "on_time_checkins": _resolve_on_time_checkins,
-    "pvp_wins": _resolve_pvp_wins,
-    "pvp_battles": _resolve_pvp_battles,
-    "thank_you_sent": _resolve_thank_you_sent,
-    "thank_you_received": _resolve_thank_you_received,
-    "anonymous_praise_sent": _resolve_anonymous_praise_sent,
-    "anonymous_praise_received": _resolve_anonymous_praise_received,
-    "fortune_spins": _resolve_fortune_spins,
+    "total_checkins": _resolve_stat("checkins"),
+    "on_time_checkins": _resolve_stat("on_time_checkins"),
+    "pvp_wins": _resolve_stat("pvp_wins"),
+    "pvp_battles": _resolve_stat("pvp_battles"),
+    "thank_you_sent": _resolve_stat("thank_you_sent"),
+    "thank_you_received": _resolve_stat("thank_you_received"),
+    "anonymous_praise_sent": _resolve_stat("praise_sent"),
+    "anonymous_praise_received": _resolve_stat("praise_received"),
+    "fortune_spins": _resolve_coin_logs("lottery"),
     "badges_count": _resolve_badges_count,
-    "gold_spent": _resolve_gold_spent,
-    "total_gold_earned": _resolve_total_gold_earned,
+    "gold_spent": _resolve_stat("gold_spent"),
+    "total_gold_earned": _resolve_stat("gold_earned"),
     "days_employed": _resolve_days_employed,
 }
 
+
+# ── Bulk resolvers ────────────────────────────────────
+# Same fields as FIELD_RESOLVERS, but each takes (db) → {user_id: int} for
+# every user in one query (a GROUP BY, or a user_stats lookup for rolled-up
+# counters). Users missing from the dict have value 0.
+
+
+def _count_by(db: Session, key_col, *filters) -> dict:
+    return dict(db.query(key_col, func.count()).filter(*filters).group_by(key_col).all())
+
+
+def _bulk_stat(metric: str):
+    def resolver(db: Session) -> dict:
+        return user_stats.get_values(db, metric)
+    return resolver
+
+
+def _bulk_user_field(field_name: str):
+    def resolver(db: Session) -> dict:
+        column = getattr(User, field_name)
+        return {uid: value or 0 for uid, value in db.query(User.id, column).all()}
+    return resolver
+
+
+def _bulk_coin_logs(log_type: str, *filters):
+    def resolver(db: Session) -> dict:
+        return _count_by(db, CoinLog.user_id, CoinLog.log_type == log_type, *filters)
+    return resolver
+
+
+def _bulk_item_purchased(reward_id: int):
+    def resolver(db: Session) -> dict:
+        return _count_by(
+            db, Redemption.user_id,
+            Redemption.reward_id == reward_id,
+            Redemption.status != "rejected",
+        )
+    return resolver
+
+
+def _bulk_leave(leave_type: str):
+    def resolver(db: Session) -> dict:
+        return _count_by(
+            db, LeaveRequest.user_id,
+            LeaveRequest.leave_type == leave_type,
+            LeaveRequest.status == "approved",
+        )
+    return resolver
+
+
+def _bulk_days_employed(db: Session) -> dict:
+    today = (datetime.utcnow() + timedelta(hours=7)).date()
+    return {
+        uid: max(0, (today - start).days)
+        for uid, start in db.query(User.id, User.start_date).filter(User.start_date.isnot(None)).all()
+    }
+
+
+BULK_RESOLVERS = {
+    "checkin_streak": checkin_calendar.current_streaks,
+    "longest_checkin_streak": checkin_calendar.longest_streaks,
+    "total_steps": _bulk_stat("steps"),
+    "mana_received": _bulk_stat("gifts_received"),
+    "mana_sent": _bulk_coin_logs("mana_gift", CoinLog.amount < 0),
+    "revival_prayers": _bulk_coin_logs("revival_contribution"),
+    "scroll_purchased": _bulk_coin_logs("scroll_purchase"),
+    "coins": _bulk_user_field("coins"),
+    "angel_coins": _bulk_user_field("angel_coins"),
+    "base_str": _bulk_user_field("base_str"),
+    "base_def": _bulk_user_field("base_def"),
+    "base_luk": _bulk_user_field("base_luk"),
+    "leave_sick": _bulk_leave("sick"),
+    "leave_vacation": _bulk_leave("vacation"),
+    "leave_business": _bulk_leave("business"),
+    "total_redemptions": lambda db: _count_by(db, Redemption.user_id, Redemption.status != "rejected"),
+    "rescue_given": _bulk_coin_logs("revival_contribution"),
+    "rescue_received": _bulk_coin_logs("revived"),
+    "total_checkins": _bulk_stat("checkins"),
+    "on_time_checkins": _bulk_stat("on_time_checkins"),
+    "pvp_wins": _bulk_stat("pvp_wins"),
+    "pvp_battles": _bulk_stat("pvp_battles"),
+    "thank_you_sent": _bulk_stat("thank_you_sent"),
+    "thank_you_received": _bulk_stat("thank_you_received"),
+    "anonymous_praise_sent": _bulk_stat("praise_sent"),
+    "anonymous_praise_received": _bulk_stat("praise_received"),
+    "fortune_spins": _bulk_coin_logs("lottery"),
+    "badges_count": lambda db: _count_by(db, UserBadge.user_id),
+    "gold_spent": _bulk_stat("gold_spent"),
+    "total_gold_earned": _bulk_stat("gold_earned"),
+    "days_employed": _bulk_days_employed,
+}
+
 # item_<id> fields are registered dynamically — see _ensure_item_fields()
 
 _item_fields_loaded = False
@@ -332,6 +282,7 @@ def _ensure_item_fields(db: Session):
             key = f"item_{r.id}"
             if key not in FIELD_RESOLVERS:
                 FIELD_RESOLVERS[key] = _resolve_item_purchased(r.id)
+                BULK_RESOLVERS[key] = _bulk_item_purchased(r.id)
                 FIELD_DESCRIPTIONS[key] = {
                     "label": f"🛒 {r.name}",
                     "desc": f"Times redeemed \"{r.name}\" (id={r.id})",
@@ -363,6 +314,7 @@ FIELD_DESCRIPTIONS = {
     # ── New fields ──
     "total_checkins":           {"label": "📋 Total Check-ins",        "desc": "Total number of check-ins",                         "example": "total_checkins >= 30"},
     "on_time_checkins":         {"label": "⏰ On-time Check-ins",      "desc": "Number of on-time check-ins",                       "example": "on_time_checkins >= 20"},
+    "longest_checkin_streak":   {"label": "🔥 Best Check-in Streak",   "desc": "Longest run of on-time check-in days",              "example": "longest_checkin_streak >= 20"},
     "pvp_wins":                 {"label": "⚔️ PvP Wins",              "desc": "PvP battles won",                                   "example": "pvp_wins >= 5"},
     "pvp_battles":              {"label": "🏟️ PvP Battles",           "desc": "Total PvP battles played",                          "example": "pvp_battles >= 10"},
     "thank_you_sent":           {"label": "💌 Thank You Sent",         "desc": "Thank You Cards sent",                              "example": "thank_you_sent >= 4"},
@@ -386,7 +338,15 @@ CONDITION_LABELS = {
 }
 
 
-# ── Query Parser ──────────────────────────────────────
+# ── Query Compiler ────────────────────────────────────
+#
+# Grammar (AND binds tighter than OR, parentheses group):
+#     expr      := and_expr (OR and_expr)*
+#     and_expr  := atom (AND atom)*
+#     atom      := "(" expr ")" | field op number
+#
+# Compiled queries are cached by query string, so each quest is parsed once
+# per process rather than once per (quest, user).
 
 OPERATORS = {
     ">=": lambda a, b: a >= b,
@@ -402,15 +362,145 @@ CONDITION_RE = re.compile(
     r"(\w+)\s*(>=|<=|!=|==|>|<)\s*(\d+)"
 )
 
+_TOKEN_RE = re.compile(
+    r"\s*(?:(?P<paren>[()])|(?P<conj>AND|OR)(?=[\s(])|(?P<cond>\w+\s*(?:>=|<=|!=|==|>|<)\s*\d+))",
+    re.IGNORECASE,
+)
+
+_COMPILED_CACHE_MAX = 256
+_compiled_cache = {}
+
+
+class CompiledQuery:
+    """
+    A parsed quest query.
+
+    The AST is nested tuples: ("cond", field, op, value), ("and", [nodes])
+    or ("or", [nodes]). `fields` lists the referenced fields in first-use order.
+    """
 
-def parse_query(query_str: str, db: Session = None):
+    def __init__(self, source: str, tree, conditions: list):
+        self.source = source
+        self.tree = tree
+        self.conditions = conditions  # [(field, op, value), ...] in query order
+        self.fields = list(dict.fromkeys(c[0] for c in conditions))
+
+    def evaluate(self, values: dict) -> bool:
+        """Evaluate for one user; values maps field → int."""
+        return bool(_eval_node(self.tree, values))
+
+    def evaluate_bulk(self, user_ids, values: dict) -> list:
+        """
+        Evaluate for many users at once over column arrays.
+
+        values maps field → {user_id: int} (missing users count as 0).
+        Returns the user ids that match, in input order.
+        """
+        user_ids = list(user_ids)
+        if not user_ids:
+            return []
+        columns = {
+            field: np.fromiter((values[field].get(uid, 0) for uid in user_ids), dtype=np.int64, count=len(user_ids))
+            for field in self.fields
+        }
+        mask = np.broadcast_to(_eval_node(self.tree, columns), (len(user_ids),))
+        return [uid for uid, hit in zip(user_ids, mask) if hit]
+
+
+def _eval_node(node, columns):
+    kind = node[0]
+    if kind == "cond":
+        _, field, op_str, value = node
+        return OPERATORS[op_str](columns[field], value)
+    results = [_eval_node(child, columns) for child in node[1]]
+    combine = np.logical_and if kind == "and" else np.logical_or
+    return reduce(combine, results)
+
+
+def _register_field(field: str):
+    """Support dynamic item_<id> fields even if not pre-loaded."""
+    if field not in FIELD_RESOLVERS and field.startswith("item_"):
+        try:
+            reward_id = int(field.split("_", 1)[1])
+            FIELD_RESOLVERS[field] = _resolve_item_purchased(reward_id)
+            BULK_RESOLVERS[field] = _bulk_item_purchased(reward_id)
+        except (ValueError, IndexError):
+            pass
+    if field not in FIELD_RESOLVERS:
+        raise ValueError(f"Unknown field: '{field}'. Available: {', '.join(sorted(FIELD_RESOLVERS.keys()))}")
+
+
+def _tokenize(q: str) -> list:
+    tokens = []
+    pos = 0
+    while pos < len(q):
+        if not q[pos:].strip():
+            break
+        m = _TOKEN_RE.match(q, pos)
+        if not m:
+            bad = re.split(r"\s+(?:AND|OR)\s+", q[pos:].strip(), maxsplit=1, flags=re.IGNORECASE)[0]
+            raise ValueError(f"Invalid condition: '{bad}'. Expected format: field >= value")
+        if m.group("paren"):
+            tokens.append(("paren", m.group("paren")))
+        elif m.group("conj"):
+            tokens.append(("conj", m.group("conj").upper()))
+        else:
+            cm = CONDITION_RE.fullmatch(m.group("cond"))
+            tokens.append(("cond", (cm.group(1), cm.group(2), int(cm.group(3)))))
+        pos = m.end()
+    return tokens
+
+
+def _parse(tokens: list, conditions: list):
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def parse_expr(conj):
+        nonlocal pos
+        sub = parse_and if conj == "OR" else parse_atom
+        children = [sub()]
+        while peek() == ("conj", conj):
+            pos += 1
+            children.append(sub())
+        return children[0] if len(children) == 1 else (conj.lower(), children)
+
+    def parse_and():
+        return parse_expr("AND")
+
+    def parse_atom():
+        nonlocal pos
+        kind, value = peek()
+        if kind == "paren" and value == "(":
+            pos += 1
+            node = parse_expr("OR")
+            if peek() != ("paren", ")"):
+                raise ValueError("Missing closing parenthesis")
+            pos += 1
+            return node
+        if kind == "cond":
+            pos += 1
+            field, op_str, number = value
+            _register_field(field)
+            conditions.append(value)
+            return ("cond", field, op_str, number)
+        if kind is None:
+            raise ValueError("Query ends unexpectedly; expected a condition")
+        raise ValueError(f"Unexpected '{value}'; expected a condition")
+
+    tree = parse_expr("OR")
+    if pos != len(tokens):
+        raise ValueError(f"Unexpected '{tokens[pos][1]}'")
+    return tree
+
+
+def compile_query(query_str: str, db: Session = None) -> CompiledQuery:
     """
-    Parse a query string into structured conditions.
-    Returns: list of (conjunction, field, op_str, value) tuples
-    conjunction is 'AND' | 'OR' | None (first condition)
+    Compile a query string (cached by string).
 
-    Example: "total_steps >= 50 AND mana_sent > 3"
-    → [(None, 'total_steps', '>=', 50), ('AND', 'mana_sent', '>', 3)]
+    Example: "total_steps >= 50 AND (mana_sent > 3 OR pvp_wins >= 1)"
+    Raises ValueError for empty or malformed queries and unknown fields.
     """
     if not query_str or not query_str.strip():
         raise ValueError("Query is empty")
@@ -419,88 +509,77 @@ def parse_query(query_str: str, db: Session = None):
     if db:
         _ensure_item_fields(db)
 
-    # Normalize whitespace
     q = query_str.strip()
-
-    # Split by AND/OR (case insensitive), keeping the conjunction
-    parts = re.split(r"\s+(AND|OR)\s+", q, flags=re.IGNORECASE)
+    compiled = _compiled_cache.get(q)
+    if compiled is not None:
+        return compiled
 
     conditions = []
-    conjunction = None
-
-    for part in parts:
-        upper = part.strip().upper()
-        if upper in ("AND", "OR"):
-            conjunction = upper
-            continue
-
-        match = CONDITION_RE.fullmatch(part.strip())
-        if not match:
-            raise ValueError(f"Invalid condition: '{part.strip()}'. Expected format: field >= value")
-
-        field = match.group(1)
-        op_str = match.group(2)
-        value = int(match.group(3))
-
-        # Support dynamic item_<id> fields even if not pre-loaded
-        if field not in FIELD_RESOLVERS and field.startswith("item_"):
-            try:
-                reward_id = int(field.split("_", 1)[1])
-                FIELD_RESOLVERS[field] = _resolve_item_purchased(reward_id)
-            except (ValueError, IndexError):
-                pass
-
-        if field not in FIELD_RESOLVERS:
-            raise ValueError(f"Unknown field: '{field}'. Available: {', '.join(sorted(FIELD_RESOLVERS.keys()))}")
-
-        conditions.append((conjunction, field, op_str, value))
-        conjunction = None  # reset after consuming
-
-    if not conditions:
-        raise ValueError("No valid conditions found")
-
-    return conditions
+    tree = _parse(_tokenize(q), conditions)
+    compiled = CompiledQuery(q, tree, conditions)
+    if len(_compiled_cache) >= _COMPILED_CACHE_MAX:
+        _compiled_cache.clear()
+    _compiled_cache[q] = compiled
+    return compiled
 
 
 def validate_query(query_str: str, db: Session = None) -> dict:
     """Validate a query string. Returns {valid: bool, error: str|None, fields: list}."""
     try:
-        conditions = parse_query(query_str, db)
-        fields = [c[1] for c in conditions]
-        return {"valid": True, "error": None, "fields": fields, "condition_count": len(conditions)}
+        compiled = compile_query(query_str, db)
+        fields = [c[0] for c in compiled.conditions]
+        return {"valid": True, "error": None, "fields": fields, "condition_count": len(compiled.conditions)}
     except ValueError as e:
         return {"valid": False, "error": str(e), "fields": [], "condition_count": 0}
 
 
 def evaluate_query(user_id: int, query_str: str, db: Session) -> bool:
-    """Evaluate a query string against a user. Returns True if all conditions are met."""
-    conditions = parse_query(query_str, db)
+    """Evaluate a query string against a user. Returns True if the query holds."""
+    return compile_query(query_str, db).evaluate(resolve_user_fields(user_id, query_str, db))
 
-    # Evaluate with AND/OR logic
-    result = None
-    for conjunction, field, op_str, value in conditions:
-        resolver = FIELD_RESOLVERS[field]
-        actual = resolver(user_id, db)
-        op_fn = OPERATORS[op_str]
-        cond_result = op_fn(actual, value)
 
-        if result is None:
-            result = cond_result
-        elif conjunction == "OR":
-            result = result or cond_result
-        else:  # AND (default)
-            result = result and cond_result
+def resolve_user_fields(user_id: int, query_str: str, db: Session) -> dict:
+    """Resolve all field values mentioned in a query for a given user."""
+    compiled = compile_query(query_str, db)
+    return {field: FIELD_RESOLVERS[field](user_id, db) for field in compiled.fields}
 
-    return bool(result)
 
+def effective_query(quest) -> str:
+    """A quest's query; legacy condition_type/threshold quests auto-convert to one."""
+    if quest.condition_query:
+        return quest.condition_query
+    if quest.condition_type:
+        return f"{quest.condition_type} >= {quest.threshold or 1}"
+    return None
 
-def resolve_user_fields(user_id: int, query_str: str, db: Session) -> dict:
-    """Resolve all field values mentioned in a query for a given user."""
-    conditions = parse_query(query_str, db)
-    values = {}
-    for _, field, _, _ in conditions:
-        if field not in values:
-            resolver = FIELD_RESOLVERS[field]
-            values[field] = resolver(user_id, db)
-    return values
 
+# ── Bulk evaluation ───────────────────────────────────
+
+BULK_USER_THRESHOLD = 50  # above this many users one GROUP BY beats per-user queries
+
+def resolve_fields_bulk(fields, db: Session) -> dict:
+    """Resolve each field for all users at once: {field: {user_id: value}}."""
+    _ensure_item_fields(db)
+    return {field: BULK_RESOLVERS[field](db) for field in set(fields)}
+
+
+def evaluate_query_bulk(query_str: str, user_ids, db: Session, values: dict = None) -> list:
+    """
+    Evaluate a query for many users; returns the ids that match.
+
+    `values` is a resolve_fields_bulk() result to share across queries; any
+    field it lacks is resolved (and added to it) here.
+    """
+    compiled = compile_query(query_str, db)
+    if values is None:
+        values = {}
+    values.update(resolve_fields_bulk([f for f in compiled.fields if f not in values], db))
+    return compiled.evaluate_bulk(user_ids, values)
+
+
+def resolve_fields_for_users(fields, user_ids, db: Session) -> dict:
+    """resolve_fields_bulk() for a subset of users (None = everyone), per user when few."""
+    if user_ids is None or len(user_ids) > BULK_USER_THRESHOLD:
+        return resolve_fields_bulk(fields, db)
+    _ensure_item_fields(db)
+    return {field: {uid: FIELD_RESOLVERS[field](uid, db) for uid in user_ids} for field in set(fields)}
@@ -0,0 +1,114 @@
+"""
+Change tracking for incremental badge quest evaluation.
+
+An after_flush hook on SessionLocal looks at the rows each flush inserts,
+updates or deletes, and records which (user, quest field) pairs they feed
+as badge_quest_dirty rows, in the same transaction as the write. Because
+the marks live in the database, writes from any API worker or the face
+worker are seen, and a rolled-back write leaves no mark.
+
+The short-interval evaluator (badge_quests.run_incremental_evaluation)
+drains these rows and recomputes only the affected pairs. Creating or
+editing a quest marks its fields dirty for every user (user_id NULL).
+"""
+
+import logging
+
+from sqlalchemy import event, inspect
+
+from app.core.database import SessionLocal
+from app.models.user import User
+from app.models.attendance import Attendance
+from app.models.fitbit import FitbitSteps
+from app.models.reward import CoinLog, Redemption
+from app.models.leave import LeaveRequest
+from app.models.badge import UserBadge
+from app.models.badge_quest import BadgeQuest, BadgeQuestDirty
+from app.models.pvp import PvpBattle
+from app.models.social import ThankYouCard, AnonymousPraise
+
+logger = logging.getLogger("hr-api")
+
+# model → [(user id attribute, fields fed for that user)]
+TRACKED = {
+    Attendance: [("user_id", ("checkin_streak", "longest_checkin_streak", "total_checkins", "on_time_checkins"))],
+    FitbitSteps: [("user_id", ("total_steps",))],
+    CoinLog: [
+        ("user_id", ("mana_received", "mana_sent", "revival_prayers", "scroll_purchased", "rescue_given",
+                     "rescue_received", "fortune_spins", "gold_spent", "total_gold_earned")),
+    ],
+    Redemption: [("user_id", ("total_redemptions",))],
+    LeaveRequest: [("user_id", ("leave_sick", "leave_vacation", "leave_business"))],
+    UserBadge: [("user_id", ("badges_count",))],
+    PvpBattle: [
+        ("player_a_id", ("pvp_battles",)),
+        ("player_b_id", ("pvp_battles",)),
+        ("winner_id", ("pvp_wins",)),
+    ],
+    ThankYouCard: [("sender_id", ("thank_you_sent",)), ("recipient_id", ("thank_you_received",))],
+    AnonymousPraise: [("sender_id", ("anonymous_praise_sent",)), ("recipient_id", ("anonymous_praise_received",))],
+}
+
+# User columns that are quest fields (column → field); other User updates are ignored
+USER_COLUMNS = {
+    "coins": "coins",
+    "angel_coins": "angel_coins",
+    "base_str": "base_str",
+    "base_def": "base_def",
+    "base_luk": "base_luk",
+    "start_date": "days_employed",
+}
+
+
+def _marks_for(obj, changed_only: bool) -> set:
+    """(user_id, field) pairs fed by one flushed object."""
+    marks = set()
+    if isinstance(obj, User):
+        state = inspect(obj)
+        for column, field in USER_COLUMNS.items():
+            if not changed_only or state.attrs[column].history.has_changes():
+                marks.add((obj.id, field))
+        return marks
+
+    if isinstance(obj, BadgeQuest):
+        from app.services.badge_quest_evaluator import compile_query, effective_query
+        query = effective_query(obj)
+        if query and obj.is_active:
+            try:
+                marks.update((None, field) for field in compile_query(query).fields)
+            except ValueError:
+                pass
+        return marks
+
+    for attr, fields in TRACKED.get(type(obj), ()):
+        uids = {getattr(obj, attr)}
+        if changed_only:
+            # A reassigned id (e.g. winner set when a battle resolves) dirties old and new owner
+            uids.update(inspect(obj).attrs[attr].history.deleted or ())
+        for uid in uids:
+            if uid is not None:
+                marks.update((uid, field) for field in fields)
+                if isinstance(obj, Redemption) and obj.reward_id is not None:
+                    marks.add((uid, f"item_{obj.reward_id}"))
+    return marks
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _record_dirty(session, flush_context):
+    marks = set()
+    try:
+        for obj in session.new:
+            marks |= _marks_for(obj, changed_only=False)
+        for obj in session.deleted:
+            marks |= _marks_for(obj, changed_only=False)
+        for obj in session.dirty:
+            if session.is_modified(obj, include_collections=False):
+                marks |= _marks_for(obj, changed_only=True)
+    except Exception as e:
+        logger.error(f"Badge quest change tracking failed: {e}")
+        return
+    if marks:
+        session.connection().execute(
+            BadgeQuestDirty.__table__.insert(),
+            [{"user_id": uid, "field": field} for uid, field in marks],
+        )
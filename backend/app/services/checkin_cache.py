@@ -0,0 +1,114 @@
+"""
+"Already checked in today" cache shared by the GPS and face check-in paths.
+
+Backed by the attendance table itself, so it survives restarts and is
+shared across processes (API workers, face worker): the cache is warmed
+with one query for the local day and then kept current by reading only
+attendance rows with an id above the last one seen (a primary-key range
+scan). Lookups are O(1) set membership and never touch the database.
+
+It is a positive cache: a hit is definitive, a miss means "not seen yet"
+and write paths still confirm against the database before inserting.
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+logger = logging.getLogger("hr-api")
+
+CHECKIN_STATUSES = ("present", "late", "absent")
+REFRESH_SECONDS = 5.0  # min interval between background refreshes
+
+_lock = threading.Lock()
+_day = None            # local date the cache is for
+_user_ids = set()      # users with a check-in today
+_last_id = None        # highest attendance id seen; None = not warmed
+_last_refresh = 0.0
+
+
+def _local_today():
+    return (datetime.utcnow() + timedelta(hours=7)).date()
+
+
+def _roll_day():
+    """Reset the cache when the local day changes (caller holds _lock)."""
+    global _day, _user_ids, _last_id
+    today = _local_today()
+    if _day != today:
+        _day = today
+        _user_ids = set()
+        _last_id = None
+    return today
+
+
+def contains(user_id) -> bool:
+    """True if the user is known to have checked in today."""
+    with _lock:
+        _roll_day()
+        return user_id in _user_ids
+
+
+def mark(user_id):
+    """Record a check-in committed by this process."""
+    with _lock:
+        _roll_day()
+        _user_ids.add(user_id)
+
+
+def refresh(db=None, force=False):
+    """
+    Pull check-ins written (by any process) since the last refresh.
+    The first call of a day warms the cache with one query for the whole day.
+    Rate-limited to REFRESH_SECONDS unless force=True.
+    """
+    global _last_id, _last_refresh
+    from app.core.database import SessionLocal
+    from app.models.attendance import Attendance
+
+    with _lock:
+        now = time.time()
+        if not force and now - _last_refresh < REFRESH_SECONDS:
+            return
+        _last_refresh = now  # claim this refresh
+        today = _roll_day()
+        last_id = _last_id
+
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    try:
+        day_start_utc = datetime.combine(today, datetime.min.time()) - timedelta(hours=7)
+        day_end_utc = datetime.combine(today, datetime.max.time()) - timedelta(hours=7)
+
+        if last_id is None:
+            # Warm: today's check-ins + current high-water mark
+            max_id = db.query(func.max(Attendance.id)).scalar() or 0
+            rows = db.query(Attendance.id, Attendance.user_id, Attendance.status, Attendance.timestamp).filter(
+                Attendance.timestamp >= day_start_utc,
+                Attendance.timestamp <= day_end_utc,
+                Attendance.id <= max_id,
+            ).all()
+        else:
+            rows = db.query(Attendance.id, Attendance.user_id, Attendance.status, Attendance.timestamp).filter(
+                Attendance.id > last_id,
+            ).all()
+            max_id = max([r.id for r in rows], default=last_id)
+    finally:
+        if own_session:
+            db.close()
+
+    checked_in = {
+        r.user_id for r in rows
+        if r.status in CHECKIN_STATUSES and r.timestamp and day_start_utc <= r.timestamp <= day_end_utc
+    }
+    with _lock:
+        if _day != today:
+            return  # day rolled over while querying
+        _user_ids.update(checked_in)
+        _last_id = max(max_id, _last_id or 0)
+        if last_id is None:
+            logger.info(f"📋 Check-in cache warmed for {today}: {len(_user_ids)} user(s) checked in")
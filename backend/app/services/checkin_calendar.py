@@ -0,0 +1,255 @@
+"""
+Per-user on-time check-in calendars (the checkin_calendars table).
+
+Each user has a bitmap of local days with an on-time ("present") check-in,
+plus the latest run of consecutive days and the longest run ever, so the
+current streak and the best streak are O(1) reads: badge quests
+(checkin_streak / longest_checkin_streak), profile pages and the streak
+leaderboards read these rows instead of walking a user's attendance.
+
+Maintenance follows user_stats: SessionLocal flush hooks collect the
+(user, local day) pairs touched by inserted, updated or deleted Attendance
+rows (old values are read by primary key before the flush), re-check those
+days against the attendance table and update the calendar rows in the same
+transaction, under a row lock. rebuild() recomputes everything and runs at
+startup when the table is empty and nightly.
+"""
+
+import logging
+import re
+from datetime import datetime, date, timedelta
+
+from sqlalchemy import event, select, delete, text
+
+from app.core.database import SessionLocal
+from app.models.attendance import Attendance
+from app.models.checkin_calendar import CheckinCalendar
+
+logger = logging.getLogger("hr-api")
+
+_RUN_RE = re.compile("1+")
+
+
+def _local_day(ts) -> date:
+    return (ts + timedelta(hours=7)).date()
+
+
+def _utc_start(day: date) -> datetime:
+    return datetime.combine(day, datetime.min.time()) - timedelta(hours=7)
+
+
+def _today() -> date:
+    return _local_day(datetime.utcnow())
+
+
+# ── Bitmap helpers ────────────────────────────────────
+
+def _encode(bits: int) -> bytes:
+    return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+
+def _decode(data) -> int:
+    return int.from_bytes(data or b"", "little")
+
+
+def _set_day(first_day, bits: int, day: date, present: bool):
+    """Set or clear one day; returns the (possibly re-based) (first_day, bits)."""
+    if first_day is None or day < first_day:
+        if not present:
+            return first_day, bits
+        if first_day is not None:
+            bits <<= (first_day - day).days
+        first_day = day
+    mask = 1 << (day - first_day).days
+    return first_day, (bits | mask) if present else (bits & ~mask)
+
+
+def _summarize(first_day, bits: int) -> dict:
+    """Latest run and longest run of consecutive days in a bitmap."""
+    summary = {"run_start": None, "run_end": None, "longest": 0, "longest_end": None}
+    if first_day is None or not bits:
+        return summary
+    # Bit i is character i of the reversed binary string
+    for m in _RUN_RE.finditer(format(bits, "b")[::-1]):
+        start, end = first_day + timedelta(days=m.start()), first_day + timedelta(days=m.end() - 1)
+        summary["run_start"], summary["run_end"] = start, end
+        if m.end() - m.start() > summary["longest"]:
+            summary["longest"], summary["longest_end"] = m.end() - m.start(), end
+    return summary
+
+
+def _row(user_id: int, first_day, bits: int) -> dict:
+    return {"user_id": user_id, "first_day": first_day, "days": _encode(bits),
+            "updated_at": datetime.utcnow(), **_summarize(first_day, bits)}
+
+
+def _current(run_start, run_end, today: date) -> int:
+    return (run_end - run_start).days + 1 if run_end == today else 0
+
+
+# ── Flush hooks ───────────────────────────────────────
+
+def _touched(row):
+    if row.user_id is None or row.timestamp is None:
+        return None
+    return (row.user_id, _local_day(row.timestamp))
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def _capture_old_days(session, flush_context, instances):
+    """Remember the (user, day) an updated/deleted check-in occupied before the flush."""
+    touched = session.info.setdefault("checkin_calendar_days", set())
+    updated = session.info.setdefault("checkin_calendar_updated", [])
+    changed = [o for o in session.dirty if isinstance(o, Attendance) and session.is_modified(o, include_collections=False)]
+    deleted = [o for o in session.deleted if isinstance(o, Attendance)]
+    if not changed and not deleted:
+        return
+    table = Attendance.__table__
+    conn = session.connection()
+    for obj in changed + deleted:
+        old = conn.execute(select(table.c.user_id, table.c.timestamp).where(table.c.id == obj.id)).first()
+        if old is not None and _touched(old):
+            touched.add(_touched(old))
+    updated.extend(changed)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _update_calendars(session, flush_context):
+    touched = session.info.pop("checkin_calendar_days", set())
+    updated = session.info.pop("checkin_calendar_updated", [])
+    for obj in list(session.new) + updated:
+        if isinstance(obj, Attendance) and _touched(obj):
+            touched.add(_touched(obj))
+    if touched:
+        _apply(session.connection(), touched)
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _discard_days(session, previous_transaction):
+    session.info.pop("checkin_calendar_days", None)
+    session.info.pop("checkin_calendar_updated", None)
+
+
+def _apply(conn, touched: set):
+    """Re-check the touched (user, day) pairs against attendance and update the calendars."""
+    user_ids = sorted({uid for uid, _ in touched})
+    days = {day for _, day in touched}
+    att = Attendance.__table__
+    present = {
+        (uid, _local_day(ts))
+        for uid, ts in conn.execute(
+            select(att.c.user_id, att.c.timestamp).where(
+                att.c.user_id.in_(user_ids),
+                att.c.status == "present",
+                att.c.timestamp >= _utc_start(min(days)),
+                att.c.timestamp < _utc_start(max(days) + timedelta(days=1)),
+            )
+        )
+    }
+
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    cal = CheckinCalendar.__table__
+    # Make sure every row exists, then lock them in user order before read-modify-write
+    conn.execute(
+        insert(cal).on_conflict_do_nothing(index_elements=["user_id"]),
+        [{"user_id": uid, "days": b"", "longest": 0} for uid in user_ids],
+    )
+    query = select(cal.c.user_id, cal.c.first_day, cal.c.days).where(cal.c.user_id.in_(user_ids)).order_by(cal.c.user_id)
+    if conn.dialect.name == "postgresql":
+        query = query.with_for_update()
+    for uid, first_day, data in conn.execute(query).all():
+        bits = _decode(data)
+        for day in sorted(d for u, d in touched if u == uid):
+            first_day, bits = _set_day(first_day, bits, day, (uid, day) in present)
+        conn.execute(cal.update().where(cal.c.user_id == uid).values(**_row(uid, first_day, bits)))
+
+
+# ── Rebuild ───────────────────────────────────────────
+
+def rebuild(db, only_if_empty: bool = False) -> bool:
+    """Recompute every calendar from the attendance table in one transaction. Returns whether it ran."""
+    conn = db.connection()
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("LOCK TABLE checkin_calendars IN EXCLUSIVE MODE"))
+    if only_if_empty and db.query(CheckinCalendar.user_id).first() is not None:
+        db.rollback()
+        return False
+
+    started = datetime.utcnow()
+    att = Attendance.__table__
+    days_by_user = {}
+    rows = conn.execution_options(yield_per=5000).execute(
+        select(att.c.user_id, att.c.timestamp).where(att.c.status == "present", att.c.user_id.isnot(None), att.c.timestamp.isnot(None))
+    )
+    for uid, ts in rows:
+        days_by_user.setdefault(uid, set()).add(_local_day(ts))
+
+    calendars = []
+    for uid, days in days_by_user.items():
+        first_day = min(days)
+        bits = 0
+        for day in days:
+            bits |= 1 << (day - first_day).days
+        calendars.append(_row(uid, first_day, bits))
+    conn.execute(delete(CheckinCalendar.__table__))
+    if calendars:
+        conn.execute(CheckinCalendar.__table__.insert(), calendars)
+    db.commit()
+    logger.info(f"📅 checkin_calendars rebuilt: {len(calendars)} users in {(datetime.utcnow() - started).total_seconds():.1f}s")
+    return True
+
+
+# ── Readers ───────────────────────────────────────────
+
+def current_streaks(db, user_ids=None) -> dict:
+    """{user_id: consecutive on-time days up to and including today} (users at 0 are absent)."""
+    today = _today()
+    q = db.query(CheckinCalendar.user_id, CheckinCalendar.run_start).filter(CheckinCalendar.run_end == today)
+    if user_ids is not None:
+        q = q.filter(CheckinCalendar.user_id.in_(list(user_ids)))
+    return {uid: (today - start).days + 1 for uid, start in q.all()}
+
+
+def longest_streaks(db, user_ids=None) -> dict:
+    """{user_id: longest run of consecutive on-time days ever}."""
+    q = db.query(CheckinCalendar.user_id, CheckinCalendar.longest).filter(CheckinCalendar.longest > 0)
+    if user_ids is not None:
+        q = q.filter(CheckinCalendar.user_id.in_(list(user_ids)))
+    return dict(q.all())
+
+
+def get_streak(db, user_id: int) -> dict:
+    cal = db.query(CheckinCalendar).filter(CheckinCalendar.user_id == user_id).first()
+    if not cal:
+        return {"current": 0, "longest": 0, "longest_end": None, "last_on_time": None}
+    return {
+        "current": _current(cal.run_start, cal.run_end, _today()),
+        "longest": cal.longest,
+        "longest_end": cal.longest_end,
+        "last_on_time": cal.run_end,
+    }
+
+
+def top(db, limit: int = 10, longest: bool = False) -> list:
+    """[(user_id, streak)] — current streaks (longer = started earlier) or all-time longest runs."""
+    if longest:
+        rows = (
+            db.query(CheckinCalendar.user_id, CheckinCalendar.longest)
+            .filter(CheckinCalendar.longest > 0)
+            .order_by(CheckinCalendar.longest.desc(), CheckinCalendar.longest_end.asc())
+            .limit(limit)
+            .all()
+        )
+        return [(uid, value) for uid, value in rows]
+    today = _today()
+    rows = (
+        db.query(CheckinCalendar.user_id, CheckinCalendar.run_start)
+        .filter(CheckinCalendar.run_end == today)
+        .order_by(CheckinCalendar.run_start.asc())
+        .limit(limit)
+        .all()
+    )
+    return [(uid, (today - start).days + 1) for uid, start in rows]
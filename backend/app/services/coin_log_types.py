@@ -0,0 +1,102 @@
+"""
+Typed classification of coin_logs rows (CoinLog.log_type).
+
+Every writer sets log_type explicitly (and sender_user_id when another user
+is involved), so readers filter with indexed equality instead of matching
+the human-readable reason text. REASON_RULES maps the reason strings written
+before log_type existed onto the same types; backfill() applies them once to
+historical rows, and a before_insert hook uses them for any writer that still
+forgets to set a type.
+"""
+
+import logging
+import re
+
+from sqlalchemy import event, update
+
+from app.models.reward import CoinLog
+
+logger = logging.getLogger("hr-api")
+
+BACKFILL_BATCH = 5000
+
+# Reasons embed user-controlled text (reward and badge names, gift comments,
+# admin notes), so every rule matches only the writer-controlled prefix at the
+# start of the reason, after an optional emoji: "Redeemed: MOTM mug" is a
+# redemption and "Received Gold from Bob: lucky draw thanks" a gift. A reason
+# no rule recognizes (e.g. a free-text admin adjustment) stays OTHER.
+_LEAD = r"^\W*"
+REASON_RULES = [
+    ("pvp", r"pvp match:"),
+    ("lucky_draw", r"lucky draw!"),
+    ("lottery", r"magic lottery"),
+    ("rescue", r"mana rescue from "),
+    ("revival_contribution", r"revival contribution for "),
+    ("revival_prayer", r"revival prayer from "),
+    ("revived", r"revived by "),
+    ("mana_gift", r"(received (angel coins|gold|mana) from |sent \d+ (angel coins|mana as) )"),
+    ("auto_mana", r"auto angel coins \("),
+    ("auto_coin", r"auto coin \("),
+    ("admin", r"angel coins \+"),
+    ("scroll_purchase", r"scroll of "),
+    ("motm", r"motm "),
+    ("quest_reward", r"quest #\d+ reward"),
+    ("party_quest", r"party quest "),
+    ("fortune_prize", r"fortune wheel prize:"),
+    ("fortune_spin", r"fortune wheel:"),
+    ("step_reward", r"step reward "),
+    ("badge_shop", r"badge shop "),
+    ("redemption", r"redeemed:"),
+    ("refund", r"(refund:|sick leave approved — refund)"),
+    ("buff", r"buff "),
+    ("penalty", r"(absent penalty \(|sick leave rejected — absent penalty)"),
+    ("check_in", r"(absent \(|late check-in|late \(|on-time check-in|on-time \(|work request approved)"),
+]
+_COMPILED_RULES = [(log_type, re.compile(_LEAD + pattern, re.IGNORECASE)) for log_type, pattern in REASON_RULES]
+
+OTHER = "other"
+
+
+def classify_reason(reason) -> str:
+    """log_type for a legacy reason string; OTHER when nothing matches."""
+    reason = reason or ""
+    for log_type, pattern in _COMPILED_RULES:
+        if pattern.search(reason):
+            return log_type
+    return OTHER
+
+
+@event.listens_for(CoinLog, "before_insert")
+def _default_log_type(mapper, connection, target):
+    if target.log_type is None:
+        target.log_type = classify_reason(target.reason)
+
+
+def backfill(db) -> int:
+    """Classify every row whose log_type is still NULL. Returns the number of rows typed."""
+    total = 0
+    while True:
+        rows = (
+            db.query(CoinLog.id, CoinLog.reason)
+            .filter(CoinLog.log_type.is_(None))
+            .order_by(CoinLog.id)
+            .limit(BACKFILL_BATCH)
+            .all()
+        )
+        if not rows:
+            break
+        by_type = {}
+        for log_id, reason in rows:
+            by_type.setdefault(classify_reason(reason), []).append(log_id)
+        for log_type, ids in by_type.items():
+            db.execute(
+                update(CoinLog)
+                .where(CoinLog.id.in_(ids), CoinLog.log_type.is_(None))
+                .values(log_type=log_type)
+                .execution_options(synchronize_session=False)
+            )
+        db.commit()
+        total += len(rows)
+    if total:
+        logger.info(f"🏷️ coin_logs backfill: typed {total} rows")
+    return total
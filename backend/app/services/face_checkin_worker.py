@@ -3,36 +3,274 @@ Face Check-in Worker — RTSP stream processing with face tracking.
 
 Connects to RTSP cameras, detects/recognizes faces, and triggers
 check-in when a face is seen for N consecutive frames.
+
+Each camera has a grabber thread keeping only its latest frame; a shared,
+bounded pool of inference workers serves all cameras round-robin.
 """
 
 import os
+import re
 import json
 import time
-import base64
+import queue
 import logging
 import threading
 import numpy as np
 from datetime import datetime, timedelta
 
+from app.services import checkin_cache
+
 logger = logging.getLogger("hr-api")
 
-# Track which users already checked in today (reset daily)
-_checked_in_today = set()
-_checked_in_date = None
+# Users whose check-in was already queued today (reset daily). Check-ins that
+# were actually recorded — by any process — come from checkin_cache.
+_queued_today = set()
+_queued_date = None
 
 # Global stop flag
 _stop_event = threading.Event()
 _worker_threads = []
 
+# Per-stream pipeline metrics: stream_idx -> _StreamMetrics
+_stream_metrics = {}
+
+# Shared inference scheduler (one per process, serves every stream)
+_inference_scheduler = None
+_scheduler_lock = threading.Lock()
+# Serializes the final "already checked in?" check + enqueue across streams
+_checkin_lock = threading.Lock()
+# Asynchronous check-in writer (Attendance / CoinLog / snapshots)
+_checkin_writer = None
+
+INFERENCE_FPS = 6  # max inference rate per stream
+METRICS_WINDOW = 5.0  # seconds over which FPS / latency are averaged
+
+# Motion gate: skip face detection on static frames
+MOTION_WIDTH = 160          # motion check runs on a frame downscaled to this width
+MOTION_PIXEL_DELTA = 25     # grayscale change for a pixel to count as moving
+MOTION_MIN_AREA = 0.002     # fraction of moving pixels that counts as motion
+MOTION_HOLD_SECONDS = 2.0   # keep detecting this long after the last motion
+
+# Top-k voting ("vote" match mode): how much one frame counts towards min_frames
+MATCH_MIN_MARGIN = 0.05     # lead over the runner-up user below which a frame is ambiguous
+MAX_FRAME_WEIGHT = 4.0      # a strong, unambiguous frame counts as this many frames
+STRONG_MATCH_SPAN = 0.15    # score this far above threshold earns the full weight
+
+
+class _StreamMetrics:
+    """Decode/inference counters for one stream, averaged over METRICS_WINDOW."""
+
+    def __init__(self, stream_idx, rtsp_url):
+        self.stream_idx = stream_idx
+        self.url = re.sub(r"//[^/@]*@", "//***@", rtsp_url)  # hide credentials
+        self._lock = threading.Lock()
+        self.decoded_total = 0
+        self.inferred_total = 0
+        self.dropped_total = 0
+        self.skipped_total = 0
+        self._window_start = time.time()
+        self._window_decoded = 0
+        self._window_inferred = 0
+        self._window_latency = []
+        self.decode_fps = 0.0
+        self.inference_fps = 0.0
+        self.avg_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+
+    def on_decode(self, dropped):
+        with self._lock:
+            self.decoded_total += 1
+            self._window_decoded += 1
+            if dropped:
+                self.dropped_total += 1
+            self._roll()
+
+    def on_skip(self):
+        with self._lock:
+            self.skipped_total += 1
+
+    def on_inference(self, latency):
+        with self._lock:
+            self.inferred_total += 1
+            self._window_inferred += 1
+            self._window_latency.append(latency)
+            self._roll()
+
+    def _roll(self):
+        now = time.time()
+        elapsed = now - self._window_start
+        if elapsed < METRICS_WINDOW:
+            return
+        self.decode_fps = self._window_decoded / elapsed
+        self.inference_fps = self._window_inferred / elapsed
+        if self._window_latency:
+            self.avg_latency_ms = 1000 * sum(self._window_latency) / len(self._window_latency)
+            self.max_latency_ms = 1000 * max(self._window_latency)
+        self._window_start = now
+        self._window_decoded = 0
+        self._window_inferred = 0
+        self._window_latency = []
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stream": self.stream_idx,
+                "url": self.url,
+                "decode_fps": round(self.decode_fps, 1),
+                "inference_fps": round(self.inference_fps, 1),
+                "decoded_frames": self.decoded_total,
+                "inferred_frames": self.inferred_total,
+                "dropped_frames": self.dropped_total,
+                "static_frames_skipped": self.skipped_total,
+                "avg_latency_ms": round(self.avg_latency_ms, 1),
+                "max_latency_ms": round(self.max_latency_ms, 1),
+            }
+
+
+class _FrameGrabber:
+    """
+    Reads a VideoCapture on its own thread and keeps only the latest frame
+    (single-slot buffer), so decoding never queues up behind slow inference.
+    A frame overwritten before the inference loop took it counts as dropped.
+    """
+
+    def __init__(self, cap, stream_idx, metrics, on_frame=None):
+        self._cap = cap
+        self._stream_idx = stream_idx
+        self._metrics = metrics
+        self._on_frame = on_frame
+        self._cond = threading.Condition()
+        self._frame = None
+        self._frame_time = 0.0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name=f"face-grab-{stream_idx}",
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stopped.is_set() and not _stop_event.is_set():
+            ret, frame = self._cap.read()
+            if not ret or frame is None:
+                time.sleep(0.5)
+                continue
+            with self._cond:
+                dropped = self._frame is not None
+                self._frame = frame
+                self._frame_time = time.time()
+                self._cond.notify()
+            self._metrics.on_decode(dropped)
+            if self._on_frame is not None and not dropped:
+                self._on_frame()
+
+    def has_frame(self):
+        return self._frame is not None
+
+    def latest(self, timeout=1.0):
+        """Take the newest frame (and when it was grabbed); None if nothing arrived in time."""
+        with self._cond:
+            if self._frame is None and timeout:
+                self._cond.wait(timeout)
+            frame, frame_time = self._frame, self._frame_time
+            self._frame = None
+        return frame, frame_time
+
+
+class _MotionGate:
+    """
+    Cheap frame-difference gate against a slowly adapting background.
+    Reports motion for MOTION_HOLD_SECONDS after the last change so a person
+    who stops in front of the door keeps being detected.
+    """
+
+    def __init__(self):
+        self._background = None
+        self._last_motion = 0.0
+
+    def has_motion(self, frame):
+        import cv2
+
+        now = time.time()
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (MOTION_WIDTH, max(1, h * MOTION_WIDTH // w)), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0).astype(np.float32)
+
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray
+            self._last_motion = now
+            return True
+
+        diff = cv2.absdiff(gray, self._background)
+        moving = np.count_nonzero(diff > MOTION_PIXEL_DELTA) / diff.size
+        cv2.accumulateWeighted(gray, self._background, 0.1)
+        if moving >= MOTION_MIN_AREA:
+            self._last_motion = now
+        return now - self._last_motion <= MOTION_HOLD_SECONDS
+
+
+def _parse_roi(value):
+    """
+    Parse a camera region of interest: [x1, y1, x2, y2] or "x1,y1,x2,y2" as
+    fractions (0–1) of the frame. Returns a tuple or None if unset/invalid.
+    """
+    if not value:
+        return None
+    try:
+        parts = value.split(",") if isinstance(value, str) else list(value)
+        x1, y1, x2, y2 = (float(p) for p in parts)
+    except (TypeError, ValueError):
+        logger.warning(f"⚠️ Invalid camera ROI {value!r}, ignoring")
+        return None
+    if not (0 <= x1 < x2 <= 1 and 0 <= y1 < y2 <= 1):
+        logger.warning(f"⚠️ Camera ROI out of range {value!r}, ignoring")
+        return None
+    return x1, y1, x2, y2
+
+
+def _parse_det_size(value):
+    """
+    Parse a camera's detector input size (px, square). Returns a multiple of 32
+    in 160–1280, or None (model default, 640) if unset/invalid.
+    """
+    if not value:
+        return None
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        logger.warning(f"⚠️ Invalid camera det_size {value!r}, ignoring")
+        return None
+    return min(1280, max(160, size // 32 * 32))
+
+
+def _crop_roi(frame, roi):
+    """Crop a frame to a fractional ROI (a view, no copy)."""
+    h, w = frame.shape[:2]
+    x1, y1, x2, y2 = roi
+    return frame[int(y1 * h):int(y2 * h), int(x1 * w):int(x2 * w)]
+
+
+def get_stream_metrics():
+    """Snapshot of pipeline metrics for all streams started by this process."""
+    return [m.snapshot() for _, m in sorted(_stream_metrics.items())]
+
 
 def _reset_daily_tracker():
-    """Reset the daily check-in tracker if it's a new day."""
-    global _checked_in_today, _checked_in_date
+    """Reset the daily queued check-in tracker if it's a new day."""
+    global _queued_today, _queued_date
     now_local = datetime.utcnow() + timedelta(hours=7)
     today = now_local.date()
-    if _checked_in_date != today:
-        _checked_in_today = set()
-        _checked_in_date = today
+    if _queued_date != today:
+        _queued_today = set()
+        _queued_date = today
         logger.info(f"🔄 Face check-in tracker reset for {today}")
 
 
@@ -74,21 +312,287 @@ def _is_frontal_face(face):
     return True
 
 
+def _frame_weight(score, margin, threshold):
+    """
+    Evidence one "vote"-mode match adds to the tracker: ambiguous frames (another
+    user close behind) add nothing, clear ones 1 frame and up to MAX_FRAME_WEIGHT
+    as the score rises above threshold, so confident faces check in faster.
+    """
+    if margin < MATCH_MIN_MARGIN:
+        return 0.0
+    strength = min(1.0, max(0.0, (score - threshold) / STRONG_MATCH_SPAN))
+    return 1.0 + (MAX_FRAME_WEIGHT - 1.0) * strength
+
+
+class _CameraStream:
+    """
+    One camera inside the shared inference scheduler: its frame grabber,
+    metrics and face tracker. The scheduler hands a stream to at most one
+    inference worker at a time (`busy`), so the tracker needs no locking.
+    """
+
+    def __init__(self, stream_idx, grabber, metrics, settings):
+        self.stream_idx = stream_idx
+        self.grabber = grabber
+        self.metrics = metrics
+        self.threshold = settings["threshold"]
+        self.min_consecutive = settings["min_frames"]
+        self.min_height = settings["min_height"]
+        self.match_mode = settings.get("match_mode") or "nearest"
+        self.roi = _parse_roi(settings.get("roi"))
+        self.det_size = _parse_det_size(settings.get("det_size"))
+        self.motion_gate = _MotionGate() if settings.get("motion", True) else None
+        # Face tracking: user_id -> { consecutive_count, evidence, last_seen_frame, best_crop, best_score }
+        self.face_tracker = {}
+        self.frame_number = 0
+        self.miss_tolerance = 3  # Allow 3 frames gap before resetting
+        # Scheduler bookkeeping
+        self.busy = False
+        self.next_due = 0.0
+
+    def gate(self, frame):
+        """
+        Crop a frame to the camera's ROI and decide whether detection is worth
+        running on it. Returns the (cropped) frame, or None for a static scene
+        with nobody currently being tracked.
+        """
+        if self.roi is not None:
+            frame = _crop_roi(frame, self.roi)
+        if self.motion_gate is not None:
+            if not self.motion_gate.has_motion(frame) and not self.face_tracker:
+                return None
+        return frame
+
+    def process(self, frame, faces):
+        """Filter detected faces, recognize them and update the tracker (may trigger check-ins)."""
+        from app.services.face_service import search_batch, search_users
+
+        self.frame_number += 1
+        frame_number = self.frame_number
+        face_tracker = self.face_tracker
+        _reset_daily_tracker()
+
+        # Filter faces, then recognize all of them with one index search
+        candidates = []
+        for face in faces:
+            x1, y1, x2, y2 = face.bbox.astype(int)
+            face_height = y2 - y1
+
+            # Filter: face height
+            if face_height < self.min_height:
+                continue
+
+            # Filter: frontal face
+            if not _is_frontal_face(face):
+                continue
+
+            candidates.append((face, (x1, y1, x2, y2)))
+
+        embeddings = [face.embedding for face, _ in candidates]
+        if self.match_mode == "vote":
+            matches = search_users(embeddings, self.threshold)
+        else:
+            matches = [m[0] + (None,) if m else None for m in search_batch(embeddings, self.threshold)]
+
+        for (face, (x1, y1, x2, y2)), match in zip(candidates, matches):
+            if match is None:
+                continue
+
+            face_height = y2 - y1
+            user_id, confidence, name, margin = match
+            weight = 1.0 if margin is None else _frame_weight(confidence, margin, self.threshold)
+
+            # Skip if already checked in today (O(1), no DB)
+            if user_id in _queued_today or checkin_cache.contains(user_id):
+                continue
+
+            # Update tracker
+            if user_id not in face_tracker:
+                face_tracker[user_id] = {
+                    "consecutive_count": 0,
+                    "evidence": 0.0,
+                    "last_seen_frame": frame_number,
+                    "best_crop": None,
+                    "best_score": 0.0,
+                    "name": name,
+                }
+
+            tracker = face_tracker[user_id]
+
+            # Check if consecutive (allow miss_tolerance gap)
+            if frame_number - tracker["last_seen_frame"] <= self.miss_tolerance:
+                tracker["consecutive_count"] += 1
+                tracker["evidence"] += weight
+            else:
+                tracker["consecutive_count"] = 1  # Reset
+                tracker["evidence"] = weight
+
+            tracker["last_seen_frame"] = frame_number
+
+            # Keep best frame (highest confidence)
+            if confidence > tracker["best_score"]:
+                tracker["best_score"] = confidence
+                # Keep the raw face crop (copied so the full frame can be freed);
+                # it is encoded only once, when the check-in is written
+                h_pad = int(face_height * 0.3)
+                w_pad = int((x2 - x1) * 0.3)
+                cy1 = max(0, y1 - h_pad)
+                cy2 = min(frame.shape[0], y2 + h_pad)
+                cx1 = max(0, x1 - w_pad)
+                cx2 = min(frame.shape[1], x2 + w_pad)
+                tracker["best_crop"] = frame[cy1:cy2, cx1:cx2].copy()
+
+            # Check if threshold met for check-in
+            if tracker["evidence"] >= self.min_consecutive:
+                logger.info(
+                    f"✅ [Stream {self.stream_idx}] CHECK-IN triggered: "
+                    f"{name} (user_id={user_id}, confidence={confidence:.3f}, "
+                    f"frames={tracker['consecutive_count']}, evidence={tracker['evidence']:.1f})"
+                )
+
+                # Queue the check-in write (another camera may have just checked this user in)
+                with _checkin_lock:
+                    if user_id not in _queued_today:
+                        _get_checkin_writer().submit(
+                            user_id=user_id,
+                            confidence=tracker["best_score"],
+                            snapshot=tracker["best_crop"],
+                        )
+                        _queued_today.add(user_id)
+                del face_tracker[user_id]
+
+        # Clean up stale trackers (not seen for too long)
+        stale = [
+            uid for uid, t in face_tracker.items()
+            if frame_number - t["last_seen_frame"] > self.miss_tolerance * 2
+        ]
+        for uid in stale:
+            del face_tracker[uid]
+
+
+class _InferenceScheduler:
+    """
+    Shared inference service for all cameras. A bounded pool of worker threads
+    takes the latest frame of each stream in round-robin order and runs
+    detection/recognition on it. Every stream is capped at INFERENCE_FPS; when
+    the pool is saturated all streams slow down evenly instead of one thread
+    per camera fighting over the CPU.
+    """
+
+    def __init__(self, num_workers):
+        self._cond = threading.Condition()
+        self._streams = []
+        self._cursor = 0
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True, name=f"face-infer-{i}")
+            for i in range(num_workers)
+        ]
+        for t in self._threads:
+            t.start()
+        logger.info(f"🧠 Face inference pool started ({num_workers} worker(s))")
+
+    def is_alive(self):
+        return any(t.is_alive() for t in self._threads)
+
+    def add_stream(self, stream):
+        with self._cond:
+            self._streams.append(stream)
+            self._cond.notify_all()
+
+    def remove_stream(self, stream):
+        with self._cond:
+            if stream in self._streams:
+                self._streams.remove(stream)
+
+    def notify(self):
+        """Wake idle workers (called by grabbers when a new frame arrives)."""
+        with self._cond:
+            self._cond.notify()
+
+    def _next_stream(self):
+        """Block until some stream has a frame and is due; claim it round-robin."""
+        interval = 1.0 / INFERENCE_FPS
+        with self._cond:
+            while not _stop_event.is_set():
+                now = time.time()
+                n = len(self._streams)
+                wait = 0.5
+                for i in range(n):
+                    stream = self._streams[(self._cursor + i) % n]
+                    if stream.busy:
+                        continue
+                    if now < stream.next_due:
+                        wait = min(wait, stream.next_due - now)
+                        continue
+                    if not stream.grabber.has_frame():
+                        continue
+                    self._cursor = (self._cursor + i + 1) % n
+                    stream.busy = True
+                    stream.next_due = now + interval
+                    return stream
+                self._cond.wait(wait)
+        return None
+
+    def _work(self):
+        from app.services.face_service import detect_faces
+
+        while True:
+            stream = self._next_stream()
+            if stream is None:
+                return
+            try:
+                frame, frame_time = stream.grabber.latest(timeout=0)
+                if frame is None:
+                    continue
+
+                # Motion / ROI gate: skip the detector on static frames
+                frame = stream.gate(frame)
+                if frame is None:
+                    stream.metrics.on_skip()
+                    continue
+
+                # Detect faces (at the camera's det_size; small faces never reach recognition)
+                try:
+                    faces = detect_faces(frame, stream.det_size, stream.min_height)
+                except Exception as e:
+                    logger.warning(f"⚠️ [Stream {stream.stream_idx}] Face detection error: {e}")
+                    continue
+
+                stream.process(frame, faces)
+                stream.metrics.on_inference(time.time() - frame_time)
+            except Exception as e:
+                logger.error(f"❌ [Stream {stream.stream_idx}] Inference error: {e}", exc_info=True)
+            finally:
+                with self._cond:
+                    stream.busy = False
+                    self._cond.notify()
+
+
+def _get_inference_scheduler():
+    """Shared inference scheduler, (re)started on demand."""
+    global _inference_scheduler
+    from app.core.config import settings as app_settings
+
+    with _scheduler_lock:
+        if _inference_scheduler is None or not _inference_scheduler.is_alive():
+            _inference_scheduler = _InferenceScheduler(max(1, app_settings.FACE_INFERENCE_WORKERS))
+        return _inference_scheduler
+
+
 def _process_rtsp_stream(rtsp_url, stream_idx, settings):
     """
-    Process a single RTSP stream. Run in a dedicated thread.
+    Supervise a single RTSP stream. Run in a dedicated thread.
+    Opens the capture, starts its frame grabber and registers the stream with
+    the shared inference scheduler until the end time is reached.
 
     Args:
         rtsp_url: RTSP URL string
         stream_idx: Index for logging
         settings: dict with threshold, min_frames, min_height, end_time
+                  and optional per-camera roi / motion
     """
     import cv2
-    from app.services.face_service import get_face_app, search
 
-    threshold = settings["threshold"]
-    min_consecutive = settings["min_frames"]
-    min_height = settings["min_height"]
     end_time_str = settings["end_time"]
 
     logger.info(f"📹 [Stream {stream_idx}] Connecting to {rtsp_url}")
@@ -98,16 +602,15 @@ def _process_rtsp_stream(rtsp_url, stream_idx, settings):
         logger.error(f"❌ [Stream {stream_idx}] Cannot open RTSP: {rtsp_url}")
         return
 
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
     logger.info(f"✅ [Stream {stream_idx}] Connected. Processing faces...")
 
-    app = get_face_app()
-    inference_interval = 1.0 / 6  # 6 fps
-    last_inference_time = 0
-
-    # Face tracking: user_id -> { consecutive_count, last_seen_frame, best_frame, best_score }
-    face_tracker = {}
-    frame_number = 0
-    miss_tolerance = 3  # Allow 3 frames gap before resetting
+    scheduler = _get_inference_scheduler()
+    metrics = _StreamMetrics(stream_idx, rtsp_url)
+    _stream_metrics[stream_idx] = metrics
+    grabber = _FrameGrabber(cap, stream_idx, metrics, on_frame=scheduler.notify).start()
+    stream = _CameraStream(stream_idx, grabber, metrics, settings)
+    scheduler.add_stream(stream)
 
     try:
         while not _stop_event.is_set():
@@ -118,238 +621,280 @@ def _process_rtsp_stream(rtsp_url, stream_idx, settings):
             if now_local.hour > end_hour or (now_local.hour == end_hour and now_local.minute > end_minute):
                 logger.info(f"⏰ [Stream {stream_idx}] End time reached ({end_time_str}). Stopping.")
                 break
-
-            ret, frame = cap.read()
-            if not ret or frame is None:
-                time.sleep(0.5)
-                continue
-
-            current_time = time.time()
-            if (current_time - last_inference_time) < inference_interval:
-                continue
-
-            last_inference_time = current_time
-            frame_number += 1
-            _reset_daily_tracker()
-
-            # Detect faces
+            # Pick up check-ins recorded elsewhere (GPS, other processes); rate-limited
             try:
-                faces = app.get(frame)
+                checkin_cache.refresh()
             except Exception as e:
-                logger.warning(f"⚠️ [Stream {stream_idx}] Face detection error: {e}")
-                continue
-
-            seen_user_ids = set()
-
-            for face in faces:
-                x1, y1, x2, y2 = face.bbox.astype(int)
-                face_height = y2 - y1
-
-                # Filter: face height
-                if face_height < min_height:
-                    continue
-
-                # Filter: frontal face
-                if not _is_frontal_face(face):
-                    continue
-
-                # Recognize face
-                result = search(face.embedding, threshold)
-                if result is None:
-                    continue
-
-                user_id, confidence, name = result
-                seen_user_ids.add(user_id)
-
-                # Skip if already checked in today
-                if user_id in _checked_in_today:
-                    continue
-
-                # Update tracker
-                if user_id not in face_tracker:
-                    face_tracker[user_id] = {
-                        "consecutive_count": 0,
-                        "last_seen_frame": frame_number,
-                        "best_frame": None,
-                        "best_score": 0.0,
-                        "name": name,
-                    }
-
-                tracker = face_tracker[user_id]
-
-                # Check if consecutive (allow miss_tolerance gap)
-                if frame_number - tracker["last_seen_frame"] <= miss_tolerance:
-                    tracker["consecutive_count"] += 1
-                else:
-                    tracker["consecutive_count"] = 1  # Reset
-
-                tracker["last_seen_frame"] = frame_number
-
-                # Keep best frame (highest confidence)
-                if confidence > tracker["best_score"]:
-                    tracker["best_score"] = confidence
-                    # Crop and encode face region from frame
-                    h_pad = int(face_height * 0.3)
-                    w_pad = int((x2 - x1) * 0.3)
-                    cy1 = max(0, y1 - h_pad)
-                    cy2 = min(frame.shape[0], y2 + h_pad)
-                    cx1 = max(0, x1 - w_pad)
-                    cx2 = min(frame.shape[1], x2 + w_pad)
-                    face_crop = frame[cy1:cy2, cx1:cx2]
-                    _, buffer = cv2.imencode('.jpg', face_crop, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                    tracker["best_frame"] = base64.b64encode(buffer).decode('utf-8')
-
-                # Check if threshold met for check-in
-                if tracker["consecutive_count"] >= min_consecutive:
-                    logger.info(
-                        f"✅ [Stream {stream_idx}] CHECK-IN triggered: "
-                        f"{name} (user_id={user_id}, confidence={confidence:.3f}, "
-                        f"frames={tracker['consecutive_count']})"
-                    )
-
-                    # Trigger check-in
-                    _do_face_checkin(
-                        user_id=user_id,
-                        confidence=tracker["best_score"],
-                        snapshot_b64=tracker["best_frame"],
-                    )
-                    _checked_in_today.add(user_id)
-                    del face_tracker[user_id]
-
-            # Clean up stale trackers (not seen for too long)
-            stale = [
-                uid for uid, t in face_tracker.items()
-                if frame_number - t["last_seen_frame"] > miss_tolerance * 2
-            ]
-            for uid in stale:
-                del face_tracker[uid]
+                logger.warning(f"⚠️ [Stream {stream_idx}] Check-in cache refresh failed: {e}")
+            _stop_event.wait(1.0)
 
     except Exception as e:
         logger.error(f"❌ [Stream {stream_idx}] Worker error: {e}", exc_info=True)
     finally:
+        scheduler.remove_stream(stream)
+        grabber.stop()
         cap.release()
         logger.info(f"📹 [Stream {stream_idx}] Stream closed.")
 
 
-def _do_face_checkin(user_id, confidence, snapshot_b64):
-    """Call the face check-in endpoint internally."""
+class _CheckinWriter:
+    """
+    Background writer for confirmed face check-ins. The recognition loop only
+    enqueues; this thread drains the queue in batches and writes Attendance /
+    CoinLog rows and snapshots with one session and one commit per batch.
+    """
+
+    MAX_BATCH = 20
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.written_total = 0
+        self.failed_total = 0
+        self.batches_total = 0
+        self.last_batch_size = 0
+        self.last_write_ms = 0.0
+        self.avg_write_ms = 0.0
+        self.max_wait_ms = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True, name="face-checkin-writer")
+        self._thread.start()
+
+    def submit(self, user_id, confidence, snapshot):
+        self._queue.put({
+            "user_id": user_id,
+            "confidence": confidence,
+            "snapshot": snapshot,
+            "queued_at": time.time(),
+        })
+
+    def drain(self, timeout=10.0):
+        """Wait (bounded) until everything queued so far has been written."""
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            t0 = time.time()
+            try:
+                written = _do_face_checkins(batch)
+                failed = 0
+            except Exception as e:
+                logger.error(f"❌ Face check-in writer error: {e}", exc_info=True)
+                written, failed = self._retry_one_by_one(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            now = time.time()
+            write_ms = 1000 * (now - t0)
+            with self._lock:
+                self.written_total += written
+                self.failed_total += failed
+                self.batches_total += 1
+                self.last_batch_size = len(batch)
+                self.last_write_ms = write_ms
+                self.avg_write_ms = write_ms if self.batches_total == 1 else 0.8 * self.avg_write_ms + 0.2 * write_ms
+                self.max_wait_ms = max(self.max_wait_ms, 1000 * (now - min(j["queued_at"] for j in batch)))
+
+    def _retry_one_by_one(self, batch):
+        """
+        Re-run a failed batch job by job so one bad row doesn't drop the rest.
+        Users whose job still fails are released from _queued_today so the
+        next sighting can queue them again. Returns (written, failed).
+        """
+        written, failed = 0, []
+        for job in batch:
+            try:
+                written += _do_face_checkins([job])
+            except Exception:
+                failed.append(job["user_id"])
+        if failed:
+            with _checkin_lock:
+                for user_id in failed:
+                    _queued_today.discard(user_id)
+            logger.warning(f"⚠️ Face check-in failed for users {failed}; they can be checked in again")
+        return written, len(failed)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "written": self.written_total,
+                "failed": self.failed_total,
+                "batches": self.batches_total,
+                "last_batch_size": self.last_batch_size,
+                "last_write_ms": round(self.last_write_ms, 1),
+                "avg_write_ms": round(self.avg_write_ms, 1),
+                "max_enqueue_to_commit_ms": round(self.max_wait_ms, 1),
+            }
+
+
+def _get_checkin_writer():
+    global _checkin_writer
+    with _scheduler_lock:
+        if _checkin_writer is None:
+            _checkin_writer = _CheckinWriter()
+        return _checkin_writer
+
+
+def get_writer_metrics():
+    """Check-in write queue metrics (None if nothing was queued yet in this process)."""
+    return _checkin_writer.snapshot() if _checkin_writer is not None else None
+
+
+def _save_snapshot(user_id, snapshot):
+    """Write a check-in snapshot (BGR face crop) to disk as WebP; returns its /uploads path or None."""
+    from app.core.config import settings
+    from app.utils.image_compress import save_bgr_array
+    import uuid
+
+    try:
+        snapshot_dir = os.path.join(settings.UPLOAD_DIR, "face_checkins")
+        snapshot_filename = save_bgr_array(snapshot, snapshot_dir, f"face_checkin_{user_id}_{uuid.uuid4().hex[:8]}")
+        return f"/uploads/face_checkins/{snapshot_filename}"
+    except Exception as e:
+        logger.warning(f"  ⚠️ Failed to save snapshot: {e}")
+        return None
+
+
+def _do_face_checkins(jobs):
+    """
+    Record a batch of face check-ins (dicts with user_id, confidence, snapshot)
+    in one session / commit. Returns the number of attendance rows written.
+    """
     from app.core.database import SessionLocal
     from app.models.attendance import Attendance
     from app.models.company import Company
     from app.models.user import User
     from app.models.reward import CoinLog
-    from app.core.config import settings
-    import uuid
+    from datetime import time as dt_time
 
     db = SessionLocal()
     try:
         now_local = datetime.utcnow() + timedelta(hours=7)
         today_local = now_local.date()
+        user_ids = {j["user_id"] for j in jobs}
 
-        # Check duplicate
+        # Check duplicates for the whole batch at once
         day_start_utc = datetime.combine(today_local, datetime.min.time()) - timedelta(hours=7)
         day_end_utc = datetime.combine(today_local, datetime.max.time()) - timedelta(hours=7)
 
-        existing = db.query(Attendance).filter(
-            Attendance.user_id == user_id,
-            Attendance.timestamp >= day_start_utc,
-            Attendance.timestamp <= day_end_utc
-        ).first()
-
-        if existing:
-            logger.info(f"  ⏭️ User {user_id} already checked in today, skipping")
-            return
-
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            logger.warning(f"  ⚠️ User {user_id} not found")
-            return
-
-        # Check working day
-        DAY_MAP = {0: "mon", 1: "tue", 2: "wed", 3: "thu", 4: "fri", 5: "sat", 6: "sun"}
-        if user.working_days:
-            day_code = DAY_MAP.get(today_local.weekday(), "")
-            user_working_days = [d.strip().lower() for d in user.working_days.split(",")]
-            if day_code not in user_working_days:
-                logger.info(f"  ⏭️ Not a working day for {user.name}")
-                return
-
-        # Save snapshot
-        snapshot_path = None
-        if snapshot_b64:
-            try:
-                img_data = base64.b64decode(snapshot_b64)
-                snapshot_filename = f"face_checkin_{user_id}_{uuid.uuid4().hex[:8]}.jpg"
-                snapshot_dir = os.path.join(settings.UPLOAD_DIR, "face_checkins")
-                os.makedirs(snapshot_dir, exist_ok=True)
-                with open(os.path.join(snapshot_dir, snapshot_filename), "wb") as f:
-                    f.write(img_data)
-                snapshot_path = f"/uploads/face_checkins/{snapshot_filename}"
-            except Exception as e:
-                logger.warning(f"  ⚠️ Failed to save snapshot: {e}")
-
-        # Determine status
-        from datetime import time as dt_time
-        check_in_time = now_local.time()
-        status = "present"
-        start = user.work_start_time or dt_time(9, 0)
-        start_minutes = start.hour * 60 + start.minute
-        checkin_minutes = check_in_time.hour * 60 + check_in_time.minute
-        diff = checkin_minutes - start_minutes
-
-        if diff > 60:
-            status = "absent"
-        elif diff > 0:
-            status = "late"
+        already = {uid for uid in user_ids if checkin_cache.contains(uid)}
+        unknown = user_ids - already
+        if unknown:
+            already |= {
+                uid for (uid,) in db.query(Attendance.user_id).filter(
+                    Attendance.user_id.in_(unknown),
+                    Attendance.timestamp >= day_start_utc,
+                    Attendance.timestamp <= day_end_utc
+                ).distinct()
+            }
+        users = {u.id: u for u in db.query(User).filter(User.id.in_(user_ids)).all()}
 
         # Get company location
         company = db.query(Company).first()
         lat = company.latitude if company else 0.0
         lon = company.longitude if company else 0.0
 
-        attendance = Attendance(
-            user_id=user_id,
-            timestamp=datetime.utcnow(),
-            latitude=lat,
-            longitude=lon,
-            status=status,
-            check_in_method="face",
-            face_image_path=snapshot_path,
-            face_confidence=confidence,
-        )
-        db.add(attendance)
-
-        # Coin logic
-        coin_change = 0
-        coin_reason = ""
-        if company:
-            if status == "absent" and company.coin_absent_penalty:
-                coin_change = -company.coin_absent_penalty
-                coin_reason = "Absent (face check-in >1hr late)"
-            elif status == "late" and company.coin_late_penalty:
-                coin_change = -company.coin_late_penalty
-                coin_reason = "Late (face check-in)"
-            elif status == "present" and company.coin_on_time:
-                coin_change = company.coin_on_time
-                coin_reason = "On-time (face check-in)"
-
-            if coin_change != 0:
-                user.coins += coin_change
-                db.add(CoinLog(
-                    user_id=user_id,
-                    amount=coin_change,
-                    reason=coin_reason,
-                    created_by="Face Recognition"
-                ))
+        DAY_MAP = {0: "mon", 1: "tue", 2: "wed", 3: "thu", 4: "fri", 5: "sat", 6: "sun"}
+        recorded = []
+
+        for job in jobs:
+            user_id = job["user_id"]
+            confidence = job["confidence"]
+
+            if user_id in already:
+                logger.info(f"  ⏭️ User {user_id} already checked in today, skipping")
+                continue
+
+            user = users.get(user_id)
+            if not user:
+                logger.warning(f"  ⚠️ User {user_id} not found")
+                continue
+
+            # Check working day
+            if user.working_days:
+                day_code = DAY_MAP.get(today_local.weekday(), "")
+                user_working_days = [d.strip().lower() for d in user.working_days.split(",")]
+                if day_code not in user_working_days:
+                    logger.info(f"  ⏭️ Not a working day for {user.name}")
+                    continue
+
+            # Save snapshot
+            snapshot_path = _save_snapshot(user_id, job["snapshot"]) if job["snapshot"] is not None else None
+
+            # Determine status (from when the check-in was confirmed, not written)
+            check_in_local = datetime.utcfromtimestamp(job["queued_at"]) + timedelta(hours=7)
+            check_in_time = check_in_local.time()
+            status = "present"
+            start = user.work_start_time or dt_time(9, 0)
+            start_minutes = start.hour * 60 + start.minute
+            checkin_minutes = check_in_time.hour * 60 + check_in_time.minute
+            diff = checkin_minutes - start_minutes
+
+            if diff > 60:
+                status = "absent"
+            elif diff > 0:
+                status = "late"
+
+            db.add(Attendance(
+                user_id=user_id,
+                timestamp=datetime.utcfromtimestamp(job["queued_at"]),
+                latitude=lat,
+                longitude=lon,
+                status=status,
+                check_in_method="face",
+                face_image_path=snapshot_path,
+                face_confidence=confidence,
+            ))
+            already.add(user_id)
+
+            # Coin logic
+            coin_change = 0
+            coin_reason = ""
+            if company:
+                if status == "absent" and company.coin_absent_penalty:
+                    coin_change = -company.coin_absent_penalty
+                    coin_reason = "Absent (face check-in >1hr late)"
+                elif status == "late" and company.coin_late_penalty:
+                    coin_change = -company.coin_late_penalty
+                    coin_reason = "Late (face check-in)"
+                elif status == "present" and company.coin_on_time:
+                    coin_change = company.coin_on_time
+                    coin_reason = "On-time (face check-in)"
+
+                if coin_change != 0:
+                    user.coins += coin_change
+                    db.add(CoinLog(
+                        user_id=user_id,
+                        amount=coin_change,
+                        reason=coin_reason,
+                        log_type="check_in",
+                        created_by="Face Recognition"
+                    ))
+
+            recorded.append((user, status, confidence, coin_change))
 
         db.commit()
-        logger.info(
-            f"📸 Face check-in recorded: {user.name} {user.surname} — "
-            f"{status} (confidence: {confidence:.3f}, coins: {coin_change:+d})"
-        )
+        for user, status, confidence, coin_change in recorded:
+            checkin_cache.mark(user.id)
+            logger.info(
+                f"📸 Face check-in recorded: {user.name} {user.surname} — "
+                f"{status} (confidence: {confidence:.3f}, coins: {coin_change:+d})"
+            )
+        return len(recorded)
     except Exception as e:
         db.rollback()
         logger.error(f"❌ Face check-in DB error: {e}", exc_info=True)
+        raise
     finally:
         db.close()
 
@@ -408,7 +953,9 @@ def run():
 
         # Build full RTSP URLs with credentials
         rtsp_urls = []
+        camera_opts = []
         for item in cameras_raw:
+            opts = {}
             if isinstance(item, str):
                 # Old format: plain URL string
                 url = item.strip()
@@ -420,14 +967,25 @@ def run():
                 if username and url.startswith("rtsp://"):
                     cred = f"{username}:{password}" if password else username
                     url = f"rtsp://{cred}@{url[7:]}"
+                # Optional: region of interest (door area) and motion gating
+                # and detector input size
+                opts = {
+                    "roi": item.get("roi"),
+                    "motion": item.get("motion", True) is not False,
+                    "det_size": item.get("det_size"),
+                }
             else:
                 continue
             if url:
                 rtsp_urls.append(url)
+                camera_opts.append(opts)
 
         if not rtsp_urls:
             return
 
+        # Warm the shared "checked in today" cache (one query for the day)
+        checkin_cache.refresh(db, force=True)
+
         # Load FAISS index if not loaded
         if _index is None or _index.ntotal == 0:
             load_index()
@@ -440,16 +998,18 @@ def run():
             "threshold": company.face_confidence_threshold or 0.5,
             "min_frames": company.face_min_consecutive_frames or 20,
             "min_height": company.face_min_face_height or 50,
+            "match_mode": company.face_match_mode or "nearest",
             "end_time": end_time_str,
         }
 
         logger.info(f"🚀 Starting face recognition on {len(rtsp_urls)} stream(s)...")
 
         _worker_threads = []
+        _stream_metrics.clear()
         for idx, url in enumerate(rtsp_urls):
             t = threading.Thread(
                 target=_process_rtsp_stream,
-                args=(url, idx, settings),
+                args=(url, idx, {**settings, **camera_opts[idx]}),
                 daemon=True,
                 name=f"face-stream-{idx}",
             )
@@ -462,8 +1022,13 @@ def run():
 
 def stop():
     """Stop all running worker threads."""
+    global _inference_scheduler
     _stop_event.set()
     for t in _worker_threads:
         t.join(timeout=5)
     _worker_threads.clear()
+    _stream_metrics.clear()
+    _inference_scheduler = None
+    if _checkin_writer is not None:
+        _checkin_writer.drain()
     logger.info("🛑 Face recognition workers stopped")
@@ -1,147 +1,935 @@
 """
 FAISS Index Management for Face Recognition
-Builds and searches the FAISS index from UserFaceImage records.
+Builds and searches the FAISS index from the embeddings stored on UserFaceImage records.
 """
 
 import os
-import json
+import time
 import logging
+import threading
 import numpy as np
+from datetime import datetime
 
 logger = logging.getLogger("hr-api")
 
 DIMENSION = 512  # ArcFace embedding dimension
+EMBEDDING_MODEL = "buffalo_l"  # stored with each embedding; changing it triggers a re-embed
+REEMBED_BATCH_SIZE = 20  # images re-embedded per background job run
+APPROX_MIN_VECTORS = 1000  # smaller galleries always use the exact flat index
+PQ_MIN_VECTORS = 10000  # product quantization needs this many training vectors
+TOMBSTONE_REBUILD_RATIO = 0.1  # rebuild an HNSW index once this share of it is deleted
+MATCH_TOP_K = 10  # vectors retrieved per face for per-user voting
+VOTE_TOP_N = 3  # a user's score is the mean of their best N photo similarities
+BULK_MIN_FACE_HEIGHT = 80  # px; smaller faces in enrollment photos are rejected
 FAISS_DIR = "/app/uploads/faiss"
-FAISS_INDEX_PATH = os.path.join(FAISS_DIR, "faiss_index.bin")
-FAISS_METADATA_PATH = os.path.join(FAISS_DIR, "faiss_metadata.json")
+FAISS_CURRENT_PATH = os.path.join(FAISS_DIR, "CURRENT")  # version of the published snapshot
+FAISS_LEGACY_PATH = os.path.join(FAISS_DIR, "faiss_index.bin")  # pre-snapshot index, imported once
+SNAPSHOT_KEEP = 3  # snapshot versions kept on disk
+RELOAD_CHECK_SECONDS = 2.0  # how often searches look for a newer snapshot
 
-# Global state — loaded once, rebuilt on face image upload/delete
+# Global state — loaded once, updated incrementally on face image upload/delete.
+# The index (flat, IVF or HNSW — see _index_kind) is keyed by UserFaceImage.id;
+# _metadata uses the same id (as str) as key.
+# On disk every save is a new snapshot version (index.v<N>.faiss + ids.v<N>.npz)
+# published by atomically replacing CURRENT; other processes memory-map it and
+# reload when CURRENT moves on. A mapped index is read-only until _ensure_writable().
 _index = None
 _metadata = {}
+_index_version = None  # snapshot version loaded (or written) by this process
+_index_mmapped = False
+_last_version_check = 0.0
+_dead_ids = set()  # ids deleted from the index but still in the graph (HNSW only)
+_dead_search = None  # (search params excluding _dead_ids, selectors kept alive), built lazily
+_index_built_size = 0  # gallery size the index was built/trained for
+_photo_counts = (None, {})  # (metadata identity, {user_id: photos in index})
 _face_app = None
+_face_app_lock = threading.Lock()
+_index_lock = threading.Lock()
+_warm_lock = threading.Lock()
+_bulk_pool = None  # enrollment process pool, kept so each process loads the model once
+_bulk_pool_lock = threading.Lock()
+_readiness = {"state": "cold"}  # cold | warming | ready | failed, plus durations
+
+
+def _session_options():
+    """
+    Explicit onnxruntime threading: the inference pool runs FACE_INFERENCE_WORKERS
+    calls in parallel, so each call gets its share of the cores instead of every
+    session spinning up one thread per core.
+    """
+    import onnxruntime
+    from app.core.config import settings
+
+    workers = max(1, settings.FACE_INFERENCE_WORKERS)
+    intra = settings.FACE_INTRA_OP_THREADS or max(1, (os.cpu_count() or 1) // workers)
+    opts = onnxruntime.SessionOptions()
+    opts.intra_op_num_threads = intra
+    opts.inter_op_num_threads = 1
+    opts.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    logger.info(f"⚙️ onnxruntime: {intra} intra-op thread(s) × {workers} inference worker(s)")
+    return opts
+
+
+def _allowed_modules():
+    """
+    InsightFace models to load (FACE_ALLOWED_MODULES). Check-in, enrollment and
+    the test stream only use the bbox, keypoints / 106-point landmarks and the
+    embedding, so the 3D landmark and gender-age models are skipped by default.
+    None loads every model of the pack.
+    """
+    from app.core.config import settings
+
+    modules = [m.strip() for m in settings.FACE_ALLOWED_MODULES.split(",") if m.strip()]
+    if not modules:
+        return None
+    for required in ("detection", "recognition"):
+        if required not in modules:
+            modules.append(required)
+    return modules
 
 
 def _get_face_app():
     """Lazy-load InsightFace model (heavy, only load once)."""
     global _face_app
     if _face_app is None:
-        logger.info("📦 Loading ArcFace model (buffalo_l)...")
-        from insightface.app import FaceAnalysis
-        _face_app = FaceAnalysis(name="buffalo_l", providers=['CPUExecutionProvider'])
-        _face_app.prepare(ctx_id=0, det_size=(640, 640))
-        logger.info("✅ ArcFace model loaded")
+        with _face_app_lock:
+            if _face_app is None:
+                logger.info(f"📦 Loading ArcFace model ({EMBEDDING_MODEL})...")
+                from insightface.app import FaceAnalysis
+                app = FaceAnalysis(
+                    name=EMBEDDING_MODEL,
+                    allowed_modules=_allowed_modules(),
+                    providers=['CPUExecutionProvider'],
+                    sess_options=_session_options(),
+                )
+                app.prepare(ctx_id=0, det_size=(640, 640))
+                _face_app = app
+                logger.info(f"✅ ArcFace model loaded ({', '.join(app.models)})")
     return _face_app
 
 
-def rebuild_index():
+def _image_abs_path(image_path):
+    """Resolve a stored /uploads/... path to an absolute file path."""
+    from app.core.config import settings
+    rel_path = image_path.lstrip("/uploads/")
+    return os.path.join(settings.UPLOAD_DIR, rel_path)
+
+
+def _index_kind(n):
     """
-    Rebuild FAISS index from all UserFaceImage records in the database.
-    Called after face image upload or delete.
+    Index type for a gallery of n vectors. FACE_INDEX_TYPE=auto uses the exact
+    flat index below FACE_INDEX_AUTO_THRESHOLD and IVF above it; approximate
+    types fall back to flat for galleries too small to be worth it.
     """
-    global _index, _metadata
+    from app.core.config import settings
+
+    kind = settings.FACE_INDEX_TYPE.lower()
+    if kind == "auto":
+        kind = "ivf" if n >= settings.FACE_INDEX_AUTO_THRESHOLD else "flat"
+    if kind not in ("flat", "ivf", "hnsw") or n < APPROX_MIN_VECTORS:
+        return "flat"
+    return kind
+
+
+def _index_spec(kind, n):
+    """faiss.index_factory string for an index of the given kind over n vectors."""
+    from app.core.config import settings
+
+    quantizer = settings.FACE_INDEX_QUANTIZER.lower()
+    if quantizer == "pq" and (kind != "ivf" or n < PQ_MIN_VECTORS):
+        quantizer = "sq8"  # PQ needs ~10k training vectors; HNSW+PQ is not worth it
+    if kind == "ivf":
+        nlist = int(max(16, min(4096, 4 * np.sqrt(n), n // 39)))
+        codes = {"sq8": "SQ8", "pq": f"PQ{DIMENSION // 8}"}.get(quantizer, "Flat")
+        return f"IVF{nlist},{codes}"
+    if kind == "hnsw":
+        return "IDMap,HNSW32,SQ8" if quantizer == "sq8" else "IDMap,HNSW32"
+    return "IDMap,Flat"
+
+
+def _base_index(index):
+    """The index under an IndexIDMap wrapper (IVF indexes carry ids themselves)."""
     import faiss
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+
+def _kind_of(index):
+    import faiss
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def _tune_index(index):
+    """Apply the configured search-time parameters (not all are persisted)."""
+    from app.core.config import settings
+
+    base = _base_index(index)
+    kind = _kind_of(index)
+    if kind == "ivf":
+        base.nprobe = max(1, settings.FACE_INDEX_NPROBE)
+    elif kind == "hnsw":
+        base.hnsw.efSearch = max(16, settings.FACE_INDEX_EF_SEARCH)
+    return index
+
+
+def _new_index(vectors=None):
+    """
+    Index keyed by UserFaceImage.id (so vectors can be added/removed individually),
+    of the type _index_kind() picks for the gallery size. Approximate types are
+    trained on the given vectors (callers add them afterwards).
+    """
+    import faiss
+
+    n = 0 if vectors is None else len(vectors)
+    kind = _index_kind(n)
+    index = faiss.index_factory(DIMENSION, _index_spec(kind, n), faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        index.train(vectors)
+    return _tune_index(index)
+
+
+def _remove_ids(ids):
+    """
+    Remove vectors by id (caller holds _index_lock). HNSW can't delete: its ids
+    are tombstoned instead — added to _dead_ids, which searches exclude — until
+    the next rebuild. Returns the number of vectors removed or tombstoned.
+    """
+    global _dead_search
+    try:
+        return _index.remove_ids(ids)
+    except RuntimeError:
+        dead = {i for i in ids.tolist() if str(i) in _metadata} - _dead_ids
+        if dead:
+            _dead_ids.update(dead)
+            _dead_search = None
+        return len(dead)
+
+
+def _search_params():
+    """
+    faiss search parameters that skip tombstoned ids, or None when there are
+    none (caller holds _index_lock). Deleted HNSW vectors stay in the graph
+    for traversal but never come back as results, however many there are.
+    """
+    global _dead_search
+    import faiss
+    if not _dead_ids:
+        return None
+    if _dead_search is None:
+        batch = faiss.IDSelectorBatch(np.fromiter(_dead_ids, dtype='int64', count=len(_dead_ids)))
+        selector = faiss.IDSelectorNot(batch)
+        params = faiss.SearchParametersHNSW()
+        params.sel = selector
+        params.efSearch = _base_index(_index).hnsw.efSearch
+        _dead_search = (params, batch, selector)
+    return _dead_search[0]
+
+
+def _reset_dead_ids(index, metadata):
+    """Recompute the tombstones of a freshly installed index (caller holds _index_lock)."""
+    global _dead_search
+    import faiss
+    _dead_ids.clear()
+    _dead_search = None
+    if _kind_of(index) == "hnsw" and isinstance(index, faiss.IndexIDMap) and index.ntotal > len(metadata):
+        _dead_ids.update(set(faiss.vector_to_array(index.id_map).tolist()) - {int(k) for k in metadata})
+
+
+def _needs_rebuild():
+    """True when the live index no longer fits the gallery (type, growth or tombstones)."""
+    if _index is None:
+        return False
+    live = _index.ntotal - len(_dead_ids)
+    if _kind_of(_index) != _index_kind(live):
+        return True
+    if _kind_of(_index) != "flat" and live > 2 * max(_index_built_size, APPROX_MIN_VECTORS):
+        return True  # IVF clusters / HNSW graph were sized for a much smaller gallery
+    return len(_dead_ids) > TOMBSTONE_REBUILD_RATIO * max(1, _index.ntotal)
+
+
+def _embed_image(abs_path):
+    """
+    Detect the first face in an image file and return (normalized embedding, det_score).
+    Returns None if the image can't be used.
+    """
+    import cv2
+
+    if not os.path.exists(abs_path):
+        logger.warning(f"  ❌ File not found: {abs_path}")
+        return None
+
+    img = cv2.imread(abs_path)
+    if img is None:
+        logger.warning(f"  ❌ Cannot read image: {abs_path}")
+        return None
+
+    faces = _get_face_app().get(img)
+    if len(faces) == 0:
+        logger.warning(f"  ❌ No face detected in: {abs_path}")
+        return None
+
+    # Use first face found
+    embedding = faces[0].embedding
+    embedding = embedding / np.linalg.norm(embedding)
+    return embedding.astype('float32'), float(faces[0].det_score)
+
+
+def _embedding_to_blob(embedding):
+    return np.asarray(embedding, dtype='<f4').reshape(-1).tobytes()
+
+
+def _blob_to_embedding(blob):
+    return np.frombuffer(blob, dtype='<f4')
+
+
+def compute_embedding(face_img):
+    """
+    Run ArcFace on a face image file and store the result on the row (caller commits).
+    A failed attempt is recorded too (embedding=None with the current model) so the
+    re-embed job doesn't retry an unusable photo forever.
+    """
+    result = _embed_image(_image_abs_path(face_img.image_path))
+    face_img.embedding_model = EMBEDDING_MODEL
+    face_img.embedded_at = datetime.utcnow()
+    if result is None:
+        face_img.embedding = None
+        face_img.det_score = None
+        return False
+    embedding, det_score = result
+    face_img.embedding = _embedding_to_blob(embedding)
+    face_img.det_score = det_score
+    return True
+
+
+def _face_metadata(face_img, user):
+    """Metadata entry stored next to each vector in the index."""
+    user_name = f"{user.name} {user.surname}" if user else f"User#{face_img.user_id}"
+    return {
+        "user_id": face_img.user_id,
+        "name": user_name,
+    }
+
+
+def _init_bulk_worker():
+    """Enrollment pool initializer: one single-threaded model per process."""
+    from app.core.config import settings
+    settings.FACE_INFERENCE_WORKERS = 1
+    settings.FACE_INTRA_OP_THREADS = 1
+    _get_face_app()
+
+
+def _get_bulk_pool():
+    """The shared enrollment pool (FACE_BULK_WORKERS processes), created on first use."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    global _bulk_pool
+    with _bulk_pool_lock:
+        if _bulk_pool is None:
+            _bulk_pool = ProcessPoolExecutor(
+                max_workers=_bulk_pool_size(),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_bulk_worker,
+            )
+        return _bulk_pool
+
+
+def _bulk_pool_size():
+    from app.core.config import settings
+    return settings.FACE_BULK_WORKERS or min(4, os.cpu_count() or 1)
+
+
+def _discard_bulk_pool(pool):
+    """Drop a broken pool so the next enrollment starts a fresh one."""
+    global _bulk_pool
+    with _bulk_pool_lock:
+        if _bulk_pool is pool:
+            _bulk_pool = None
+    pool.shutdown(wait=False)
+
+
+def _assess_face_image(abs_path):
+    """
+    Quality-check and embed one enrollment photo (runs in a pool process).
+    status is ok, unreadable, no_face, multiple_faces (another face at least
+    half the size of the largest) or small_face.
+    """
     import cv2
+
+    img = cv2.imread(abs_path)
+    if img is None:
+        return {"status": "unreadable"}
+    faces = _get_face_app().get(img)
+    if not faces:
+        return {"status": "no_face"}
+
+    faces = sorted(faces, key=lambda f: f.bbox[3] - f.bbox[1], reverse=True)
+    face_height = float(faces[0].bbox[3] - faces[0].bbox[1])
+    if len(faces) > 1 and faces[1].bbox[3] - faces[1].bbox[1] >= 0.5 * face_height:
+        return {"status": "multiple_faces", "faces": len(faces)}
+    if face_height < BULK_MIN_FACE_HEIGHT:
+        return {"status": "small_face", "face_height": int(face_height)}
+
+    embedding = faces[0].embedding / np.linalg.norm(faces[0].embedding)
+    return {
+        "status": "ok",
+        "embedding": embedding.astype('float32'),
+        "det_score": float(faces[0].det_score),
+        "face_height": int(face_height),
+    }
+
+
+def enroll_faces(items, max_per_user=None):
+    """
+    Bulk enrollment. items: [{"user_id", "image_path"}, ...] for photos already
+    saved under uploads. Photos are decoded, quality-checked and embedded in a
+    process pool (FACE_BULK_WORKERS) that is reused across calls, so the model is
+    loaded once per pool process; accepted ones become UserFaceImage rows,
+    with their embeddings, in one commit, and the index gets a single update.
+    Rejected photos are deleted. Returns one result dict per item (status,
+    image id or failure details).
+    """
+    from concurrent.futures.process import BrokenProcessPool
+    from sqlalchemy import func
+    from app.core.database import SessionLocal
+    from app.models.face_image import UserFaceImage
+    from app.models.user import User
+
+    if not items:
+        return []
+    paths = [_image_abs_path(item["image_path"]) for item in items]
+    workers = min(len(items), _bulk_pool_size())
+    logger.info(f"🧑‍🤝‍🧑 Bulk enrollment: {len(items)} image(s) on {workers} process(es)...")
+    if workers <= 1:
+        assessments = [_assess_face_image(path) for path in paths]
+    else:
+        pool = _get_bulk_pool()
+        try:
+            assessments = list(pool.map(_assess_face_image, paths))
+        except BrokenProcessPool:
+            _discard_bulk_pool(pool)
+            raise
+
+    db = SessionLocal()
+    try:
+        user_ids = {item["user_id"] for item in items}
+        slots = {}
+        if max_per_user is not None:
+            existing = dict(
+                db.query(UserFaceImage.user_id, func.count(UserFaceImage.id))
+                .filter(UserFaceImage.user_id.in_(user_ids))
+                .group_by(UserFaceImage.user_id)
+                .all()
+            )
+            slots = {uid: max(0, max_per_user - existing.get(uid, 0)) for uid in user_ids}
+
+        results = []
+        accepted = []
+        now = datetime.utcnow()
+        for item, path, assessment in zip(items, paths, assessments):
+            result = {**item, **{k: v for k, v in assessment.items() if k != "embedding"}}
+            if assessment["status"] == "ok" and max_per_user is not None:
+                if slots[item["user_id"]] <= 0:
+                    result["status"] = "limit"
+                else:
+                    slots[item["user_id"]] -= 1
+            if result["status"] == "ok":
+                face_img = UserFaceImage(
+                    user_id=item["user_id"],
+                    image_path=item["image_path"],
+                    embedding=_embedding_to_blob(assessment["embedding"]),
+                    embedding_model=EMBEDDING_MODEL,
+                    det_score=assessment["det_score"],
+                    embedded_at=now,
+                )
+                db.add(face_img)
+                accepted.append((face_img, result))
+            elif os.path.exists(path):
+                os.remove(path)
+            results.append(result)
+
+        db.commit()
+        for face_img, result in accepted:
+            result["image_id"] = face_img.id
+
+        if accepted:
+            if _index is None:
+                load_index()
+            users = {u.id: u for u in db.query(User).filter(User.id.in_(user_ids)).all()}
+            _add_vectors([face_img for face_img, _ in accepted], users)
+        logger.info(f"✅ Bulk enrollment: {len(accepted)}/{len(items)} image(s) enrolled ({_index.ntotal if _index else 0} faces in index)")
+        return results
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _import_legacy_vectors(db):
+    """
+    Copy vectors from a pre-snapshot faiss_index.bin (keyed by image id) onto
+    rows that were never embedded into the DB, so those photos stay searchable
+    until reembed_stale_faces() reaches them (they keep a NULL embedding_model).
+    The file is renamed afterwards so this runs once.
+    """
+    import faiss
+    from app.models.face_image import UserFaceImage
+
+    if not os.path.exists(FAISS_LEGACY_PATH):
+        return 0
+    imported = 0
+    try:
+        legacy = faiss.read_index(FAISS_LEGACY_PATH)
+        if isinstance(legacy, faiss.IndexIDMap) and legacy.ntotal:
+            ids = faiss.vector_to_array(legacy.id_map).tolist()
+            vectors = faiss.downcast_index(legacy.index).reconstruct_n(0, legacy.ntotal)
+            by_id = dict(zip(ids, vectors))
+            rows = db.query(UserFaceImage).filter(
+                UserFaceImage.id.in_(ids),
+                UserFaceImage.embedding.is_(None),
+                UserFaceImage.embedding_model.is_(None),
+            ).all()
+            for face_img in rows:
+                face_img.embedding = _embedding_to_blob(by_id[face_img.id])
+            db.commit()
+            imported = len(rows)
+        os.replace(FAISS_LEGACY_PATH, f"{FAISS_LEGACY_PATH}.imported")
+        logger.info(f"📥 Imported {imported} vector(s) from legacy {FAISS_LEGACY_PATH}")
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"⚠️ Could not import legacy FAISS index: {e}")
+    return imported
+
+
+def rebuild_index():
+    """
+    Rebuild FAISS index from the embeddings stored on UserFaceImage rows.
+    No detection is run. Rows still carrying an older model's vector are
+    indexed with it, so they stay matchable until reembed_stale_faces()
+    replaces the vector.
+    """
+    global _index, _metadata, _index_built_size, _index_mmapped
     from app.core.database import SessionLocal
     from app.models.face_image import UserFaceImage
     from app.models.user import User
-    from app.core.config import settings
 
     logger.info("🔨 Rebuilding FAISS index...")
 
     db = SessionLocal()
     try:
-        face_images = db.query(UserFaceImage).all()
-        if not face_images:
-            logger.info("⚠️ No face images found, creating empty index")
-            _index = faiss.IndexFlatIP(DIMENSION)
-            _metadata = {}
-            _save_index()
-            return
+        _import_legacy_vectors(db)
+        face_images = db.query(UserFaceImage).filter(UserFaceImage.embedding.isnot(None)).all()
+        user_ids = {f.user_id for f in face_images}
+        users = {u.id: u for u in db.query(User).filter(User.id.in_(user_ids)).all()} if user_ids else {}
 
-        app = _get_face_app()
-        index = faiss.IndexFlatIP(DIMENSION)
         metadata = {}
-        face_id = 0
+        if face_images:
+            vectors = np.vstack([_blob_to_embedding(f.embedding) for f in face_images])
+            ids = np.array([f.id for f in face_images], dtype='int64')
+            index = _new_index(vectors)
+            index.add_with_ids(vectors, ids)
+            for f in face_images:
+                metadata[str(f.id)] = _face_metadata(f, users.get(f.user_id))
+        else:
+            index = _new_index()
 
-        for face_img in face_images:
-            # Resolve absolute path
-            rel_path = face_img.image_path.lstrip("/uploads/")
-            abs_path = os.path.join(settings.UPLOAD_DIR, rel_path)
+        with _index_lock:
+            _index = index
+            _metadata = metadata
+            _reset_dead_ids(index, metadata)
+            _index_built_size = index.ntotal
+            _index_mmapped = False
+            _save_index()
+        logger.info(f"✅ FAISS index rebuilt: {index.ntotal} face embeddings ({_kind_of(index)})")
 
-            if not os.path.exists(abs_path):
-                logger.warning(f"  ❌ File not found: {abs_path}")
-                continue
+        stale = db.query(UserFaceImage).filter(_stale_filter(UserFaceImage)).count()
+        if stale:
+            logger.info(f"⏳ {stale} face image(s) awaiting re-embed ({EMBEDDING_MODEL})")
 
-            img = cv2.imread(abs_path)
-            if img is None:
-                logger.warning(f"  ❌ Cannot read image: {abs_path}")
-                continue
+    except Exception as e:
+        logger.error(f"❌ FAISS rebuild error: {e}", exc_info=True)
+    finally:
+        db.close()
 
-            faces = app.get(img)
-            if len(faces) == 0:
-                logger.warning(f"  ❌ No face detected in: {abs_path}")
-                continue
 
-            # Use first face found
-            embedding = faces[0].embedding
-            embedding = embedding / np.linalg.norm(embedding)
-            embedding = embedding.astype('float32').reshape(1, -1)
+def _stale_filter(model):
+    """Rows whose embedding was never computed or came from another model."""
+    from sqlalchemy import or_
+    return or_(model.embedding_model.is_(None), model.embedding_model != EMBEDDING_MODEL)
 
-            index.add(embedding)
 
-            # Get user info
-            user = db.query(User).filter(User.id == face_img.user_id).first()
-            user_name = f"{user.name} {user.surname}" if user else f"User#{face_img.user_id}"
+def _add_vectors(face_images, users):
+    """
+    Add stored embeddings of the given rows to the live index and persist it.
+    Re-adding an id an HNSW index already holds (e.g. a re-embedded image)
+    rebuilds it instead: the old vector can't be removed from the graph and
+    would come back under the same id.
+    """
+    ids = np.array([f.id for f in face_images], dtype='int64')
+    vectors = np.vstack([_blob_to_embedding(f.embedding) for f in face_images])
+    _maybe_reload(force=True)
+    with _index_lock:
+        readd = _kind_of(_index) == "hnsw" and any(
+            str(i) in _metadata or i in _dead_ids for i in ids.tolist()
+        )
+        if not readd:
+            _ensure_writable()
+            _remove_ids(ids)  # no-op unless re-adding the same images
+            _index.add_with_ids(vectors, ids)
+            for f in face_images:
+                _metadata[str(f.id)] = _face_metadata(f, users.get(f.user_id))
+            _save_index()
+    if readd or _needs_rebuild():
+        rebuild_index()
 
-            metadata[str(face_id)] = {
-                "user_id": face_img.user_id,
-                "name": user_name,
-                "image_path": face_img.image_path,
-            }
 
-            logger.info(f"  ✅ [{face_id}] {user_name} ({face_img.image_path})")
-            face_id += 1
+def add_face_image(face_image_id):
+    """
+    Embed a single newly uploaded face image (stored on the row) and add it to the index.
+    Only the new image goes through ArcFace; existing vectors are untouched.
+    """
+    from app.core.database import SessionLocal
+    from app.models.face_image import UserFaceImage
+    from app.models.user import User
+
+    if _index is None:
+        load_index()
 
-        _index = index
-        _metadata = metadata
-        _save_index()
-        logger.info(f"✅ FAISS index rebuilt: {index.ntotal} face embeddings")
+    db = SessionLocal()
+    try:
+        face_img = db.query(UserFaceImage).filter(UserFaceImage.id == face_image_id).first()
+        if not face_img:
+            logger.warning(f"⚠️ Face image {face_image_id} not found, skipping index add")
+            return False
 
+        if face_img.embedding_model != EMBEDDING_MODEL:
+            compute_embedding(face_img)
+            db.commit()
+        if face_img.embedding is None:
+            return False
+
+        user = db.query(User).filter(User.id == face_img.user_id).first()
+        _add_vectors([face_img], {face_img.user_id: user})
+        logger.info(f"➕ FAISS index: added [{face_img.id}] {_metadata[str(face_img.id)]['name']} ({_index.ntotal} faces)")
+        return True
     except Exception as e:
-        logger.error(f"❌ FAISS rebuild error: {e}", exc_info=True)
+        db.rollback()
+        logger.error(f"❌ FAISS add error: {e}", exc_info=True)
+        return False
     finally:
         db.close()
 
 
+def reembed_stale_faces(batch_size=REEMBED_BATCH_SIZE):
+    """
+    Background re-embed job: embed up to batch_size images that have no embedding
+    or one from an older model, store the vectors and swap them into the index.
+    An image that can no longer be embedded has its old vector removed.
+    Runs in small batches so a model upgrade doesn't monopolize the CPU.
+    Returns the number of images processed.
+    """
+    from app.core.database import SessionLocal
+    from app.models.face_image import UserFaceImage
+    from app.models.user import User
+
+    db = SessionLocal()
+    try:
+        face_images = (
+            db.query(UserFaceImage)
+            .filter(_stale_filter(UserFaceImage))
+            .order_by(UserFaceImage.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not face_images:
+            return 0
+
+        if _index is None:
+            load_index()
+
+        logger.info(f"🔁 Re-embedding {len(face_images)} face image(s) with {EMBEDDING_MODEL}...")
+        embedded, failed = [], []
+        for f in face_images:
+            (embedded if compute_embedding(f) else failed).append(f)
+        db.commit()
+
+        if embedded:
+            user_ids = {f.user_id for f in embedded}
+            users = {u.id: u for u in db.query(User).filter(User.id.in_(user_ids)).all()}
+            _add_vectors(embedded, users)
+        if failed:
+            _remove_vectors([f.id for f in failed])
+        logger.info(f"✅ Re-embedded {len(embedded)}/{len(face_images)} face image(s) ({_index.ntotal} faces in index)")
+        return len(face_images)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"❌ Face re-embed error: {e}", exc_info=True)
+        return 0
+    finally:
+        db.close()
+
+
+def _remove_vectors(image_ids):
+    """Remove vectors by image id from the live index and persist it. Returns how many were removed."""
+    _maybe_reload(force=True)
+    with _index_lock:
+        _ensure_writable()
+        removed = _remove_ids(np.array(image_ids, dtype='int64'))
+        for image_id in image_ids:
+            _metadata.pop(str(image_id), None)
+        _save_index()
+    if _needs_rebuild():
+        rebuild_index()
+    return removed
+
+
+def remove_face_image(face_image_id):
+    """Remove a deleted face image's vector from the index by its id."""
+    if _index is None:
+        load_index()
+
+    try:
+        removed = _remove_vectors([face_image_id])
+        logger.info(f"➖ FAISS index: removed [{face_image_id}] ({removed} vector(s), {_index.ntotal} faces)")
+        return removed > 0
+    except Exception as e:
+        logger.error(f"❌ FAISS remove error: {e}", exc_info=True)
+        return False
+
+
+def _snapshot_paths(version):
+    return (
+        os.path.join(FAISS_DIR, f"index.v{version}.faiss"),
+        os.path.join(FAISS_DIR, f"ids.v{version}.npz"),
+    )
+
+
+def _atomic_write(path, write):
+    """Write via a temp file + rename, so readers never see a partial file."""
+    tmp = f"{path}.tmp{os.getpid()}"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _current_version():
+    """Version of the published snapshot, or None if there is none."""
+    try:
+        with open(FAISS_CURRENT_PATH, 'r') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_text(text):
+    def write(path):
+        with open(path, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+    return write
+
+
+def _prune_snapshots(keep_from):
+    """Delete all but the newest SNAPSHOT_KEEP versions (mapped readers keep their pages)."""
+    versions = set()
+    for name in os.listdir(FAISS_DIR):
+        if name.startswith(("index.v", "ids.v")) and ".tmp" not in name:
+            try:
+                versions.add(int(name.split(".v", 1)[1].split(".", 1)[0]))
+            except ValueError:
+                continue
+    for version in sorted(versions, reverse=True)[SNAPSHOT_KEEP:]:
+        if version >= keep_from:
+            continue
+        for path in _snapshot_paths(version):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
 def _save_index():
-    """Save FAISS index and metadata to disk."""
+    """
+    Write the index and a compact binary id -> user map as a new snapshot
+    version, then publish it by replacing CURRENT (caller holds _index_lock).
+    """
+    global _index_version
     import faiss
+
     os.makedirs(FAISS_DIR, exist_ok=True)
-    if _index is not None:
-        faiss.write_index(_index, FAISS_INDEX_PATH)
-    with open(FAISS_METADATA_PATH, 'w', encoding='utf-8') as f:
-        json.dump(_metadata, f, ensure_ascii=False, indent=2)
+    version = max(time.time_ns(), (_current_version() or 0) + 1)
+    index_path, ids_path = _snapshot_paths(version)
+
+    image_ids = np.fromiter((int(k) for k in _metadata), dtype='int64', count=len(_metadata))
+    user_ids = np.fromiter(
+        (m.get("user_id") if m.get("user_id") is not None else -1 for m in _metadata.values()),
+        dtype='int64', count=len(_metadata),
+    )
+    names = {m.get("user_id"): m.get("name", "Unknown") for m in _metadata.values() if m.get("user_id") is not None}
+
+    def write_ids(path):
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                image_ids=image_ids,
+                user_ids=user_ids,
+                name_user_ids=np.array(list(names.keys()), dtype='int64'),
+                names=np.array(list(names.values()), dtype=str),
+            )
+
+    _atomic_write(index_path, lambda path: faiss.write_index(_index, path))
+    _atomic_write(ids_path, write_ids)
+    _atomic_write(FAISS_CURRENT_PATH, _write_text(str(version)))
+    _index_version = version
+    _prune_snapshots(version)
+
+
+def _read_snapshot(version):
+    """Memory-map a snapshot's index (read-only) and load its id -> user map."""
+    import faiss
+
+    index_path, ids_path = _snapshot_paths(version)
+    flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+    index = faiss.read_index(index_path, flags)
+    with np.load(ids_path) as data:
+        names = dict(zip(data["name_user_ids"].tolist(), data["names"].tolist()))
+        metadata = {
+            str(image_id): {
+                "user_id": user_id if user_id >= 0 else None,
+                "name": names.get(user_id, f"User#{user_id}"),
+            }
+            for image_id, user_id in zip(data["image_ids"].tolist(), data["user_ids"].tolist())
+        }
+    return index, metadata
+
+
+def _install_snapshot(version, index, metadata):
+    global _index, _metadata, _index_built_size, _index_version, _index_mmapped
+    with _index_lock:
+        _index = _tune_index(index)
+        _metadata = metadata
+        _reset_dead_ids(index, metadata)
+        _index_built_size = index.ntotal
+        _index_version = version
+        _index_mmapped = True
+
+
+def _ensure_writable():
+    """
+    Swap a memory-mapped (read-only) index for an in-memory copy before it is
+    mutated — faiss aborts the process on writes to mapped storage.
+    Caller holds _index_lock.
+    """
+    global _index, _index_mmapped
+    import faiss
+    if _index_mmapped:
+        _index = _tune_index(faiss.deserialize_index(faiss.serialize_index(_index)))
+        _index_mmapped = False
+
+
+def _maybe_reload(force=False):
+    """Reload the index when another process has published a newer snapshot."""
+    global _last_version_check
+    now = time.time()
+    if _index is None or (not force and now - _last_version_check < RELOAD_CHECK_SECONDS):
+        return
+    _last_version_check = now
+    version = _current_version()
+    if version is None or version <= (_index_version or 0):
+        return
+    try:
+        index, metadata = _read_snapshot(version)
+    except Exception as e:
+        logger.warning(f"⚠️ FAISS snapshot v{version} not loadable yet: {e}")
+        return
+    _install_snapshot(version, index, metadata)
+    logger.info(f"🔄 FAISS index reloaded: snapshot v{version} ({index.ntotal} faces)")
 
 
 def load_index():
-    """Load FAISS index from disk (called on startup)."""
+    """Load (memory-map) the published FAISS snapshot (called on startup)."""
     global _index, _metadata
     import faiss
 
-    if os.path.exists(FAISS_INDEX_PATH) and os.path.exists(FAISS_METADATA_PATH):
+    version = _current_version()
+    if version is not None:
         try:
-            _index = faiss.read_index(FAISS_INDEX_PATH)
-            with open(FAISS_METADATA_PATH, 'r', encoding='utf-8') as f:
-                _metadata = json.load(f)
-            logger.info(f"📂 FAISS index loaded: {_index.ntotal} faces")
+            index, metadata = _read_snapshot(version)
+            if not isinstance(index, (faiss.IndexIDMap, faiss.IndexIVF)):
+                # Old sequential-id index — ids don't match UserFaceImage.id
+                logger.info("📂 FAISS index has old format, rebuilding from stored embeddings...")
+                rebuild_index()
+                return
+            _install_snapshot(version, index, metadata)
+            if _needs_rebuild():
+                # FACE_INDEX_TYPE changed or the gallery outgrew the saved index
+                logger.info(f"📂 FAISS index ({_kind_of(index)}) doesn't match the configured type, rebuilding...")
+                rebuild_index()
+                return
+            logger.info(f"📂 FAISS index loaded: {_index.ntotal} faces ({_kind_of(index)}, snapshot v{version})")
         except Exception as e:
-            logger.warning(f"⚠️ Failed to load FAISS index: {e}")
-            _index = faiss.IndexFlatIP(DIMENSION)
-            _metadata = {}
+            logger.warning(f"⚠️ Failed to load FAISS snapshot v{version}: {e}, rebuilding from stored embeddings")
+            rebuild_index()
+            if _index is None:
+                _index = _new_index()
+                _metadata = {}
     else:
-        logger.info("📂 No existing FAISS index found, will build on first face upload")
-        _index = faiss.IndexFlatIP(DIMENSION)
-        _metadata = {}
+        # Cheap: the index is built from embeddings already stored in the DB
+        # (vectors of a pre-snapshot faiss_index.bin are imported first)
+        logger.info("📂 No existing FAISS index found, building from stored embeddings")
+        rebuild_index()
+
+
+def search_batch(embeddings, threshold=0.5, k=1):
+    """
+    Search FAISS index for all faces of a frame in one call.
+
+    Args:
+        embeddings: sequence of 512-dim face embeddings (or an (n, 512) array)
+        threshold: minimum cosine similarity (0.0 - 1.0)
+        k: number of nearest vectors to return per face
+
+    Returns:
+        list with one entry per embedding: [(user_id, confidence, name), ...]
+        best match first, only hits above threshold (empty list if no match)
+    """
+    n = len(embeddings)
+    if n == 0:
+        return []
+    _maybe_reload()
+    if _index is None or _index.ntotal == 0:
+        return [[] for _ in range(n)]
+
+    embs = np.asarray(embeddings, dtype='float32').reshape(n, -1)
+    embs = embs / np.linalg.norm(embs, axis=1, keepdims=True)
+
+    with _index_lock:
+        scores, indices = _index.search(embs, k, params=_search_params())
+        metadata = _metadata
+
+    results = []
+    for row_scores, row_indices in zip(scores.tolist(), indices.tolist()):
+        matches = []
+        for score, idx in zip(row_scores, row_indices):
+            if score <= threshold or idx < 0:
+                continue
+            face_data = metadata.get(str(idx), {})
+            user_id = face_data.get("user_id")
+            if user_id is not None:
+                matches.append((user_id, score, face_data.get("name", "Unknown")))
+                if len(matches) == k:
+                    break
+        results.append(matches)
+    return results
 
 
 def search(embedding, threshold=0.5):
@@ -155,24 +943,237 @@ def search(embedding, threshold=0.5):
     Returns:
         (user_id, confidence, name) or None if no match
     """
+    matches = search_batch([embedding], threshold)
+    return matches[0][0] if matches and matches[0] else None
+
+
+def _user_photo_counts(metadata):
+    """Photos per user in the index, recomputed only when metadata changes."""
+    global _photo_counts
+    key = (id(metadata), len(metadata))
+    if _photo_counts[0] != key:
+        counts = {}
+        for face_data in metadata.values():
+            user_id = face_data.get("user_id")
+            counts[user_id] = counts.get(user_id, 0) + 1
+        _photo_counts = (key, counts)
+    return _photo_counts[1]
+
+
+def search_users(embeddings, threshold=0.5, k=MATCH_TOP_K):
+    """
+    Per-user matching: retrieve the top-k vectors per face and score each user
+    by the mean of their best VOTE_TOP_N photo similarities, so one stray photo
+    of a user can't carry a match on its own. Photos of the user that didn't
+    make the top-k count as the lowest similarity retrieved.
+
+    Returns one entry per embedding: (user_id, score, name, margin) for the best
+    user if its score is above threshold, else None. margin is the lead over
+    the runner-up user (score itself if there is none).
+    """
+    n = len(embeddings)
+    if n == 0:
+        return []
+    _maybe_reload()
     if _index is None or _index.ntotal == 0:
-        return None
+        return [None] * n
+
+    embs = np.asarray(embeddings, dtype='float32').reshape(n, -1)
+    embs = embs / np.linalg.norm(embs, axis=1, keepdims=True)
+
+    with _index_lock:
+        scores, indices = _index.search(embs, min(k, _index.ntotal), params=_search_params())
+        metadata = _metadata
+        photo_counts = _user_photo_counts(metadata)
 
-    emb = embedding / np.linalg.norm(embedding)
-    emb = emb.astype('float32').reshape(1, -1)
+    results = []
+    for row_scores, row_indices in zip(scores.tolist(), indices.tolist()):
+        hits = {}
+        names = {}
+        floor = 0.0
+        for score, idx in zip(row_scores, row_indices):
+            if idx < 0:
+                continue
+            face_data = metadata.get(str(idx))
+            if not face_data or face_data.get("user_id") is None:
+                continue
+            user_id = face_data["user_id"]
+            hits.setdefault(user_id, []).append(score)
+            names[user_id] = face_data.get("name", "Unknown")
+            floor = score  # scores come sorted, so this ends as the lowest
+        if not hits:
+            results.append(None)
+            continue
+
+        user_scores = {}
+        for user_id, sims in hits.items():
+            top_n = min(VOTE_TOP_N, photo_counts.get(user_id, 1))
+            sims = sims[:top_n] + [floor] * max(0, top_n - len(sims))
+            user_scores[user_id] = sum(sims) / len(sims)
+
+        ranked = sorted(user_scores.items(), key=lambda item: item[1], reverse=True)
+        best_user, best_score = ranked[0]
+        if best_score <= threshold:
+            results.append(None)
+            continue
+        margin = best_score - ranked[1][1] if len(ranked) > 1 else best_score
+        results.append((best_user, best_score, names[best_user], margin))
+    return results
+
+
+def index_report(recall_sample=0, k=5, seed=0):
+    """
+    Describe the live index: type, size and serialized size. With
+    recall_sample > 0, also compare it against an exact flat index built from
+    the stored embeddings: recall@k, top-1 agreement (image and user) and
+    per-query latency of both, using recall_sample gallery vectors with a
+    little noise as probe faces.
+    """
+    import faiss
+    from app.core.database import SessionLocal
+    from app.models.face_image import UserFaceImage
+
+    if _index is None:
+        load_index()
+
+    with _index_lock:
+        index = _index
+        metadata = dict(_metadata)
+        report = {
+            "type": _kind_of(index),
+            "vectors": index.ntotal,
+            "live_vectors": index.ntotal - len(_dead_ids),
+            "tombstones": len(_dead_ids),
+            "index_bytes": len(faiss.serialize_index(index)),
+        }
+    if not recall_sample or index.ntotal == 0:
+        return report
+
+    db = SessionLocal()
+    try:
+        rows = db.query(UserFaceImage.id, UserFaceImage.embedding).filter(
+            UserFaceImage.embedding.isnot(None),
+        ).all()
+    finally:
+        db.close()
+    if not rows:
+        return report
+
+    vectors = np.vstack([_blob_to_embedding(r.embedding) for r in rows])
+    exact = faiss.IndexIDMap(faiss.IndexFlatIP(DIMENSION))
+    exact.add_with_ids(vectors, np.array([r.id for r in rows], dtype='int64'))
+
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(recall_sample, len(vectors)), replace=False)
+    queries = vectors[picks] + rng.normal(0, 0.02, size=(len(picks), DIMENSION)).astype('float32')
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    k = min(k, len(vectors))
+
+    t0 = time.perf_counter()
+    _, exact_ids = exact.search(queries, k)
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    with _index_lock:
+        t0 = time.perf_counter()
+        _, approx_ids = index.search(queries, k, params=_search_params())
+        approx_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+    def user_of(image_id):
+        return metadata.get(str(image_id), {}).get("user_id")
 
-    scores, indices = _index.search(emb, k=1)
-    score = float(scores[0][0])
-    idx = int(indices[0][0])
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx_ids.tolist(), exact_ids.tolist()))
+    report.update({
+        "recall_queries": len(queries),
+        "recall_at_k": round(hits / (len(queries) * k), 4),
+        "k": k,
+        "top1_agreement": round(float(np.mean(approx_ids[:, 0] == exact_ids[:, 0])), 4),
+        "top1_user_agreement": round(float(np.mean([
+            user_of(a) == user_of(e) for a, e in zip(approx_ids[:, 0].tolist(), exact_ids[:, 0].tolist())
+        ])), 4),
+        "search_ms_per_query": round(approx_ms, 4),
+        "exact_search_ms_per_query": round(exact_ms, 4),
+        "exact_index_bytes": len(faiss.serialize_index(exact)),
+    })
+    return report
+
+
+def detect_faces(frame, det_size=None, min_height=0):
+    """
+    Two-stage detection for camera frames: run the detector at det_size px
+    (default: the 640 the model was prepared with), drop faces shorter than
+    min_height, and only then run the landmark / recognition models on the
+    survivors — aligned from the full-resolution frame, so a smaller det_size
+    cuts detector cost without costing recognition accuracy.
+    """
+    from insightface.app.common import Face
+
+    app = _get_face_app()
+    input_size = (det_size, det_size) if det_size else None
+    bboxes, kpss = app.det_model.detect(frame, input_size=input_size, max_num=0, metric='default')
+
+    faces = []
+    for i in range(bboxes.shape[0]):
+        bbox = bboxes[i, 0:4]
+        if bbox[3] - bbox[1] < min_height:
+            continue
+        face = Face(bbox=bbox, kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+        for taskname, model in app.models.items():
+            if taskname != 'detection':
+                model.get(frame, face)
+        faces.append(face)
+    return faces
+
+
+def warm_up():
+    """
+    Warm the process that owns face recognition: load the model, run one dummy
+    inference through the detector and the recognition model (first ONNX runs
+    are slow), and load the index. Durations are kept for get_readiness().
+    Concurrent callers wait for the first warm-up instead of repeating it.
+    """
+    with _warm_lock:
+        if _readiness["state"] == "ready":
+            return get_readiness()
+        _readiness.clear()
+        _readiness.update({"state": "warming", "started_at": datetime.utcnow().isoformat()})
+        try:
+            t0 = time.perf_counter()
+            app = _get_face_app()
+            t1 = time.perf_counter()
+            detect_faces(np.zeros((480, 640, 3), dtype=np.uint8))
+            recognition = app.models.get("recognition")
+            if recognition is not None:
+                recognition.get_feat(np.zeros((112, 112, 3), dtype=np.uint8))
+            t2 = time.perf_counter()
+            if _index is None:
+                load_index()
+            t3 = time.perf_counter()
+            _readiness.update({
+                "state": "ready",
+                "model_load_s": round(t1 - t0, 3),
+                "warmup_inference_s": round(t2 - t1, 3),
+                "index_load_s": round(t3 - t2, 3),
+                "ready_at": datetime.utcnow().isoformat(),
+            })
+            logger.info(
+                f"🔥 Face recognition warm: model {t1 - t0:.1f}s, "
+                f"first inference {t2 - t1:.1f}s, index {t3 - t2:.1f}s"
+            )
+        except Exception as e:
+            _readiness.update({"state": "failed", "error": str(e)})
+            logger.error(f"❌ Face recognition warm-up failed: {e}", exc_info=True)
+    return get_readiness()
 
-    if score > threshold and idx >= 0:
-        face_data = _metadata.get(str(idx), {})
-        user_id = face_data.get("user_id")
-        name = face_data.get("name", "Unknown")
-        if user_id is not None:
-            return user_id, score, name
 
-    return None
+def get_readiness():
+    """Model / index load state and warm-up durations."""
+    index = _index
+    return {
+        **_readiness,
+        "ready": _readiness.get("state") == "ready",
+        "model_loaded": _face_app is not None,
+        "index_loaded": index is not None,
+        "index_size": index.ntotal if index is not None else 0,
+    }
 
 
 def get_face_app():
@@ -0,0 +1,64 @@
+"""
+Client for the standalone face worker (app.face_worker).
+
+When FACE_WORKER_URL is configured, API processes don't load the ArcFace
+model or the FAISS index themselves — index updates, metrics and the
+camera test stream are forwarded to the face worker over HTTP.
+If it is not configured, everything runs in-process as before.
+"""
+
+import logging
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger("hr-api")
+
+
+def is_remote() -> bool:
+    return bool(settings.FACE_WORKER_URL)
+
+
+def _url(path: str) -> str:
+    return f"{settings.FACE_WORKER_URL.rstrip('/')}{path}"
+
+
+def post(path: str, timeout: float = 30, **kwargs):
+    """POST to the face worker; returns the JSON body or None on failure."""
+    try:
+        resp = httpx.post(_url(path), timeout=timeout, **kwargs)
+        resp.raise_for_status()
+        return resp.json()
+    except httpx.HTTPError as e:
+        logger.error(f"❌ Face worker POST {path} failed: {e}")
+        return None
+
+
+def get(path: str, timeout: float = 10, **kwargs):
+    """GET from the face worker; returns the JSON body or None on failure."""
+    try:
+        resp = httpx.get(_url(path), timeout=timeout, **kwargs)
+        resp.raise_for_status()
+        return resp.json()
+    except httpx.HTTPError as e:
+        logger.error(f"❌ Face worker GET {path} failed: {e}")
+        return None
+
+
+def probe(path: str, timeout: float = 5):
+    """GET a status endpoint; returns (status_code, JSON body), or (None, None) if unreachable."""
+    try:
+        resp = httpx.get(_url(path), timeout=timeout)
+        return resp.status_code, resp.json()
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"⚠️ Face worker {path} unreachable: {e}")
+        return None, None
+
+
+async def stream(path: str, params: dict):
+    """Proxy a streaming response (MJPEG) from the face worker."""
+    async with httpx.AsyncClient(timeout=None) as client:
+        async with client.stream("GET", _url(path), params=params) as resp:
+            async for chunk in resp.aiter_raw():
+                yield chunk
@@ -0,0 +1,220 @@
+"""
+Shared MJPEG broadcaster for the camera test stream.
+
+One thread per camera URL decodes, runs face detection/recognition and
+annotates each frame once; the encoded JPEG is fanned out to every viewer
+of that camera. Viewers are async generators fed through a one-slot queue,
+so a slow client skips frames instead of stalling the others, and no
+threadpool slot is held per viewer. The camera is closed IDLE_SHUTDOWN_SECONDS
+after its last viewer disconnects.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("hr-api")
+
+TARGET_FPS = 6
+IDLE_SHUTDOWN_SECONDS = 5.0  # keep the camera open briefly for reconnecting viewers
+JPEG_QUALITY = 70
+
+_broadcasters = {}  # rtsp_url -> _Broadcaster
+_registry_lock = threading.Lock()
+
+
+def _mjpeg_chunk(jpeg_bytes):
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + jpeg_bytes + b'\r\n')
+
+
+def _error_chunk(message):
+    err = np.zeros((360, 640, 3), dtype=np.uint8)
+    cv2.putText(err, message, (30, 180), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+    _, buf = cv2.imencode('.jpg', err)
+    return _mjpeg_chunk(buf.tobytes())
+
+
+def _annotate(frame, app):
+    """Draw face boxes, names and confidence / height labels onto a frame."""
+    from app.services.face_service import search_batch
+
+    faces = app.get(frame)
+
+    # Recognise all faces against FAISS index in one search
+    matches = iter(search_batch(
+        [f.embedding for f in faces if f.embedding is not None], threshold=0.3
+    ))
+
+    for face in faces:
+        face_matches = next(matches) if face.embedding is not None else []
+        x1, y1, x2, y2 = face.bbox.astype(int)
+        face_h = y2 - y1
+
+        name = "Unknown"
+        confidence = 0.0
+        if face_matches:
+            _uid, confidence, name = face_matches[0]
+
+        # Colours: green=known, orange=unknown
+        color = (0, 255, 0) if name != "Unknown" else (0, 165, 255)
+
+        # Bounding box
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+
+        # Name label above the box
+        cv2.putText(frame, name, (x1, y1 - 8),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.65, color, 2)
+
+        # Confidence | height label below the box
+        info_text = f"{confidence:.2f} | {face_h}px"
+        cv2.putText(frame, info_text, (x1, y2 + 18),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    return frame
+
+
+class _Subscriber:
+    """One viewer: a queue on the viewer's event loop holding only the latest frame."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def offer(self, chunk):
+        """Called from the broadcaster thread; None ends the stream."""
+        try:
+            self.loop.call_soon_threadsafe(self._put, chunk)
+        except RuntimeError:
+            pass  # viewer's loop already closed
+
+    def _put(self, chunk):
+        if chunk is not None:
+            while not self.queue.empty():
+                self.queue.get_nowait()  # drop stale frames the viewer hasn't sent yet
+        self.queue.put_nowait(chunk)
+
+
+class _Broadcaster:
+    """Decodes + annotates one camera for all of its viewers."""
+
+    def __init__(self, rtsp_url):
+        self.rtsp_url = rtsp_url
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._last_chunk = None
+        self._idle_since = time.time()
+        self.frames = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name="mjpeg-broadcast")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def add(self, sub):
+        with self._lock:
+            self._subscribers.add(sub)
+            if self._last_chunk is not None:
+                sub.offer(self._last_chunk)  # show something right away
+
+    def remove(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+            if not self._subscribers:
+                self._idle_since = time.time()
+
+    def viewers(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _publish(self, chunk):
+        with self._lock:
+            if chunk is not None:
+                self._last_chunk = chunk
+            for sub in self._subscribers:
+                sub.offer(chunk)
+
+    def _retire_if_idle(self):
+        """Unregister once idle long enough; atomic with _attach, so no viewer joins a retiring camera."""
+        with _registry_lock:
+            with self._lock:
+                idle = not self._subscribers and time.time() - self._idle_since > IDLE_SHUTDOWN_SECONDS
+            if idle and _broadcasters.get(self.rtsp_url) is self:
+                del _broadcasters[self.rtsp_url]
+            return idle
+
+    def _run(self):
+        from app.services.face_service import get_face_app
+
+        cap = cv2.VideoCapture(self.rtsp_url)
+        try:
+            if not cap.isOpened():
+                self._publish(_error_chunk("Cannot connect to RTSP stream"))
+                return
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            app = get_face_app()
+            interval = 1.0 / TARGET_FPS
+
+            while not self._retire_if_idle():
+                t0 = time.time()
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if self.viewers():
+                    frame = _annotate(frame, app)
+                    _, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                    self._publish(_mjpeg_chunk(buf.tobytes()))
+                    self.frames += 1
+
+                # Throttle to target FPS
+                elapsed = time.time() - t0
+                if elapsed < interval:
+                    time.sleep(interval - elapsed)
+        except Exception as e:
+            logger.error(f"❌ Test stream error for {self.rtsp_url}: {e}", exc_info=True)
+        finally:
+            cap.release()
+            with _registry_lock:
+                if _broadcasters.get(self.rtsp_url) is self:
+                    del _broadcasters[self.rtsp_url]
+            self._publish(None)  # end remaining viewers' streams
+            logger.info(f"📹 Test stream closed for {self.rtsp_url} ({self.frames} frames broadcast)")
+
+
+def _attach(rtsp_url, sub):
+    """Add a viewer to the camera's broadcaster, starting one if needed."""
+    with _registry_lock:
+        broadcaster = _broadcasters.get(rtsp_url)
+        if broadcaster is None:
+            broadcaster = _Broadcaster(rtsp_url)
+            _broadcasters[rtsp_url] = broadcaster
+            broadcaster.add(sub)
+            broadcaster.start()
+            logger.info(f"📹 Test stream opened for {rtsp_url}")
+        else:
+            broadcaster.add(sub)
+    return broadcaster
+
+
+async def stream(rtsp_url):
+    """Async MJPEG generator for one viewer of a camera (for StreamingResponse)."""
+    sub = _Subscriber(asyncio.get_running_loop())
+    broadcaster = _attach(rtsp_url, sub)
+    try:
+        while True:
+            chunk = await sub.queue.get()
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        broadcaster.remove(sub)
+
+
+def get_broadcast_metrics():
+    """Open test-stream cameras and their viewer counts."""
+    with _registry_lock:
+        broadcasters = list(_broadcasters.values())
+    return [{"viewers": b.viewers(), "frames": b.frames} for b in broadcasters]
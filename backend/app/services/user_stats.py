@@ -0,0 +1,283 @@
+"""
+Materialized per-user counters (the user_stats table).
+
+Counters such as check-ins, on-time check-ins, steps, PvP wins, thank-you
+cards, gold spent and Mana received are kept per user in three buckets:
+all-time ("all"), local month ("YYYY-MM") and local day ("YYYY-MM-DD").
+Badge quests, the Man of the Month leaderboards/rewards and party quests
+read these rows instead of scanning coin_logs / attendance.
+
+Maintenance is transactional: SessionLocal flush hooks turn every inserted,
+updated or deleted source row into counter deltas (old row values are read
+by primary key before the flush) and upsert them in the same transaction.
+rebuild() recomputes everything from the source tables with the same
+classifiers; it runs at startup when the table is empty and nightly to
+repair drift from writes made outside the ORM.
+"""
+
+import logging
+from datetime import datetime, date, timedelta
+
+from sqlalchemy import event, select, delete, case, text
+
+from app.core.database import SessionLocal
+from app.models.user_stats import UserStat
+from app.models.attendance import Attendance
+from app.models.fitbit import FitbitSteps
+from app.models.reward import CoinLog
+from app.models.pvp import PvpBattle
+from app.models.social import ThankYouCard, AnonymousPraise
+from app.services import coin_log_types  # noqa: F401  (the CoinLog classifier relies on log_type being set)
+
+logger = logging.getLogger("hr-api")
+
+ALL_TIME = "all"
+
+# Deductions that aren't the user's own spending (late/absent check-ins, penalties, admin adjustments)
+INVOLUNTARY_TYPES = ("check_in", "penalty", "admin")
+
+
+def _local_day(when) -> date:
+    return (when + timedelta(hours=7)).date() if isinstance(when, datetime) else when
+
+
+def _utc_start(day: date) -> datetime:
+    return datetime.combine(day, datetime.min.time()) - timedelta(hours=7)
+
+
+def month_period(local_day) -> str:
+    return local_day.strftime("%Y-%m")
+
+
+def day_period(local_day) -> str:
+    return local_day.strftime("%Y-%m-%d")
+
+
+# ── Classifiers: source row → [(user_id, metric, amount, when)] ──
+# `when` is a UTC datetime or a local date; rows may be ORM objects or Core rows.
+
+def _attendance(r):
+    if r.user_id is None or r.timestamp is None:
+        return []
+    out = [(r.user_id, "checkins", 1, r.timestamp)]
+    if r.status == "present":
+        seconds = r.timestamp.hour * 3600 + r.timestamp.minute * 60 + r.timestamp.second
+        out += [
+            (r.user_id, "on_time_checkins", 1, r.timestamp),
+            (r.user_id, "on_time_seconds", seconds, r.timestamp),  # for "earliest average" tie-breaks
+        ]
+    return out
+
+
+def _coin_log(r):
+    if r.user_id is None or r.created_at is None:
+        return []
+    amount = r.amount or 0
+    out = []
+    if r.log_type == "mana_gift" and amount > 0:
+        out += [
+            (r.user_id, "gifts_received", 1, r.created_at),
+            (r.user_id, "gift_amount_received", amount, r.created_at),
+        ]
+        if r.created_by is not None and "admin" not in r.created_by.lower():
+            out.append((r.user_id, "gift_amount_received_non_admin", amount, r.created_at))
+    if amount < 0:
+        out.append((r.user_id, "gold_spent", -amount, r.created_at))
+        if r.log_type not in INVOLUNTARY_TYPES:
+            out.append((r.user_id, "gold_spent_voluntary", -amount, r.created_at))
+    elif amount > 0:
+        out.append((r.user_id, "gold_earned", amount, r.created_at))
+    return out
+
+
+def _fitbit_steps(r):
+    if r.user_id is None or r.date is None:
+        return []
+    return [(r.user_id, "steps", r.steps or 0, r.date)]
+
+
+def _pvp_battle(r):
+    if r.created_at is None:
+        return []
+    out = [(uid, "pvp_battles", 1, r.created_at) for uid in (r.player_a_id, r.player_b_id) if uid is not None]
+    if r.winner_id is not None:
+        out.append((r.winner_id, "pvp_wins", 1, r.created_at))
+    return out
+
+
+def _thank_you(r):
+    if r.created_at is None:
+        return []
+    return [
+        (r.sender_id, "thank_you_sent", 1, r.created_at),
+        (r.recipient_id, "thank_you_received", 1, r.created_at),
+    ]
+
+
+def _anonymous_praise(r):
+    try:
+        day = date.fromisoformat(r.date_key)
+    except (TypeError, ValueError):
+        return []
+    return [
+        (r.sender_id, "praise_sent", 1, day),
+        (r.recipient_id, "praise_received", 1, day),
+    ]
+
+
+CLASSIFIERS = {
+    Attendance: _attendance,
+    CoinLog: _coin_log,
+    FitbitSteps: _fitbit_steps,
+    PvpBattle: _pvp_battle,
+    ThankYouCard: _thank_you,
+    AnonymousPraise: _anonymous_praise,
+}
+
+
+def _accumulate(totals: dict, contributions, sign: int = 1):
+    """Add contributions into {(user_id, period, metric): [value, first_at]} for all three buckets."""
+    for uid, metric, amount, when in contributions:
+        if uid is None:
+            continue
+        day = _local_day(when)
+        first_at = when if isinstance(when, datetime) else _utc_start(when)
+        for period in (ALL_TIME, month_period(day), day_period(day)):
+            entry = totals.setdefault((uid, period, metric), [0, first_at])
+            entry[0] += sign * amount
+            if first_at < entry[1]:
+                entry[1] = first_at
+
+
+def _upsert(conn, totals: dict):
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    table = UserStat.__table__
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "period", "metric"],
+        set_={
+            "value": table.c.value + stmt.excluded.value,
+            "first_at": case(
+                (table.c.first_at.is_(None), stmt.excluded.first_at),
+                (stmt.excluded.first_at < table.c.first_at, stmt.excluded.first_at),
+                else_=table.c.first_at,
+            ),
+        },
+    )
+    # Sorted so concurrent transactions lock rows in the same order
+    conn.execute(stmt, [
+        {"user_id": uid, "period": period, "metric": metric, "value": value, "first_at": first_at}
+        for (uid, period, metric), (value, first_at) in sorted(totals.items())
+        if value
+    ])
+
+
+# ── Flush hooks ───────────────────────────────────────
+
+@event.listens_for(SessionLocal, "before_flush")
+def _capture_old_rows(session, flush_context, instances):
+    """Subtract the pre-flush version of updated/deleted source rows."""
+    totals = session.info.setdefault("user_stats_deltas", {})
+    updated = session.info.setdefault("user_stats_updated", [])
+    changed = [o for o in session.dirty if type(o) in CLASSIFIERS and session.is_modified(o, include_collections=False)]
+    deleted = [o for o in session.deleted if type(o) in CLASSIFIERS]
+    conn = session.connection()
+    for obj in changed + deleted:
+        table = type(obj).__table__
+        old = conn.execute(select(table).where(table.c.id == obj.id)).first()
+        if old is not None:
+            _accumulate(totals, CLASSIFIERS[type(obj)](old), sign=-1)
+    updated.extend(changed)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _apply_deltas(session, flush_context):
+    """Add the post-flush version of inserted/updated rows and upsert all deltas."""
+    totals = session.info.pop("user_stats_deltas", {})
+    updated = session.info.pop("user_stats_updated", [])
+    for obj in list(session.new) + updated:
+        classify = CLASSIFIERS.get(type(obj))
+        if classify:
+            _accumulate(totals, classify(obj))
+    if any(value for value, _ in totals.values()):
+        _upsert(session.connection(), totals)
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _discard_deltas(session, previous_transaction):
+    session.info.pop("user_stats_deltas", None)
+    session.info.pop("user_stats_updated", None)
+
+
+# ── Rebuild ───────────────────────────────────────────
+
+def rebuild(db, only_if_empty: bool = False) -> bool:
+    """
+    Recompute user_stats from the source tables in one transaction.
+
+    On PostgreSQL the table is locked for the duration, so writers that
+    commit meanwhile apply their deltas after the rebuild. Returns whether
+    a rebuild ran.
+    """
+    conn = db.connection()
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("LOCK TABLE user_stats IN EXCLUSIVE MODE"))
+    if only_if_empty and db.query(UserStat.id).first() is not None:
+        db.rollback()
+        return False
+
+    started = datetime.utcnow()
+    totals = {}
+    for model, classify in CLASSIFIERS.items():
+        rows = conn.execution_options(yield_per=5000).execute(select(model.__table__))
+        for row in rows:
+            _accumulate(totals, classify(row))
+    conn.execute(delete(UserStat.__table__))
+    if totals:
+        _upsert(conn, totals)
+    db.commit()
+    logger.info(f"📊 user_stats rebuilt: {len(totals)} rows in {(datetime.utcnow() - started).total_seconds():.1f}s")
+    return True
+
+
+# ── Readers ───────────────────────────────────────────
+
+def get_values(db, metric: str, period: str = ALL_TIME, user_ids=None) -> dict:
+    """{user_id: value} for one metric and period (users without events are absent)."""
+    q = db.query(UserStat.user_id, UserStat.value).filter(UserStat.metric == metric, UserStat.period == period)
+    if user_ids is not None:
+        q = q.filter(UserStat.user_id.in_(list(user_ids)))
+    return {uid: int(value) for uid, value in q.all()}
+
+
+def get_value(db, metric: str, user_id: int, period: str = ALL_TIME) -> int:
+    return get_values(db, metric, period, [user_id]).get(user_id, 0)
+
+
+def top(db, metric: str, period: str, limit: int = 10) -> list:
+    """[(user_id, value)] with the highest positive values; ties go to whoever got there first."""
+    rows = (
+        db.query(UserStat.user_id, UserStat.value)
+        .filter(UserStat.metric == metric, UserStat.period == period, UserStat.value > 0)
+        .order_by(UserStat.value.desc(), UserStat.first_at.asc())
+        .limit(limit)
+        .all()
+    )
+    return [(uid, int(value)) for uid, value in rows]
+
+
+def range_total(db, metric: str, user_ids, start_day: date, end_day: date) -> int:
+    """Sum of a metric over local days start_day..end_day (inclusive) for a set of users."""
+    user_ids = list(user_ids)
+    if not user_ids or end_day < start_day:
+        return 0
+    days = [day_period(start_day + timedelta(days=i)) for i in range((end_day - start_day).days + 1)]
+    rows = db.query(UserStat.value).filter(
+        UserStat.metric == metric,
+        UserStat.user_id.in_(user_ids),
+        UserStat.period.in_(days),
+    ).all()
+    return int(sum(value for (value,) in rows))
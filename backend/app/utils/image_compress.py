@@ -11,6 +11,27 @@ MAX_DIMENSION = 800  # Max width or height in pixels
 QUALITY = 82         # WebP quality (0-100)
 
 
+def _resize_and_save(img, dest_dir: str, base_name: str, max_dim: int, quality: int) -> str:
+    """Resize a PIL image if larger than max_dim and save it as WebP. Returns the filename."""
+    # Resize if too large
+    w, h = img.size
+    if w > max_dim or h > max_dim:
+        ratio = min(max_dim / w, max_dim / h)
+        new_size = (int(w * ratio), int(h * ratio))
+        img = img.resize(new_size, Image.LANCZOS)
+        logger.info(f"🖼️ Resized {w}x{h} → {new_size[0]}x{new_size[1]}")
+
+    # Save as WebP
+    filename = f"{base_name}.webp"
+    filepath = os.path.join(dest_dir, filename)
+    img.save(filepath, "WEBP", quality=quality, optimize=True)
+
+    file_size_kb = os.path.getsize(filepath) / 1024
+    logger.info(f"🖼️ Compressed → {filename} ({file_size_kb:.0f} KB)")
+
+    return filename
+
+
 def compress_and_save(file_obj, dest_dir: str, base_name: str, max_dim: int = MAX_DIMENSION, quality: int = QUALITY) -> str:
     """
     Read an uploaded file, resize if larger than max_dim, save as compressed WebP.
@@ -27,23 +48,7 @@ def compress_and_save(file_obj, dest_dir: str, base_name: str, max_dim: int = MA
         elif img.mode != "RGB":
             img = img.convert("RGB")
 
-        # Resize if too large
-        w, h = img.size
-        if w > max_dim or h > max_dim:
-            ratio = min(max_dim / w, max_dim / h)
-            new_size = (int(w * ratio), int(h * ratio))
-            img = img.resize(new_size, Image.LANCZOS)
-            logger.info(f"🖼️ Resized {w}x{h} → {new_size[0]}x{new_size[1]}")
-
-        # Save as WebP
-        filename = f"{base_name}.webp"
-        filepath = os.path.join(dest_dir, filename)
-        img.save(filepath, "WEBP", quality=quality, optimize=True)
-
-        file_size_kb = os.path.getsize(filepath) / 1024
-        logger.info(f"🖼️ Compressed → {filename} ({file_size_kb:.0f} KB)")
-
-        return filename
+        return _resize_and_save(img, dest_dir, base_name, max_dim, quality)
 
     except Exception as e:
         logger.warning(f"🖼️ Compression failed, saving raw: {e}")
@@ -54,3 +59,13 @@ def compress_and_save(file_obj, dest_dir: str, base_name: str, max_dim: int = MA
         with open(filepath, "wb") as f:
             f.write(file_obj.read())
         return filename
+
+
+def save_bgr_array(pixels, dest_dir: str, base_name: str, max_dim: int = MAX_DIMENSION, quality: int = QUALITY) -> str:
+    """
+    Save an OpenCV (BGR, uint8) image array as compressed WebP — encoded once,
+    straight from memory. Returns the saved filename (with .webp extension).
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    img = Image.fromarray(pixels[:, :, ::-1].copy())  # BGR → RGB
+    return _resize_and_save(img, dest_dir, base_name, max_dim, quality)
@@ -0,0 +1,376 @@
+"""
+Benchmark the face check-in pipeline without a live camera.
+
+Replays local video files (a file path stands in for rtsp://) or synthetic
+frame sequences through the same code the RTSP worker uses — ROI / motion
+gate, detection, _is_frontal_face, search_batch and the face tracker in
+_CameraStream.process — and reports throughput, per-stage latency
+percentiles, memory and time-to-check-in per identity. Check-ins are
+recorded in memory; nothing is written to the database.
+
+Examples (inside the backend container, or any CPU Linux box with the
+backend requirements installed):
+
+    # gallery from a folder: <name>.jpg or <name>/<photo>.jpg
+    python scripts/bench_face_pipeline.py --gallery ./faces lobby.mp4 door.mp4
+
+    # synthetic: paste each gallery face onto a moving canvas, 300 frames
+    python scripts/bench_face_pipeline.py --gallery ./faces --synthetic 300
+
+    # use the deployed FAISS index instead of a gallery folder
+    python scripts/bench_face_pipeline.py --use-index lobby.mp4
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+STAGES = ("decode", "gate", "detect", "frontal", "search", "tracker", "total")
+
+_ORIGINALS = {}  # un-instrumented pipeline functions
+
+
+def _rss_mb():
+    """Peak resident set size of this process in MB (Linux reports KB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class _Timings:
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+
+    def add(self, stage, seconds):
+        self.samples[stage].append(seconds * 1000.0)
+
+    def summary(self):
+        out = {}
+        for stage, values in self.samples.items():
+            if not values:
+                continue
+            arr = np.asarray(values)
+            out[stage] = {
+                "count": len(values),
+                "mean_ms": round(float(arr.mean()), 2),
+                "p50_ms": round(float(np.percentile(arr, 50)), 2),
+                "p95_ms": round(float(np.percentile(arr, 95)), 2),
+                "p99_ms": round(float(np.percentile(arr, 99)), 2),
+            }
+        return out
+
+
+class _RecordingWriter:
+    """Stands in for the check-in writer: records when each identity fired."""
+
+    def __init__(self):
+        self.checkins = []
+        self.clock = None  # callable returning (media_time, wall_time)
+
+    def submit(self, user_id, confidence, snapshot):
+        media_time, wall_time = self.clock()
+        self.checkins.append({
+            "user_id": user_id,
+            "confidence": round(float(confidence), 3),
+            "media_time": media_time,
+            "wall_time": wall_time,
+        })
+
+
+def _gallery_images(gallery_dir):
+    """Yield (name, path) for <name>.jpg files and <name>/<photo>.jpg folders."""
+    for entry in sorted(os.listdir(gallery_dir)):
+        path = os.path.join(gallery_dir, entry)
+        if os.path.isdir(path):
+            for photo in sorted(os.listdir(path)):
+                if os.path.splitext(photo)[1].lower() in IMAGE_EXTENSIONS:
+                    yield entry, os.path.join(path, photo)
+        elif os.path.splitext(entry)[1].lower() in IMAGE_EXTENSIONS:
+            yield os.path.splitext(entry)[0], path
+
+
+def _load_gallery(gallery_dir):
+    """Build an in-memory index from a folder. Returns {user_id: name}."""
+    from app.services import face_service
+
+    index = face_service._new_index()
+    metadata = {}
+    names = {}
+    user_ids = {}
+    image_id = 0
+    for name, path in _gallery_images(gallery_dir):
+        result = face_service._embed_image(path)
+        if result is None:
+            continue
+        emb, _ = result
+        image_id += 1
+        user_id = user_ids.setdefault(name, len(user_ids) + 1)
+        index.add_with_ids(emb.reshape(1, -1), np.array([image_id], dtype="int64"))
+        metadata[str(image_id)] = {"user_id": user_id, "name": name, "image_path": path}
+        names[user_id] = name
+
+    face_service.RELOAD_CHECK_SECONDS = float("inf")  # keep this index, don't follow deployed snapshots
+    with face_service._index_lock:
+        face_service._index = index
+        face_service._metadata = metadata
+    print(f"🗂️  Gallery: {index.ntotal} photo(s) of {len(names)} identities from {gallery_dir}")
+    return names
+
+
+def _synthetic_frames(gallery_dir, n_frames, size=(1280, 720), fps=25.0):
+    """
+    Paste one gallery photo per identity onto a grey canvas, drifting across
+    the frame. Identities take turns, n_frames // identities frames each.
+    """
+    import cv2
+
+    faces = {}
+    for name, path in _gallery_images(gallery_dir):
+        if name not in faces:
+            img = cv2.imread(path)
+            if img is not None:
+                faces[name] = img
+    if not faces:
+        return
+    w, h = size
+    per_identity = max(1, n_frames // len(faces))
+    rng = np.random.default_rng(0)
+    frame_idx = 0
+    for name, face in faces.items():
+        scale = min(1.0, (h * 0.5) / face.shape[0])
+        face = cv2.resize(face, None, fx=scale, fy=scale)
+        fh, fw = face.shape[:2]
+        for i in range(per_identity):
+            canvas = np.full((h, w, 3), 96, dtype=np.uint8)
+            canvas += rng.integers(0, 8, size=canvas.shape, dtype=np.uint8)  # sensor noise
+            x = int((w - fw) * i / max(1, per_identity - 1))
+            y = (h - fh) // 2
+            canvas[y:y + fh, x:x + fw] = face
+            yield canvas, frame_idx / fps
+            frame_idx += 1
+
+
+def _video_frames(path):
+    """Decode a local video file as the RTSP capture would, with media timestamps."""
+    import cv2
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        print(f"❌ Cannot open {path}")
+        return
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    idx = 0
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            yield frame, idx / fps
+            idx += 1
+    finally:
+        cap.release()
+
+
+def _instrument(timings):
+    """Wrap the per-face stages called from _CameraStream.process with timers."""
+    from app.services import face_service
+    from app.services import face_checkin_worker as worker
+
+    original_frontal = _ORIGINALS.setdefault("frontal", worker._is_frontal_face)
+    original_search = _ORIGINALS.setdefault("search", face_service.search_batch)
+
+    def timed_frontal(face):
+        t0 = time.perf_counter()
+        try:
+            return original_frontal(face)
+        finally:
+            timings.add("frontal", time.perf_counter() - t0)
+
+    def timed_search(embeddings, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return original_search(embeddings, *args, **kwargs)
+        finally:
+            timings.add("search", time.perf_counter() - t0)
+
+    worker._is_frontal_face = timed_frontal
+    face_service.search_batch = timed_search
+
+
+def run_source(label, frames, settings, every_frame):
+    """Replay one frame source through a fresh _CameraStream."""
+    from app.services import face_service
+    from app.services import face_checkin_worker as worker
+
+    timings = _Timings()
+    _instrument(timings)
+    recorder = _RecordingWriter()
+    worker._get_checkin_writer = lambda: recorder
+    worker._queued_today = set()
+
+    stream = worker._CameraStream(0, None, worker._StreamMetrics(0, label), settings)
+    interval = 1.0 / worker.INFERENCE_FPS
+    next_due = 0.0
+    first_seen = {}
+    state = {"media_time": 0.0}
+    started = time.perf_counter()
+    recorder.clock = lambda: (state["media_time"], time.perf_counter() - started)
+
+    decoded = processed = skipped = faces_total = 0
+    t_decode = time.perf_counter()
+    for frame, media_time in frames:
+        timings.add("decode", time.perf_counter() - t_decode)
+        decoded += 1
+        state["media_time"] = media_time
+        # Sample like the live grabber + scheduler: INFERENCE_FPS of media time
+        if not every_frame and media_time < next_due:
+            t_decode = time.perf_counter()
+            continue
+        next_due = media_time + interval
+
+        t0 = time.perf_counter()
+        gated = stream.gate(frame)
+        t1 = time.perf_counter()
+        timings.add("gate", t1 - t0)
+        if gated is None:
+            skipped += 1
+            t_decode = time.perf_counter()
+            continue
+
+        faces = face_service.detect_faces(gated, stream.det_size, stream.min_height)
+        t2 = time.perf_counter()
+        timings.add("detect", t2 - t1)
+        faces_total += len(faces)
+
+        n_frontal, n_search = len(timings.samples["frontal"]), len(timings.samples["search"])
+        stream.process(gated, faces)
+        t3 = time.perf_counter()
+        inner = sum(timings.samples["frontal"][n_frontal:]) + sum(timings.samples["search"][n_search:])
+        timings.add("tracker", max(0.0, (t3 - t2) - inner / 1000.0))
+        timings.add("total", t3 - t0)
+        processed += 1
+
+        for user_id in stream.face_tracker:
+            first_seen.setdefault(user_id, media_time)
+        t_decode = time.perf_counter()
+
+    elapsed = time.perf_counter() - started
+    checkins = []
+    for c in recorder.checkins:
+        seen = first_seen.get(c["user_id"], c["media_time"])
+        checkins.append({**c, "time_to_checkin_s": round(c["media_time"] - seen, 3)})
+
+    return {
+        "source": label,
+        "frames_decoded": decoded,
+        "frames_processed": processed,
+        "frames_gated": skipped,
+        "faces_detected": faces_total,
+        "elapsed_s": round(elapsed, 3),
+        "decode_fps": round(decoded / elapsed, 1) if elapsed else 0.0,
+        "inference_fps": round(processed / elapsed, 1) if elapsed else 0.0,
+        "stages": timings.summary(),
+        "checkins": checkins,
+        "peak_rss_mb": round(_rss_mb(), 1),
+    }
+
+
+def _print_report(report, names):
+    print(f"\n📹 {report['source']}")
+    print(f"   frames: {report['frames_decoded']} decoded, {report['frames_processed']} processed, "
+          f"{report['frames_gated']} gated  |  faces: {report['faces_detected']}")
+    print(f"   throughput: {report['decode_fps']} decode fps, {report['inference_fps']} inference fps "
+          f"({report['elapsed_s']}s)  |  peak RSS {report['peak_rss_mb']} MB")
+    print(f"   {'stage':<8} {'n':>6} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8}  (ms)")
+    for stage in STAGES:
+        s = report["stages"].get(stage)
+        if s:
+            print(f"   {stage:<8} {s['count']:>6} {s['mean_ms']:>8} {s['p50_ms']:>8} {s['p95_ms']:>8} {s['p99_ms']:>8}")
+    if not report["checkins"]:
+        print("   check-ins: none")
+    for c in report["checkins"]:
+        name = names.get(c["user_id"], c["user_id"])
+        print(f"   ✅ {name}: checked in at {c['media_time']:.2f}s "
+              f"({c['time_to_checkin_s']:.2f}s after first match, confidence {c['confidence']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the face check-in pipeline on recorded video.")
+    parser.add_argument("videos", nargs="*", help="local video files (stand-ins for rtsp:// URLs)")
+    parser.add_argument("--gallery", help="folder of enrolled faces: <name>.jpg or <name>/<photo>.jpg")
+    parser.add_argument("--use-index", action="store_true", help="use the deployed FAISS index (needs DB/uploads)")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="N",
+                        help="also replay N synthetic frames built from the gallery")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--min-frames", type=int, default=20)
+    parser.add_argument("--min-height", type=int, default=60)
+    parser.add_argument("--match-mode", choices=("nearest", "vote"), default="nearest",
+                        help="nearest photo, or per-user top-k voting")
+    parser.add_argument("--roi", help="x1,y1,x2,y2 fractions, as in the camera settings")
+    parser.add_argument("--det-size", type=int, help="detector input size in px (default 640)")
+    parser.add_argument("--no-motion", action="store_true", help="disable the motion gate")
+    parser.add_argument("--every-frame", action="store_true",
+                        help="run inference on every decoded frame instead of INFERENCE_FPS sampling")
+    parser.add_argument("--json", help="write the full report to this file")
+    args = parser.parse_args()
+
+    if not args.videos and not args.synthetic:
+        parser.error("give at least one video file or --synthetic N")
+    if args.synthetic and not args.gallery:
+        parser.error("--synthetic needs --gallery")
+    if not args.gallery and not args.use_index:
+        parser.error("give --gallery DIR or --use-index")
+
+    from app.services import face_service
+
+    rss_start = _rss_mb()
+    t0 = time.perf_counter()
+    face_service.get_face_app()
+    model_load_s = time.perf_counter() - t0
+    rss_model = _rss_mb()
+    print(f"🧠 Model loaded in {model_load_s:.2f}s (RSS {rss_start:.0f} → {rss_model:.0f} MB)")
+
+    if args.gallery:
+        names = _load_gallery(args.gallery)
+    else:
+        face_service.load_index()
+        names = {m["user_id"]: m.get("name") for m in face_service._metadata.values()}
+        print(f"🗂️  FAISS index: {face_service._index.ntotal if face_service._index else 0} vector(s)")
+
+    settings = {
+        "threshold": args.threshold,
+        "min_frames": args.min_frames,
+        "min_height": args.min_height,
+        "roi": args.roi,
+        "motion": not args.no_motion,
+        "match_mode": args.match_mode,
+        "det_size": args.det_size,
+    }
+
+    reports = []
+    if args.synthetic:
+        frames = _synthetic_frames(args.gallery, args.synthetic)
+        reports.append(run_source(f"synthetic ({args.synthetic} frames)", frames, settings, args.every_frame))
+        _print_report(reports[-1], names)
+    for path in args.videos:
+        reports.append(run_source(path, _video_frames(path), settings, args.every_frame))
+        _print_report(reports[-1], names)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "model_load_s": round(model_load_s, 3),
+                "rss_after_model_mb": round(rss_model, 1),
+                "settings": settings,
+                "runs": reports,
+            }, f, indent=2)
+        print(f"\n💾 Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+/api/badge-quests/my-progress with an active quest, badge quest awards,
+bulk field resolvers against the per-user ones, and incremental evaluation
+awarding the same as a full sweep.
+
+Runs against a throwaway SQLite database:
+    python -m pytest -q test_badge_quest_progress.py
+"""
+import os
+import sys
+import tempfile
+
+# Point the app at a scratch database before anything imports app.core.database
+_DB_PATH = os.path.join(tempfile.mkdtemp(), "badge_quest_progress.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_PATH}"
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import importlib
+import pkgutil
+from datetime import date, datetime, timedelta
+
+import app.models as models
+
+for _mod in pkgutil.iter_modules(models.__path__):
+    importlib.import_module(f"app.models.{_mod.name}")
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app.core.database import Base, engine, SessionLocal
+from app.models.user import User
+from app.models.badge import Badge, UserBadge
+from app.models.badge_quest import BadgeQuest, BadgeQuestDirty
+from app.models.attendance import Attendance
+from app.models.reward import CoinLog, Reward, Redemption
+from app.models.leave import LeaveRequest
+from app.models.fitbit import FitbitSteps
+from app.models.pvp import PvpBattle
+from app.models.social import ThankYouCard, AnonymousPraise
+from app.services import badge_quest_evaluator
+from app.services import badge_quest_tracker  # noqa: F401  (records the dirty marks incremental runs drain)
+from app.api.endpoints.badge_quests import get_my_progress, _run_evaluation, run_incremental_evaluation
+
+
+def test_my_progress_with_active_quest():
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    try:
+        user = User(name="Quest", surname="Tester", email="quest@test.local", coins=7)
+        db.add(user)
+        db.add(BadgeQuest(condition_query="coins >= 5", is_active=True, reward_type="gold", reward_value=1))
+        db.add(BadgeQuest(condition_type="checkin_streak", threshold=3, is_active=True, reward_type="gold", reward_value=1))
+        db.commit()
+
+        result = get_my_progress(db=db, current_user=user)
+
+        assert len(result) == 2
+        by_query = {r["condition_query"]: r for r in result}
+        assert by_query["coins >= 5"]["progress"]["coins"] == 7
+        assert by_query["coins >= 5"]["completed"] is False
+        assert by_query[None]["progress"]["checkin_streak"] == 0
+    finally:
+        db.close()
+        Base.metadata.drop_all(engine)
+
+
+def test_badge_awarded_once():
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    try:
+        user = User(name="Badge", surname="Tester", email="badge@test.local", coins=7)
+        badge = Badge(name="Rich")
+        db.add_all([user, badge])
+        db.flush()
+        db.add(BadgeQuest(condition_query="coins >= 5", badge_id=badge.id, is_active=True, reward_type="badge"))
+        db.commit()
+
+        assert _run_evaluation(db)["awarded"] == 1
+        assert _run_evaluation(db)["awarded"] == 0
+        assert db.query(UserBadge).filter(UserBadge.user_id == user.id).count() == 1
+        assert db.query(BadgeQuestDirty).filter(
+            BadgeQuestDirty.user_id == user.id, BadgeQuestDirty.field == "badges_count"
+        ).count() >= 1
+
+        # The unique index backs the check for every other award path too
+        db.add(UserBadge(user_id=user.id, badge_id=badge.id))
+        with pytest.raises(IntegrityError):
+            db.commit()
+        db.rollback()
+    finally:
+        db.close()
+        Base.metadata.drop_all(engine)
+
+
+def _on_time(user_id, days_ago):
+    """An on-time check-in at 08:00 local, days_ago local days before today."""
+    today = (datetime.utcnow() + timedelta(hours=7)).date()
+    local = datetime.combine(today - timedelta(days=days_ago), datetime.min.time()) + timedelta(hours=8)
+    return Attendance(user_id=user_id, timestamp=local - timedelta(hours=7), status="present")
+
+
+def _mana_gift(user_id):
+    return CoinLog(user_id=user_id, amount=1, reason="🪽 Received Mana from Quest Tester", created_by="Quest Tester")
+
+
+def _award_scenario(db, evaluate):
+    """Two rounds of writes, each followed by evaluate(db); returns every award made."""
+    users = [User(name=f"U{i}", surname="Tester", email=f"u{i}@test.local", coins=coins)
+             for i, coins in enumerate((12, 16, 0, 0, 0))]
+    punctual, streak, rich, collector = badges = [Badge(name=n) for n in ("Punctual", "Streak", "Rich", "Collector")]
+    db.add_all(users + badges)
+    db.flush()
+    u1, u2, u3, u4, u5 = [u.id for u in users]
+    db.add_all([
+        BadgeQuest(condition_query="on_time_checkins >= 2", badge_id=punctual.id, reward_type="badge"),
+        BadgeQuest(condition_type="checkin_streak", threshold=3, badge_id=streak.id, reward_type="badge"),
+        BadgeQuest(condition_query="mana_received >= 1 AND coins >= 10", reward_type="gold", reward_value=5),
+        # Fed by other quests' rewards: gold → coins, badges → badges_count
+        BadgeQuest(condition_query="coins >= 20", badge_id=rich.id, reward_type="badge"),
+        BadgeQuest(condition_query="badges_count >= 2", badge_id=collector.id, reward_type="badge"),
+        BadgeQuest(condition_query="pvp_wins >= 1 OR thank_you_received >= 2", reward_type="str", reward_value=1),
+    ])
+    db.add_all([_on_time(u1, n) for n in (2, 1, 0)] + [_on_time(u3, 0), _mana_gift(u1), _mana_gift(u2)])
+    db.add(ThankYouCard(sender_id=u1, recipient_id=u5, week_key="2026-W01"))
+    db.commit()
+    evaluate(db)
+
+    db.add_all([_on_time(u3, 1), _on_time(u4, 5)])
+    db.add(PvpBattle(battle_date=datetime.utcnow().date(), player_a_id=u4, player_b_id=u5, winner_id=u4, status="resolved"))
+    db.add(ThankYouCard(sender_id=u2, recipient_id=u5, week_key="2026-W01"))
+    db.get(User, u4).coins = 25
+    db.delete(db.query(Attendance).filter(Attendance.user_id == u1).first())  # awards are never revoked
+    db.commit()
+    evaluate(db)
+
+    badge_names = {b.id: b.name for b in badges}
+    return (
+        {(uid, badge_names[bid]) for uid, bid in db.query(UserBadge.user_id, UserBadge.badge_id).all()}
+        | {(uid, reason) for uid, reason in db.query(CoinLog.user_id, CoinLog.reason).filter(CoinLog.log_type == "quest_reward").all()}
+    )
+
+
+def _full(db):
+    while _run_evaluation(db)["awarded"]:
+        pass
+
+
+def _incremental(db):
+    while db.query(BadgeQuestDirty.id).first() is not None:
+        run_incremental_evaluation(db)
+
+
+def test_incremental_evaluation_matches_full():
+    awards = {}
+    for name, evaluate in (("full", _full), ("incremental", _incremental)):
+        Base.metadata.create_all(engine)
+        db = SessionLocal()
+        try:
+            awards[name] = _award_scenario(db, evaluate)
+            if name == "incremental":
+                assert _run_evaluation(db)["awarded"] == 0  # nothing left for a sweep to find
+        finally:
+            db.close()
+            Base.metadata.drop_all(engine)
+
+    assert awards["incremental"] == awards["full"]
+    users_with = {}
+    for uid, award in awards["full"]:
+        users_with.setdefault(award, set()).add(uid)
+    assert users_with["Punctual"] == {1, 3}
+    assert users_with["Streak"] == {1}
+    assert users_with["Rich"] == {2, 4}
+    assert users_with["Collector"] == {1}
+    assert users_with["🎯 Quest #3 reward"] == {1, 2}
+    assert users_with["🎯 Quest #6 reward"] == {4, 5}
+
+
+def test_bulk_resolvers_match_per_user():
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    try:
+        _award_scenario(db, _full)
+        u1, u2, u3 = 1, 2, 3
+        db.get(User, u2).angel_coins = 4
+        db.get(User, u3).start_date = date(2020, 1, 1)
+        mug = Reward(name="Mug", point_cost=10)
+        db.add(mug)
+        db.flush()
+        db.add_all([
+            Redemption(user_id=u1, reward_id=mug.id, status="approved"),
+            Redemption(user_id=u1, reward_id=mug.id, status="rejected"),
+            Redemption(user_id=u2, reward_id=mug.id, status="pending"),
+            LeaveRequest(user_id=u1, leave_type="sick", status="approved", start_date=date(2026, 1, 5), end_date=date(2026, 1, 5)),
+            LeaveRequest(user_id=u2, leave_type="vacation", status="approved", start_date=date(2026, 1, 5), end_date=date(2026, 1, 6)),
+            LeaveRequest(user_id=u2, leave_type="business", status="approved", start_date=date(2026, 2, 2), end_date=date(2026, 2, 2)),
+            LeaveRequest(user_id=u3, leave_type="business", status="pending", start_date=date(2026, 2, 2), end_date=date(2026, 2, 2)),
+            FitbitSteps(user_id=u2, date=date(2026, 1, 5), steps=9000),
+            CoinLog(user_id=u2, amount=-1, reason="🪽 Sent 1 Mana as Mana to U0 Tester", created_by="U1 Tester"),
+            CoinLog(user_id=u1, amount=-2, reason="🙏 Revival Contribution for U2 Tester", created_by="U0 Tester"),
+            CoinLog(user_id=u3, amount=0, reason="💖 Revived by U0 Tester!", created_by="system"),
+            CoinLog(user_id=u3, amount=-5, reason="📜 Scroll of Luck — LUK +1 (now 11)", created_by="U2 Tester"),
+            CoinLog(user_id=u1, amount=-3, reason="🎰 Magic Lottery ticket", created_by="U0 Tester"),
+            AnonymousPraise(sender_id=u2, recipient_id=u3, message="Thanks", date_key="2026-01-05"),
+        ])
+        db.commit()
+
+        badge_quest_evaluator._item_fields_loaded = False  # register item_<id> for the reward added above
+        badge_quest_evaluator._ensure_item_fields(db)
+        fields = list(badge_quest_evaluator.FIELD_RESOLVERS)
+        assert f"item_{mug.id}" in fields
+        bulk = badge_quest_evaluator.resolve_fields_bulk(fields, db)
+        user_ids = [uid for (uid,) in db.query(User.id).all()]
+        for field in fields:
+            per_user = {uid: badge_quest_evaluator.FIELD_RESOLVERS[field](uid, db) for uid in user_ids}
+            assert {uid: bulk[field].get(uid, 0) for uid in user_ids} == per_user, field
+            assert any(per_user.values()), f"{field} is 0 for everyone"
+    finally:
+        db.close()
+        Base.metadata.drop_all(engine)
+
+
+if __name__ == "__main__":
+    test_my_progress_with_active_quest()
+    test_badge_awarded_once()
+    test_bulk_resolvers_match_per_user()
+    test_incremental_evaluation_matches_full()
+    print("badge quests OK")
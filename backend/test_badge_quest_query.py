@@ -0,0 +1,118 @@
+"""
+Badge quest query compiler: precedence, parentheses, malformed queries and
+per-user vs bulk evaluation.
+
+    python -m pytest -q test_badge_quest_query.py
+"""
+import itertools
+import os
+import random
+import sys
+import tempfile
+
+# Importing the models needs a database URL; point it at a scratch SQLite file
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'badge_quest_query.db')}")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from app.services.badge_quest_evaluator import compile_query, validate_query
+
+
+def _values(coins=0, base_str=0, base_def=0, base_luk=0):
+    return {"coins": coins, "base_str": base_str, "base_def": base_def, "base_luk": base_luk}
+
+
+def test_and_binds_tighter_than_or():
+    query = compile_query("coins >= 1 OR base_str >= 1 AND base_def >= 1")
+    assert query.tree == ("or", [
+        ("cond", "coins", ">=", 1),
+        ("and", [("cond", "base_str", ">=", 1), ("cond", "base_def", ">=", 1)]),
+    ])
+    # a OR (b AND c), not (a OR b) AND c
+    assert query.evaluate(_values(coins=1)) is True
+    assert query.evaluate(_values(base_str=1)) is False
+    assert query.evaluate(_values(base_str=1, base_def=1)) is True
+
+
+def test_chained_operators_flatten():
+    query = compile_query("coins > 0 AND base_str > 0 AND base_def > 0 OR base_luk > 0 OR coins == 7")
+    assert query.tree[0] == "or"
+    assert len(query.tree[1]) == 3
+    assert query.tree[1][0] == ("and", [
+        ("cond", "coins", ">", 0), ("cond", "base_str", ">", 0), ("cond", "base_def", ">", 0),
+    ])
+
+
+def test_parentheses_override_precedence():
+    query = compile_query("(coins >= 1 OR base_str >= 1) AND base_def >= 1")
+    assert query.tree == ("and", [
+        ("or", [("cond", "coins", ">=", 1), ("cond", "base_str", ">=", 1)]),
+        ("cond", "base_def", ">=", 1),
+    ])
+    assert query.evaluate(_values(coins=1)) is False
+    assert query.evaluate(_values(coins=1, base_def=1)) is True
+
+
+def test_nested_parentheses_and_lowercase_conjunctions():
+    query = compile_query("((coins >= 1)) and (base_str < 2 or (base_def != 0 and base_luk == 3))")
+    assert query.fields == ["coins", "base_str", "base_def", "base_luk"]
+    assert query.evaluate(_values(coins=1, base_str=5, base_def=1, base_luk=3)) is True
+    assert query.evaluate(_values(coins=1, base_str=5, base_def=1, base_luk=2)) is False
+    assert query.evaluate(_values(coins=0, base_str=0)) is False
+
+
+@pytest.mark.parametrize("query", [
+    "",
+    "   ",
+    "coins",
+    "coins >=",
+    "coins => 1",
+    "coins >= -1",
+    "coins >= 1 AND",
+    "AND coins >= 1",
+    "coins >= 1 OR OR base_str >= 1",
+    "coins >= 1 base_str >= 1",
+    "(coins >= 1",
+    "coins >= 1)",
+    "()",
+    "(coins >= 1 AND) base_str >= 1",
+    "no_such_field >= 1",
+])
+def test_malformed_queries_are_rejected(query):
+    with pytest.raises(ValueError):
+        compile_query(query)
+    result = validate_query(query)
+    assert result["valid"] is False
+    assert result["error"]
+
+
+QUERIES = [
+    "coins >= 3",
+    "coins >= 3 OR base_str < 2 AND base_def != 1",
+    "(coins >= 3 OR base_str < 2) AND base_def != 1",
+    "coins == 0 OR base_luk > 2 OR base_str <= 1 AND (base_def >= 2 OR coins < 1)",
+    "base_luk != 2 AND base_luk != 3",
+]
+
+
+@pytest.mark.parametrize("source", QUERIES)
+def test_evaluate_bulk_matches_evaluate(source):
+    query = compile_query(source)
+    rng = random.Random(source)
+    # Every combination of small values, plus users missing from some columns (count as 0)
+    users = list(itertools.product(range(4), repeat=len(query.fields)))
+    user_ids = list(range(1, len(users) + 1))
+    values = {field: {} for field in query.fields}
+    for uid, combo in zip(user_ids, users):
+        for field, value in zip(query.fields, combo):
+            if value or rng.random() < 0.5:
+                values[field][uid] = value
+    user_ids.append(len(user_ids) + 1)  # in no column at all
+
+    expected = [
+        uid for uid in user_ids
+        if query.evaluate({field: values[field].get(uid, 0) for field in query.fields})
+    ]
+    assert query.evaluate_bulk(user_ids, values) == expected
+    assert query.evaluate_bulk([], values) == []
@@ -0,0 +1,162 @@
+"""
+Check-in calendars: streaks across gaps and the UTC+7 day boundary, and the
+flush hooks matching a full rebuild() after inserts, updates, deletes and rollbacks.
+
+Runs against a throwaway SQLite database:
+    python -m pytest -q test_checkin_calendar.py
+"""
+import os
+import sys
+import tempfile
+
+# Point the app at a scratch database before anything imports app.core.database
+_DB_PATH = os.path.join(tempfile.mkdtemp(), "checkin_calendar.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_PATH}"
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import importlib
+import pkgutil
+from datetime import datetime, date, timedelta
+
+import app.models as models
+
+for _mod in pkgutil.iter_modules(models.__path__):
+    importlib.import_module(f"app.models.{_mod.name}")
+
+import pytest
+
+from app.core.database import Base, engine, SessionLocal
+from app.models.user import User
+from app.models.attendance import Attendance
+from app.models.checkin_calendar import CheckinCalendar
+from app.services import checkin_calendar
+
+TODAY = date(2026, 4, 10)  # local (UTC+7) day
+
+
+def _on(day: date, hour: int = 1, minute: int = 0) -> datetime:
+    """UTC timestamp on a UTC calendar day."""
+    return datetime(day.year, day.month, day.day, hour, minute)
+
+
+def _calendars(db):
+    """{user_id: (local days, run_start, run_end, longest, longest_end)} for users with any day."""
+    db.expire_all()
+    out = {}
+    for cal in db.query(CheckinCalendar).all():
+        bits = checkin_calendar._decode(cal.days)
+        days = frozenset(cal.first_day + timedelta(days=i) for i in range(bits.bit_length()) if bits >> i & 1)
+        if days:
+            out[cal.user_id] = (days, cal.run_start, cal.run_end, cal.longest, cal.longest_end)
+    return out
+
+
+def _assert_matches_rebuild(db):
+    maintained = _calendars(db)
+    checkin_calendar.rebuild(db)
+    assert maintained == _calendars(db)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(checkin_calendar, "_today", lambda: TODAY)
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(engine)
+
+
+def _users(db, *names):
+    users = [User(name=name, surname="Tester", email=f"{name.lower()}@test.local") for name in names]
+    db.add_all(users)
+    db.commit()
+    return [u.id for u in users]
+
+
+def test_streaks_across_gap_and_day_boundary(db):
+    gap, edge, late, lapsed = _users(db, "Gap", "Edge", "Late", "Lapsed")
+    db.add_all(
+        # 4 days, a missed day, then 2 days up to today
+        [Attendance(user_id=gap, timestamp=_on(TODAY - timedelta(days=n)), status="present") for n in (6, 5, 4, 3, 1, 0)]
+        + [
+            # 16:59 UTC is 23:59 local the same day; 17:00 UTC and later is the next local day,
+            # so these three are three consecutive local days ending today
+            Attendance(user_id=edge, timestamp=_on(TODAY - timedelta(days=2), 16, 59), status="present"),
+            Attendance(user_id=edge, timestamp=_on(TODAY - timedelta(days=2), 17, 0), status="present"),
+            Attendance(user_id=edge, timestamp=_on(TODAY - timedelta(days=1), 17, 30), status="present"),
+            # Only on-time check-ins count
+            Attendance(user_id=late, timestamp=_on(TODAY - timedelta(days=1)), status="present"),
+            Attendance(user_id=late, timestamp=_on(TODAY, 3), status="late"),
+            # A run that ended yesterday is not a current streak
+            Attendance(user_id=lapsed, timestamp=_on(TODAY - timedelta(days=2)), status="present"),
+            Attendance(user_id=lapsed, timestamp=_on(TODAY - timedelta(days=1)), status="present"),
+        ]
+    )
+    db.commit()
+
+    assert checkin_calendar.current_streaks(db) == {gap: 2, edge: 3}
+    assert checkin_calendar.longest_streaks(db) == {gap: 4, edge: 3, late: 1, lapsed: 2}
+    assert checkin_calendar.current_streaks(db, [gap, late]) == {gap: 2}
+    assert checkin_calendar.get_streak(db, gap) == {
+        "current": 2, "longest": 4, "longest_end": TODAY - timedelta(days=3), "last_on_time": TODAY,
+    }
+    _assert_matches_rebuild(db)
+
+    # Filling the gap joins the runs
+    db.add(Attendance(user_id=gap, timestamp=_on(TODAY - timedelta(days=2)), status="present"))
+    db.commit()
+    assert checkin_calendar.current_streaks(db, [gap]) == {gap: 7}
+    assert checkin_calendar.longest_streaks(db, [gap]) == {gap: 7}
+    _assert_matches_rebuild(db)
+
+
+def test_hooks_match_rebuild(db):
+    ann, bob = _users(db, "Ann", "Bob")
+    db.add_all([Attendance(user_id=ann, timestamp=_on(TODAY - timedelta(days=n)), status="present") for n in range(5)])
+    db.add_all([Attendance(user_id=bob, timestamp=_on(TODAY - timedelta(days=n)), status="present") for n in (9, 8, 1)])
+    db.commit()
+    _assert_matches_rebuild(db)
+
+    # Deleting the middle of a run splits it
+    db.delete(db.query(Attendance).filter(Attendance.user_id == ann, Attendance.timestamp == _on(TODAY - timedelta(days=2))).one())
+    db.commit()
+    assert checkin_calendar.current_streaks(db, [ann]) == {ann: 2}
+    assert checkin_calendar.longest_streaks(db, [ann]) == {ann: 2}
+    _assert_matches_rebuild(db)
+
+    # Updates: on-time → late clears a day, moving a check-in moves it (across the local boundary)
+    first = db.query(Attendance).filter(Attendance.user_id == bob, Attendance.timestamp == _on(TODAY - timedelta(days=9))).one()
+    first.status = "late"
+    moved = db.query(Attendance).filter(Attendance.user_id == bob, Attendance.timestamp == _on(TODAY - timedelta(days=1))).one()
+    moved.timestamp = _on(TODAY - timedelta(days=1), 18)  # local today
+    db.commit()
+    assert checkin_calendar.current_streaks(db, [bob]) == {bob: 1}
+    _assert_matches_rebuild(db)
+
+    # Deleting a user's only remaining days leaves no streak
+    for att in db.query(Attendance).filter(Attendance.user_id == bob).all():
+        db.delete(att)
+    db.commit()
+    assert checkin_calendar.longest_streaks(db, [bob]) == {}
+    _assert_matches_rebuild(db)
+
+    # A flushed-then-rolled-back write leaves no trace, and the next commit isn't skewed by it
+    before = _calendars(db)
+    db.add(Attendance(user_id=ann, timestamp=_on(TODAY - timedelta(days=2)), status="present"))
+    db.add(Attendance(user_id=bob, timestamp=_on(TODAY), status="present"))
+    db.flush()
+    assert checkin_calendar.current_streaks(db, [ann]) == {ann: 5}
+    db.rollback()
+    assert _calendars(db) == before
+
+    db.add(Attendance(user_id=bob, timestamp=_on(TODAY - timedelta(days=3)), status="present"))
+    db.commit()
+    assert checkin_calendar.longest_streaks(db, [ann, bob]) == {ann: 2, bob: 1}
+    _assert_matches_rebuild(db)
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,102 @@
+"""
+coin_log_types.classify_reason against the reason strings every CoinLog writer produces.
+
+    python -m pytest -q test_coin_log_types.py
+"""
+import os
+import sys
+import tempfile
+
+# Importing the models needs a database URL; point it at a scratch SQLite file
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'coin_log_types.db')}")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from app.services.coin_log_types import classify_reason, OTHER
+
+# (reason as written, log_type the writer sets) — one or more per CoinLog( writer
+WRITER_REASONS = [
+    # absent_check.py / scheduler.py auto absent penalty
+    ("Absent penalty (2026-03-04)", "penalty"),
+    # attendance.py check-in (GPS and face)
+    ("Absent (checked in >1hr late, Sick Leave day)", "check_in"),
+    ("Late Check-in (Vacation Leave day)", "check_in"),
+    ("Absent (checked in >1hr late)", "check_in"),
+    ("Late Check-in", "check_in"),
+    ("On-time Check-in", "check_in"),
+    # attendance.py / face_checkin_worker.py face check-in
+    ("Absent (face check-in >1hr late)", "check_in"),
+    ("Late (face check-in)", "check_in"),
+    ("On-time (face check-in)", "check_in"),
+    # work_requests.py approval
+    ("On-time (work request approved)", "check_in"),
+    ("Absent (remote request approved, >1hr late)", "check_in"),
+    ("Late (remote request approved)", "check_in"),
+    ("On-time (remote request approved)", "check_in"),
+    ("Work Request approved", "check_in"),
+    # badge_quests.py
+    ("🎯 Quest #12 reward", "quest_reward"),
+    # badge_shop.py
+    ('🏪 Badge Shop — purchased "Night Owl"', "badge_shop"),
+    # badges.py scrolls
+    ("📜 Scroll of Luck — LUK +1 (now 14)", "scroll_purchase"),
+    ("📜 Scroll of Strength — STR +1 (now 11)", "scroll_purchase"),
+    ("📜 Scroll of Defense — DEF +1 (now 12)", "scroll_purchase"),
+    # fitbit.py
+    ("🥾 Step reward — daily goal (10,000 steps)", "step_reward"),
+    # fortune_wheel.py
+    ("Fortune Wheel: Golden Wheel", "fortune_spin"),
+    ("Fortune Wheel Prize: 50 Gold", "fortune_prize"),
+    # leaves.py
+    ("Sick leave approved — refund for absent penalties (2026-03-02 to 2026-03-03)", "refund"),
+    ("Sick leave rejected — absent penalty (2026-03-02)", "penalty"),
+    # party_quest.py
+    ("🤝 Party Quest 'Spring Clean' — Team Red Wins! Gold +34 (Team Reward 100/3)", "party_quest"),
+    ("🤝 Party Quest 'Spring Clean' — Team Red Wins! Mana +4 (Team Reward 10/3)", "party_quest"),
+    # pvp.py
+    ("⚔️ PvP Match: Ann Lee vs Bob Ray | Winner: Ann Lee", "pvp"),
+    # rewards.py
+    ("Redeemed: Coffee voucher", "redemption"),
+    ("Refund: Coffee voucher redemption rejected", "refund"),
+    # social.py
+    ("⚡ Buff 🗡️ STR+2 → Bob Ray", "buff"),
+    # users.py revival, mana, admin
+    ("🙏 Revival Contribution for Bob Ray", "revival_contribution"),
+    ("🙏 Revival Prayer from Ann Lee", "revival_prayer"),
+    ("💖 Revived by Ann Lee, Cat Poe!", "revived"),
+    ("🪽 Angel Coins +5: monthly top-up", "admin"),
+    ("🪽 Sent 3 Mana as Gold to Bob Ray: thanks!", "mana_gift"),
+    ("🪽 Sent 3 Mana as Mana to Bob Ray", "mana_gift"),
+    ("🪽 Received Gold from Ann Lee: thanks!", "mana_gift"),
+    ("🪽 Received Mana from Ann Lee", "mana_gift"),
+    # scheduler.py
+    ("🪙 Auto Coin (MON)", "auto_coin"),
+    ("🪽 Auto Angel Coins (MON)", "auto_mana"),
+    ("🎰 Lucky Draw! Won 20 Gold (FRI)", "lucky_draw"),
+    ("🏆 MOTM March 2026: Most Punctual — Gold +100", "motm"),
+    ("🏆 MOTM March 2026: Most Punctual — Mana +10", "motm"),
+]
+
+# User-controlled text after a writer prefix must not change the type
+USER_TEXT_REASONS = [
+    ("Redeemed: MOTM mug", "redemption"),
+    ("Redeemed: Scroll of Fire", "redemption"),
+    ("Redeemed: Lucky Draw! ticket", "redemption"),
+    ("🪽 Received Gold from Bob: lucky draw thanks", "mana_gift"),
+    ("🪽 Sent 2 Mana as Gold to Ann: refund: for lunch", "mana_gift"),
+    ('🏪 Badge Shop — purchased "PvP Match: Champion"', "badge_shop"),
+    ("🤝 Party Quest 'Redeemed: Buff party' — Team A Wins! Gold +5 (Team Reward 10/2)", "party_quest"),
+    ("🪽 Angel Coins +5: late check-in bonus", "admin"),
+    ("Refund: Absent penalty (2026-01-01) redemption rejected", "refund"),
+]
+
+
+@pytest.mark.parametrize("reason,log_type", WRITER_REASONS + USER_TEXT_REASONS)
+def test_classify_reason(reason, log_type):
+    assert classify_reason(reason) == log_type
+
+
+@pytest.mark.parametrize("reason", [None, "", "Bonus for helping the team", "late night snack fund"])
+def test_free_text_is_other(reason):
+    assert classify_reason(reason) == OTHER
@@ -0,0 +1,231 @@
+"""
+FAISS index maintenance in app.services.face_service, with random vectors
+(no face model needed) in a scratch SQLite database and index directory.
+
+    python -m pytest -q test_face_index.py
+"""
+import os
+import sys
+import tempfile
+
+# Point the app at a scratch database before anything imports app.core.database
+_DB_PATH = os.path.join(tempfile.mkdtemp(), "face_index.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_PATH}"
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import importlib
+import pkgutil
+import subprocess
+import textwrap
+
+import numpy as np
+import pytest
+
+import app.models as models
+
+for _mod in pkgutil.iter_modules(models.__path__):
+    importlib.import_module(f"app.models.{_mod.name}")
+
+from app.core.config import settings
+from app.core.database import Base, engine, SessionLocal
+from app.models.face_image import UserFaceImage
+from app.services import face_service as fs
+
+GALLERY = 200
+
+
+def _unit(rng, n=1):
+    v = rng.normal(size=(n, fs.DIMENSION)).astype("float32")
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def gallery(tmp_path, monkeypatch):
+    """GALLERY embedded rows, one user each (user_id == row id), and an empty index directory."""
+    monkeypatch.setattr(fs, "FAISS_DIR", str(tmp_path))
+    monkeypatch.setattr(fs, "FAISS_CURRENT_PATH", str(tmp_path / "CURRENT"))
+    monkeypatch.setattr(fs, "FAISS_LEGACY_PATH", str(tmp_path / "faiss_index.bin"))
+    for name, value in (("_index", None), ("_metadata", {}), ("_index_version", None),
+                        ("_index_mmapped", False), ("_dead_ids", set()), ("_dead_search", None)):
+        monkeypatch.setattr(fs, name, value)
+
+    Base.metadata.create_all(engine)
+    rng = np.random.default_rng(7)
+    vectors = _unit(rng, GALLERY)
+    db = SessionLocal()
+    for i, vec in enumerate(vectors, start=1):
+        db.add(UserFaceImage(id=i, user_id=i, image_path=f"/uploads/face_images/{i}.jpg",
+                             embedding=fs._embedding_to_blob(vec), embedding_model=fs.EMBEDDING_MODEL))
+    db.commit()
+    db.close()
+    yield {i: vec for i, vec in enumerate(vectors, start=1)}
+    Base.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def hnsw(monkeypatch):
+    monkeypatch.setattr(fs, "APPROX_MIN_VECTORS", 10)
+    monkeypatch.setattr(settings, "FACE_INDEX_TYPE", "hnsw")
+    monkeypatch.setattr(settings, "FACE_INDEX_QUANTIZER", "")
+
+
+def _top_user(vec):
+    hits = fs.search_batch([vec], threshold=0.0, k=1)[0]
+    return hits[0][0] if hits else None
+
+
+def test_hnsw_tombstones_are_counted_by_id_and_never_returned(gallery, hnsw, monkeypatch):
+    monkeypatch.setattr(fs, "TOMBSTONE_REBUILD_RATIO", 1.0)  # keep the tombstones around
+    fs.rebuild_index()
+    assert fs._kind_of(fs._index) == "hnsw"
+
+    # A probe near photo 1, and 40 photos nearer to the probe than photo 1 is,
+    # all deleted afterwards: more than any fixed over-fetch would skip
+    rng = np.random.default_rng(1)
+    target = gallery[1] + rng.normal(0, 0.02, fs.DIMENSION).astype("float32")
+    target /= np.linalg.norm(target)
+    db = SessionLocal()
+    twins = []
+    for i in range(40):
+        vec = target + rng.normal(0, 0.002, fs.DIMENSION).astype("float32")
+        vec /= np.linalg.norm(vec)
+        face = UserFaceImage(user_id=1000 + i, image_path=f"/uploads/face_images/t{i}.jpg",
+                             embedding=fs._embedding_to_blob(vec), embedding_model=fs.EMBEDDING_MODEL)
+        db.add(face)
+        twins.append(face)
+    db.commit()
+    fs._add_vectors(twins, {})
+    assert _top_user(target) >= 1000
+
+    assert fs._remove_vectors([f.id for f in twins]) == 40
+    assert fs._remove_vectors([f.id for f in twins]) == 0  # removing again is not a second tombstone
+    assert len(fs._dead_ids) == 40
+    assert fs.index_report()["tombstones"] == 40
+    assert _top_user(target) == 1
+    db.close()
+
+
+def test_hnsw_readd_rebuilds_instead_of_resurrecting(gallery, hnsw):
+    fs.rebuild_index()
+    old = gallery[5]
+    new = _unit(np.random.default_rng(2))[0]
+
+    db = SessionLocal()
+    face = db.get(UserFaceImage, 5)
+    face.embedding = fs._embedding_to_blob(new)
+    db.commit()
+    fs._add_vectors([face], {})
+    db.close()
+
+    assert fs._index.ntotal == GALLERY  # rebuilt, not appended
+    assert not fs._dead_ids
+    assert _top_user(new) == 5
+    hits = fs.search_batch([old], threshold=0.9, k=5)[0]
+    assert all(user_id != 5 for user_id, _, _ in hits)
+
+
+def test_hnsw_tombstones_survive_reload(gallery, hnsw):
+    fs.rebuild_index()
+    fs._remove_vectors([3, 4])
+    version = fs._index_version
+
+    fs._index = None
+    fs._dead_ids.clear()
+    fs.load_index()
+    assert fs._index_version == version
+    assert fs._dead_ids == {3, 4}
+    assert _top_user(gallery[3]) != 3
+
+
+def _snapshot_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith(("index.v", "ids.v")))
+
+
+def test_snapshots_are_versioned_published_and_pruned(gallery, tmp_path):
+    fs.rebuild_index()
+    first = fs._index_version
+    assert fs._current_version() == first
+    assert _snapshot_files(tmp_path) == [f"ids.v{first}.npz", f"index.v{first}.faiss"]
+
+    index, metadata = fs._read_snapshot(first)
+    assert index.ntotal == GALLERY
+    assert metadata == {str(i): {"user_id": i, "name": fs._metadata[str(i)]["name"]} for i in gallery}
+
+    versions = [first]
+    for image_id in range(1, 6):
+        fs._remove_vectors([image_id])
+        assert fs._index_version > versions[-1]
+        versions.append(fs._index_version)
+    assert fs._current_version() == versions[-1]
+    kept = versions[-fs.SNAPSHOT_KEEP:]
+    assert _snapshot_files(tmp_path) == sorted(
+        [f"ids.v{v}.npz" for v in kept] + [f"index.v{v}.faiss" for v in kept]
+    )
+    assert fs._read_snapshot(versions[-1])[0].ntotal == GALLERY - 5
+
+
+def test_failed_save_leaves_current_snapshot(gallery, tmp_path, monkeypatch):
+    fs.rebuild_index()
+    published = fs._current_version()
+
+    def crash(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(np, "savez", crash)  # the index file is written, the id map is not
+    with pytest.raises(OSError):
+        fs._remove_vectors([1])
+
+    assert fs._current_version() == published
+    assert not [name for name in os.listdir(tmp_path) if ".tmp" in name]
+    index, metadata = fs._read_snapshot(published)
+    assert index.ntotal == GALLERY and "1" in metadata
+
+
+READER = textwrap.dedent("""
+    import os, sys
+    os.environ["DATABASE_URL"] = sys.argv[1]
+    sys.path.insert(0, sys.argv[2])
+    from app.services import face_service as fs
+    fs.FAISS_DIR = sys.argv[3]
+    fs.FAISS_CURRENT_PATH = os.path.join(fs.FAISS_DIR, "CURRENT")
+    fs.FAISS_LEGACY_PATH = os.path.join(fs.FAISS_DIR, "faiss_index.bin")
+
+    def report():
+        print(fs._index_version, fs._index.ntotal, fs._index_mmapped, "1" in fs._metadata, flush=True)
+
+    fs.load_index()
+    report()
+    for _ in sys.stdin:
+        fs._maybe_reload(force=True)
+        report()
+""")
+
+
+def test_reader_process_reloads_newer_snapshot(gallery, tmp_path):
+    fs.rebuild_index()
+    reader = subprocess.Popen(
+        [sys.executable, "-c", READER, os.environ["DATABASE_URL"], os.path.dirname(os.path.abspath(__file__)), str(tmp_path)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        def reader_state():
+            version, ntotal, mmapped, has_first = reader.stdout.readline().split()
+            return int(version), int(ntotal), mmapped == "True", has_first == "True"
+
+        assert reader_state() == (fs._index_version, GALLERY, True, True)
+
+        # Nothing new: the reader keeps its mapped snapshot
+        reader.stdin.write("\n")
+        reader.stdin.flush()
+        assert reader_state() == (fs._index_version, GALLERY, True, True)
+
+        # Published by this (writer) process, past the prune window of the reader's version
+        for image_id in range(1, fs.SNAPSHOT_KEEP + 2):
+            fs._remove_vectors([image_id])
+        reader.stdin.write("\n")
+        reader.stdin.flush()
+        assert reader_state() == (fs._index_version, GALLERY - fs.SNAPSHOT_KEEP - 1, True, False)
+    finally:
+        reader.stdin.close()
+        reader.wait(timeout=30)
+    assert reader.returncode == 0
@@ -0,0 +1,128 @@
+"""
+user_stats rollup: the values the flush hooks maintain match a full rebuild()
+after inserts, updates, deletes and rollbacks.
+
+Runs against a throwaway SQLite database:
+    python -m pytest -q test_user_stats.py
+"""
+import os
+import sys
+import tempfile
+
+# Point the app at a scratch database before anything imports app.core.database
+_DB_PATH = os.path.join(tempfile.mkdtemp(), "user_stats.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_PATH}"
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import importlib
+import pkgutil
+from datetime import datetime, date
+
+import app.models as models
+
+for _mod in pkgutil.iter_modules(models.__path__):
+    importlib.import_module(f"app.models.{_mod.name}")
+
+from app.core.database import Base, engine, SessionLocal
+from app.models.user import User
+from app.models.user_stats import UserStat
+from app.models.attendance import Attendance
+from app.models.fitbit import FitbitSteps
+from app.models.reward import CoinLog
+from app.models.pvp import PvpBattle
+from app.models.social import ThankYouCard, AnonymousPraise
+from app.services import user_stats
+
+
+def _snapshot(db, with_first_at=False):
+    """{(user_id, period, metric): value} for non-zero rows (the hooks leave zeroed rows behind)."""
+    db.expire_all()
+    return {
+        (r.user_id, r.period, r.metric): (r.value, r.first_at) if with_first_at else r.value
+        for r in db.query(UserStat).all()
+        if r.value
+    }
+
+
+def _assert_matches_rebuild(db, with_first_at=False):
+    maintained = _snapshot(db, with_first_at)
+    user_stats.rebuild(db)
+    assert maintained == _snapshot(db, with_first_at)
+
+
+def test_hooks_match_rebuild():
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    try:
+        ann = User(name="Ann", surname="Lee", email="ann@test.local")
+        bob = User(name="Bob", surname="Ray", email="bob@test.local")
+        db.add_all([ann, bob])
+        db.commit()
+
+        # Inserts across every source table, spanning a local day and month boundary
+        # (2026-03-31 17:30 UTC is 2026-04-01 00:30 local)
+        late_march = datetime(2026, 3, 31, 17, 30)
+        db.add_all([
+            Attendance(user_id=ann.id, timestamp=datetime(2026, 3, 31, 1, 50), status="present"),
+            Attendance(user_id=ann.id, timestamp=late_march, status="present"),
+            Attendance(user_id=bob.id, timestamp=datetime(2026, 4, 1, 2, 30), status="late"),
+            CoinLog(user_id=ann.id, amount=5, reason="🪽 Received Mana from Bob Ray", created_by="Bob Ray", created_at=late_march),
+            CoinLog(user_id=bob.id, amount=-5, reason="🪽 Sent 5 Mana as Mana to Ann Lee", created_by="Bob Ray", created_at=late_march),
+            CoinLog(user_id=bob.id, amount=-3, reason="Absent penalty (2026-03-31)", created_by="system", created_at=late_march),
+            CoinLog(user_id=ann.id, amount=-20, reason="Redeemed: Coffee voucher", created_by="Ann Lee", created_at=late_march),
+            FitbitSteps(user_id=ann.id, date=date(2026, 3, 31), steps=8000),
+            FitbitSteps(user_id=ann.id, date=date(2026, 4, 1), steps=12000),
+            PvpBattle(battle_date=date(2026, 4, 1), player_a_id=ann.id, player_b_id=bob.id,
+                      winner_id=ann.id, loser_id=bob.id, status="resolved", created_at=late_march),
+            ThankYouCard(sender_id=bob.id, recipient_id=ann.id, week_key="2026-W14", created_at=late_march),
+            AnonymousPraise(sender_id=ann.id, recipient_id=bob.id, message="Great demo", date_key="2026-04-01"),
+        ])
+        db.commit()
+        assert user_stats.get_value(db, "on_time_checkins", ann.id, "2026-03") == 1
+        assert user_stats.get_value(db, "on_time_checkins", ann.id, "2026-04-01") == 1
+        assert user_stats.get_value(db, "gold_spent_voluntary", bob.id) == 5
+        _assert_matches_rebuild(db, with_first_at=True)
+
+        # Updates move a row between buckets and metrics
+        attendance = db.query(Attendance).filter(Attendance.user_id == bob.id).one()
+        attendance.status = "present"
+        attendance.timestamp = datetime(2026, 4, 2, 1, 0)
+        steps = db.query(FitbitSteps).filter(FitbitSteps.date == date(2026, 4, 1)).one()
+        steps.steps = 15000
+        battle = db.query(PvpBattle).one()
+        battle.winner_id, battle.loser_id = bob.id, ann.id
+        db.commit()
+        assert user_stats.get_value(db, "pvp_wins", ann.id) == 0
+        assert user_stats.get_value(db, "pvp_wins", bob.id) == 1
+        _assert_matches_rebuild(db)
+
+        # Deletes
+        db.delete(db.query(ThankYouCard).one())
+        db.delete(db.query(Attendance).filter(Attendance.timestamp == late_march).one())
+        for log in db.query(CoinLog).filter(CoinLog.user_id == bob.id).all():
+            db.delete(log)
+        db.commit()
+        assert user_stats.get_value(db, "thank_you_received", ann.id) == 0
+        _assert_matches_rebuild(db)
+
+        # A flushed-then-rolled-back write leaves no trace, and the next commit isn't skewed by it
+        before = _snapshot(db)
+        db.add(Attendance(user_id=ann.id, timestamp=datetime(2026, 4, 3, 1, 0), status="present"))
+        db.delete(db.query(AnonymousPraise).one())
+        db.flush()
+        assert user_stats.get_value(db, "praise_sent", ann.id) == 0
+        db.rollback()
+        assert _snapshot(db) == before
+
+        db.add(FitbitSteps(user_id=bob.id, date=date(2026, 4, 3), steps=4000))
+        db.commit()
+        assert user_stats.get_value(db, "steps", bob.id, "2026-04") == 4000
+        _assert_matches_rebuild(db)
+    finally:
+        db.close()
+        Base.metadata.drop_all(engine)
+
+
+if __name__ == "__main__":
+    test_hooks_match_rebuild()
+    print("user_stats OK")
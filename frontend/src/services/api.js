@@ -104,6 +104,8 @@ export const getDepartments = () => api.get('/api/users/departments/list')
 export const getUserAttendance = (id) => api.get(`/api/users/${id}/attendance`)
 export const getUserLeaves = (id) => api.get(`/api/users/${id}/leaves`)
 export const getUserRedemptions = (id) => api.get(`/api/users/${id}/redemptions`)
+export const getUserCheckinStreak = (id) => api.get(`/api/users/${id}/checkin-streak`)
+export const getCheckinStreakLeaderboard = (limit = 10) => api.get('/api/users/checkin-streaks', { params: { limit } })
 
 // === User Face Images ===
 export const getUserFaceImages = (userId) => api.get(`/api/users/${userId}/face-images`)
@@ -115,6 +117,9 @@ export const uploadUserFaceImage = (userId, file) => {
     })
 }
 export const deleteUserFaceImage = (userId, imageId) => api.delete(`/api/users/${userId}/face-images/${imageId}`)
+export const rebuildFaceIndex = () => api.post('/api/users/face-index/rebuild')
+export const getFaceIndexStats = (recallSample = 0) => api.get('/api/users/face-index/stats', { params: { recall_sample: recallSample } })
+export const bulkUploadFaceImages = (formData) => api.post('/api/users/face-images/bulk', formData, { headers: { 'Content-Type': 'multipart/form-data' } })
 
 // === Approval Flows ===
 export const getApprovalFlows = () => api.get('/api/approval-flows/')